@@ -1,639 +1,4222 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-"""
-Sistema de Gestión Misangeles - Aplicación Web
-Aplicación web completa para gestión de inventario y ventas
-"""
-
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, date
-import os
-import json
-from decimal import Decimal
-import openpyxl
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
-import io
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'misangeles2025'
-app.config['UPLOAD_FOLDER'] = 'static/img'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///misangeles.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
-
-# ===== MODELOS DE BASE DE DATOS =====
-
-class Configuracion(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    tasa_cambio = db.Column(db.Float, default=35.50)
-    iva_porcentaje = db.Column(db.Float, default=30.0)
-    fecha_dolar = db.Column(db.Date, default=date.today)
-    fecha_programa = db.Column(db.Date, default=date.today)
-    nombre_empresa = db.Column(db.String(100), default="Misangeles")
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'tasa_cambio': self.tasa_cambio,
-            'iva_porcentaje': self.iva_porcentaje,
-            'fecha_dolar': self.fecha_dolar.strftime('%Y-%m-%d') if self.fecha_dolar else None,
-            'fecha_programa': self.fecha_programa.strftime('%Y-%m-%d') if self.fecha_programa else None,
-            'nombre_empresa': self.nombre_empresa
-        }
-
-class Producto(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    codigo = db.Column(db.String(20), unique=True, nullable=False)
-    nombre = db.Column(db.String(100), nullable=False)
-    descripcion = db.Column(db.Text)
-    categoria = db.Column(db.String(50))
-    precio_detal_usd = db.Column(db.Float, nullable=False)
-    precio_mayor_usd = db.Column(db.Float, nullable=False)
-    equivalencia = db.Column(db.Integer, default=1)
-    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'codigo': self.codigo,
-            'nombre': self.nombre,
-            'descripcion': self.descripcion,
-            'categoria': self.categoria,
-            'precio_detal_usd': self.precio_detal_usd,
-            'precio_mayor_usd': self.precio_mayor_usd,
-            'equivalencia': self.equivalencia,
-            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S') if self.fecha_creacion else None
-        }
-
-class Entrada(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    fecha = db.Column(db.Date, default=date.today)
-    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
-    tipo_entrada = db.Column(db.String(10), nullable=False)  # 'Mayor' o 'Detal'
-    cantidad = db.Column(db.Float, nullable=False)
-    precio_unitario_usd = db.Column(db.Float, nullable=False)
-    total_usd = db.Column(db.Float, nullable=False)
-    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    producto = db.relationship('Producto', backref='entradas')
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'fecha': self.fecha.strftime('%Y-%m-%d') if self.fecha else None,
-            'producto_id': self.producto_id,
-            'producto_codigo': self.producto.codigo if self.producto else None,
-            'producto_nombre': self.producto.nombre if self.producto else None,
-            'tipo_entrada': self.tipo_entrada,
-            'cantidad': self.cantidad,
-            'precio_unitario_usd': self.precio_unitario_usd,
-            'total_usd': self.total_usd,
-            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S') if self.fecha_creacion else None
-        }
-
-class Venta(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    fecha = db.Column(db.Date, default=date.today)
-    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
-    tipo_venta = db.Column(db.String(10), nullable=False)  # 'Mayor' o 'Detal'
-    cantidad_mayor = db.Column(db.Float, default=0)
-    cantidad_detal = db.Column(db.Float, default=0)
-    precio_unitario_usd = db.Column(db.Float, nullable=False)
-    total_sin_iva_usd = db.Column(db.Float, nullable=False)
-    iva_usd = db.Column(db.Float, nullable=False)
-    total_con_iva_usd = db.Column(db.Float, nullable=False)
-    total_bs = db.Column(db.Float, nullable=False)
-    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    producto = db.relationship('Producto', backref='ventas')
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'fecha': self.fecha.strftime('%Y-%m-%d') if self.fecha else None,
-            'producto_id': self.producto_id,
-            'producto_codigo': self.producto.codigo if self.producto else None,
-            'producto_nombre': self.producto.nombre if self.producto else None,
-            'tipo_venta': self.tipo_venta,
-            'cantidad_mayor': self.cantidad_mayor,
-            'cantidad_detal': self.cantidad_detal,
-            'precio_unitario_usd': self.precio_unitario_usd,
-            'total_sin_iva_usd': self.total_sin_iva_usd,
-            'iva_usd': self.iva_usd,
-            'total_con_iva_usd': self.total_con_iva_usd,
-            'total_bs': self.total_bs,
-            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S') if self.fecha_creacion else None
-        }
-
-# ===== FUNCIONES AUXILIARES =====
-
-def calcular_iva(monto, porcentaje_iva):
-    """Calcula el IVA de un monto"""
-    return monto * (porcentaje_iva / 100)
-
-def convertir_usd_a_bs(monto_usd, tasa_cambio):
-    """Convierte USD a BS"""
-    return monto_usd * tasa_cambio
-
-def obtener_configuracion():
-    """Obtiene la configuración actual del sistema"""
-    config = Configuracion.query.first()
-    if not config:
-        config = Configuracion()
-        db.session.add(config)
-        db.session.commit()
-    return config
-
-def calcular_stock_producto(producto_id):
-    """Calcula el stock actual de un producto"""
-    # Obtener entradas
-    entradas_mayor = Entrada.query.filter_by(
-        producto_id=producto_id, 
-        tipo_entrada='Mayor'
-    ).with_entities(db.func.sum(Entrada.cantidad)).scalar() or 0
-    
-    entradas_detal = Entrada.query.filter_by(
-        producto_id=producto_id, 
-        tipo_entrada='Detal'
-    ).with_entities(db.func.sum(Entrada.cantidad)).scalar() or 0
-    
-    # Obtener ventas
-    ventas_mayor = Venta.query.filter_by(
-        producto_id=producto_id, 
-        tipo_venta='Mayor'
-    ).with_entities(db.func.sum(Venta.cantidad_mayor)).scalar() or 0
-    
-    ventas_detal = Venta.query.filter_by(
-        producto_id=producto_id, 
-        tipo_venta='Detal'
-    ).with_entities(db.func.sum(Venta.cantidad_detal)).scalar() or 0
-    
-    # Calcular stock
-    producto = Producto.query.get(producto_id)
-    if not producto:
-        return {'stock_mayor': 0, 'stock_unidades': 0, 'valor_usd': 0, 'valor_bs': 0}
-    
-    stock_mayor = entradas_mayor - ventas_mayor
-    stock_unidades = (entradas_mayor * producto.equivalencia + entradas_detal) - ventas_detal
-    
-    # Calcular valores
-    config = obtener_configuracion()
-    valor_usd = (stock_mayor * producto.precio_mayor_usd) + (stock_unidades * producto.precio_detal_usd)
-    valor_bs = valor_usd * config.tasa_cambio
-    
-    return {
-        'stock_mayor': stock_mayor,
-        'stock_unidades': stock_unidades,
-        'valor_usd': round(valor_usd, 2),
-        'valor_bs': round(valor_bs, 2)
-    }
-
-# ===== RUTAS DE LA APLICACIÓN =====
-
-@app.route('/')
-def dashboard():
-    """Pantalla principal del sistema"""
-    config = obtener_configuracion()
-    
-    # Obtener estadísticas del día
-    hoy = date.today()
-    ventas_hoy = Venta.query.filter_by(fecha=hoy).all()
-    total_ventas_usd = sum(v.total_con_iva_usd for v in ventas_hoy)
-    total_ventas_bs = sum(v.total_bs for v in ventas_hoy)
-    
-    # Obtener productos con stock
-    productos = Producto.query.all()
-    inventario = []
-    total_inventario_usd = 0
-    total_inventario_bs = 0
-    
-    for producto in productos:
-        stock = calcular_stock_producto(producto.id)
-        if stock['stock_mayor'] > 0 or stock['stock_unidades'] > 0:
-            inventario.append({
-                'producto': producto.to_dict(),
-                'stock': stock
-            })
-            total_inventario_usd += stock['valor_usd']
-            total_inventario_bs += stock['valor_bs']
-    
-    return render_template('dashboard.html',
-                         config=config.to_dict(),
-                         ventas_hoy=len(ventas_hoy),
-                         total_ventas_usd=round(total_ventas_usd, 2),
-                         total_ventas_bs=round(total_ventas_bs, 2),
-                         inventario=inventario,
-                         total_inventario_usd=round(total_inventario_usd, 2),
-                         total_inventario_bs=round(total_inventario_bs, 2))
-
-@app.route('/configuracion', methods=['GET', 'POST'])
-def configuracion():
-    """Gestión de configuración del sistema"""
-    if request.method == 'POST':
-        config = obtener_configuracion()
-        
-        # Actualizar configuración
-        config.tasa_cambio = float(request.form.get('tasa_cambio', 35.50))
-        config.iva_porcentaje = float(request.form.get('iva_porcentaje', 30.0))
-        config.nombre_empresa = request.form.get('nombre_empresa', 'Misangeles')
-        
-        db.session.commit()
-        flash('Configuración actualizada correctamente', 'success')
-        return redirect(url_for('configuracion'))
-    
-    config = obtener_configuracion()
-    
-    # Obtener URL del logo actual
-    logo_url = get_logo_url()
-    
-    return render_template('configuracion.html', config=config, logo_url=logo_url)
-
-@app.route('/productos')
-def productos():
-    """Lista de productos"""
-    productos = Producto.query.all()
-    return render_template('productos.html', productos=productos)
-
-@app.route('/productos/nuevo', methods=['GET', 'POST'])
-def nuevo_producto():
-    """Crear nuevo producto"""
-    if request.method == 'POST':
-        producto = Producto(
-            codigo=request.form['codigo'],
-            nombre=request.form['nombre'],
-            descripcion=request.form['descripcion'],
-            categoria=request.form['categoria'],
-            precio_detal_usd=float(request.form['precio_detal_usd']),
-            precio_mayor_usd=float(request.form['precio_mayor_usd']),
-            equivalencia=int(request.form['equivalencia'])
-        )
-        
-        db.session.add(producto)
-        db.session.commit()
-        flash('Producto creado correctamente', 'success')
-        return redirect(url_for('productos'))
-    
-    return render_template('nuevo_producto.html')
-
-@app.route('/entradas')
-def entradas():
-    """Lista de entradas de inventario"""
-    entradas = Entrada.query.order_by(Entrada.fecha.desc()).all()
-    
-    # Calcular estadísticas
-    hoy = date.today()
-    entradas_hoy = Entrada.query.filter_by(fecha=hoy).count()
-    total_usd = sum(e.total_usd for e in entradas)
-    config = obtener_configuracion()
-    total_bs = total_usd * config.tasa_cambio
-    
-    return render_template('entradas.html', 
-                         entradas=entradas,
-                         entradas_hoy=entradas_hoy,
-                         total_usd=total_usd,
-                         total_bs=total_bs)
-
-@app.route('/entradas/nueva', methods=['GET', 'POST'])
-def nueva_entrada():
-    """Crear nueva entrada de inventario"""
-    if request.method == 'POST':
-        producto = Producto.query.filter_by(codigo=request.form['codigo_producto']).first()
-        if not producto:
-            flash('Producto no encontrado', 'error')
-            return redirect(url_for('nueva_entrada'))
-        
-        tipo_entrada = request.form['tipo_entrada']
-        cantidad = float(request.form['cantidad'])
-        fecha_entrada = datetime.strptime(request.form['fecha'], '%Y-%m-%d').date()
-        
-        # Determinar precio según tipo
-        if tipo_entrada == 'Mayor':
-            precio_unitario = producto.precio_mayor_usd
-        else:
-            precio_unitario = producto.precio_detal_usd
-        
-        total_usd = cantidad * precio_unitario
-        
-        entrada = Entrada(
-            producto_id=producto.id,
-            tipo_entrada=tipo_entrada,
-            cantidad=cantidad,
-            precio_unitario_usd=precio_unitario,
-            total_usd=total_usd,
-            fecha=fecha_entrada
-        )
-        
-        db.session.add(entrada)
-        db.session.commit()
-        flash('Entrada registrada correctamente', 'success')
-        return redirect(url_for('entradas'))
-    
-    productos = Producto.query.all()
-    config = obtener_configuracion()
-    today = date.today()
-    
-    return render_template('nueva_entrada.html', 
-                         productos=productos,
-                         config=config.to_dict(),
-                         today=today)
-
-@app.route('/ventas')
-def ventas():
-    """Lista de ventas"""
-    ventas = Venta.query.order_by(Venta.fecha.desc()).all()
-    
-    # Calcular estadísticas
-    hoy = date.today()
-    ventas_hoy = Venta.query.filter_by(fecha=hoy).count()
-    total_usd = sum(v.total_con_iva_usd for v in ventas)
-    total_bs = sum(v.total_bs for v in ventas)
-    
-    return render_template('ventas.html', 
-                         ventas=ventas,
-                         ventas_hoy=ventas_hoy,
-                         total_usd=total_usd,
-                         total_bs=total_bs)
-
-@app.route('/ventas/nueva', methods=['GET', 'POST'])
-def nueva_venta():
-    """Registrar nueva venta"""
-    if request.method == 'POST':
-        try:
-            # Obtener datos del formulario
-            codigo = request.form['codigo']
-            fecha_venta = datetime.strptime(request.form['fecha'], '%Y-%m-%d').date()
-            tipo_venta = request.form['tipo_venta']
-            cantidad = float(request.form['cantidad'])
-            precio_unitario = float(request.form['precio_unitario'])
-            observaciones = request.form.get('observaciones', '')
-            
-            # Buscar producto
-            producto = Producto.query.filter_by(codigo=codigo).first()
-            if not producto:
-                flash('Producto no encontrado', 'danger')
-                return redirect(url_for('nueva_venta'))
-            
-            # Calcular totales
-            subtotal_usd = cantidad * precio_unitario
-            config = obtener_configuracion()
-            iva_usd = subtotal_usd * (config.iva_porcentaje / 100)
-            total_con_iva_usd = subtotal_usd + iva_usd
-            total_bs = total_con_iva_usd * config.tasa_cambio
-            
-            # Crear nueva venta
-            nueva_venta = Venta(
-                fecha=fecha_venta,
-                producto_id=producto.id,
-                tipo_venta=tipo_venta,
-                cantidad_mayor=cantidad if tipo_venta == 'Mayor' else 0,
-                cantidad_detal=cantidad if tipo_venta == 'Detal' else 0,
-                precio_unitario_usd=precio_unitario,
-                total_sin_iva_usd=subtotal_usd,
-                iva_usd=iva_usd,
-                total_con_iva_usd=total_con_iva_usd,
-                total_bs=total_bs
-            )
-            
-            db.session.add(nueva_venta)
-            db.session.commit()
-            
-            flash('Venta registrada exitosamente', 'success')
-            return redirect(url_for('ventas'))
-            
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al registrar la venta: {str(e)}', 'danger')
-            return redirect(url_for('nueva_venta'))
-    
-    productos = Producto.query.all()
-    config = obtener_configuracion()
-    today = date.today()
-    
-    return render_template('nueva_venta.html', 
-                         productos=productos,
-                         config=config.to_dict(),
-                         today=today)
-
-@app.route('/inventario')
-def inventario():
-    """Vista del inventario actual"""
-    productos = Producto.query.all()
-    inventario = []
-    total_inventario_usd = 0
-    total_inventario_bs = 0
-    
-    for producto in productos:
-        stock = calcular_stock_producto(producto.id)
-        if stock['stock_mayor'] > 0 or stock['stock_unidades'] > 0:
-            inventario.append({
-                'producto': producto.to_dict(),
-                'stock': stock
-            })
-            total_inventario_usd += stock['valor_usd']
-            total_inventario_bs += stock['valor_bs']
-    
-    return render_template('inventario.html', 
-                         inventario=inventario,
-                         total_inventario_usd=total_inventario_usd,
-                         total_inventario_bs=total_inventario_bs)
-
-@app.route('/reportes')
-def reportes():
-    """Página de reportes"""
-    # Obtener estadísticas básicas
-    total_productos = Producto.query.count()
-    
-    # Obtener ventas del mes actual
-    hoy = date.today()
-    inicio_mes = date(hoy.year, hoy.month, 1)
-    ventas_mes = Venta.query.filter(Venta.fecha >= inicio_mes).count()
-    
-    # Calcular totales de ventas del mes
-    ventas_mes_data = Venta.query.filter(Venta.fecha >= inicio_mes).all()
-    total_ventas_usd = sum(v.total_con_iva_usd for v in ventas_mes_data)
-    total_ventas_bs = sum(v.total_bs for v in ventas_mes_data)
-    
-    return render_template('reportes.html',
-                         total_productos=total_productos,
-                         ventas_mes=ventas_mes,
-                         total_ventas_usd=total_ventas_usd,
-                         total_ventas_bs=total_ventas_bs)
-
-@app.route('/exportar/excel')
-def exportar_excel():
-    """Exportar inventario a Excel"""
-    productos = Producto.query.all()
-    inventario = []
-    
-    for producto in productos:
-        stock = calcular_stock_producto(producto.id)
-        inventario.append({
-            'Código': producto.codigo,
-            'Nombre': producto.nombre,
-            'Descripción': producto.descripcion,
-            'Categoría': producto.categoria,
-            'Stock Mayor': stock['stock_mayor'],
-            'Stock Unidades': stock['stock_unidades'],
-            'Valor USD': stock['valor_usd'],
-            'Valor BS': stock['valor_bs']
-        })
-    
-    # Crear archivo Excel
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Inventario"
-    
-    # Encabezados
-    if inventario:
-        headers = list(inventario[0].keys())
-        for col, header in enumerate(headers, 1):
-            ws.cell(row=1, column=col, value=header)
-        
-        # Datos
-        for row, item in enumerate(inventario, 2):
-            for col, value in enumerate(item.values(), 1):
-                ws.cell(row=row, column=col, value=value)
-    
-    # Guardar en memoria
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f'inventario_misangeles_{date.today()}.xlsx'
-    )
-
-@app.route('/api/productos/<codigo>')
-def api_producto_por_codigo(codigo):
-    """API para buscar producto por código"""
-    producto = Producto.query.filter_by(codigo=codigo).first()
-    if producto:
-        return jsonify(producto.to_dict())
-    return jsonify({'error': 'Producto no encontrado'}), 404
-
-@app.route('/api/inventario')
-def api_inventario():
-    """API para obtener inventario completo"""
-    productos = Producto.query.all()
-    inventario = []
-    
-    for producto in productos:
-        stock = calcular_stock_producto(producto.id)
-        inventario.append({
-            'producto': producto.to_dict(),
-            'stock': stock
-        })
-    
-    return jsonify(inventario)
-
-@app.route('/subir_logo', methods=['POST'])
-def subir_logo():
-    try:
-        if 'logo' not in request.files:
-            return jsonify({'success': False, 'message': 'No se seleccionó ningún archivo'})
-        
-        file = request.files['logo']
-        if file.filename == '':
-            return jsonify({'success': False, 'message': 'No se seleccionó ningún archivo'})
-        
-        if file and allowed_file(file.filename):
-            # Guardar como logo.png (reemplaza el anterior)
-            filename = "logo.png"
-            filepath = os.path.join(app.root_path, 'static', 'img', filename)
-            
-            # Crear directorio si no existe
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            
-            # Guardar archivo
-            file.save(filepath)
-            
-            # Crear URL para el archivo
-            logo_url = url_for('static', filename=f'img/{filename}')
-            
-            return jsonify({
-                'success': True, 
-                'message': 'Logo subido correctamente',
-                'logo_url': logo_url
-            })
-        else:
-            return jsonify({'success': False, 'message': 'Formato de archivo no permitido'})
-            
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Error al subir logo: {str(e)}'})
-
-def allowed_file(filename):
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg'}
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def get_logo_url():
-    """Obtiene la URL del logo actual del sistema"""
-    logo_path = os.path.join(app.root_path, 'static', 'img', 'logo.png')
-    if os.path.exists(logo_path):
-        return url_for('static', filename='img/logo.png')
-    return url_for('static', filename='img/default-logo.png')
-
-# ===== INICIALIZACIÓN =====
-
-def inicializar_base_datos():
-    """Inicializa la base de datos con datos de ejemplo"""
-    with app.app_context():
-        db.create_all()
-        
-        # Crear configuración por defecto
-        if not Configuracion.query.first():
-            config = Configuracion()
-            db.session.add(config)
-            db.session.commit()
-        
-        # Crear productos de ejemplo
-        if not Producto.query.first():
-            productos_ejemplo = [
-                Producto(
-                    codigo='H001',
-                    nombre='Huevos',
-                    descripcion='Huevos de gallina frescos',
-                    categoria='Proteínas',
-                    precio_detal_usd=0.15,
-                    precio_mayor_usd=0.12,
-                    equivalencia=30
-                ),
-                Producto(
-                    codigo='A001',
-                    nombre='Arroz',
-                    descripcion='Arroz blanco premium',
-                    categoria='Granos',
-                    precio_detal_usd=2.50,
-                    precio_mayor_usd=2.00,
-                    equivalencia=25
-                ),
-                Producto(
-                    codigo='AC001',
-                    nombre='Aceite',
-                    descripcion='Aceite de cocina vegetal',
-                    categoria='Aceites',
-                    precio_detal_usd=3.00,
-                    precio_mayor_usd=2.40,
-                    equivalencia=12
-                )
-            ]
-            
-            for producto in productos_ejemplo:
-                db.session.add(producto)
-            
-            db.session.commit()
-
-if __name__ == '__main__':
-    inicializar_base_datos()
-    print("🚀 Sistema de Gestión Mis Angeles iniciado")
-    print("📱 Accede a: http://localhost:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sistema de Gestión Misangeles - Aplicación Web
+Aplicación web completa para gestión de inventario y ventas
+"""
+
+from flask import Flask, Blueprint, current_app, render_template, request, session, jsonify, redirect, url_for, flash, send_file, g, has_app_context, has_request_context, Response, stream_with_context, abort, make_response, before_render_template, template_rendered
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, func, inspect, table, column, literal_column
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import StaticPool
+from werkzeug.exceptions import RequestEntityTooLarge
+from datetime import datetime, date, timedelta
+import os
+import json
+import sqlite3
+from decimal import Decimal
+import io
+import gzip
+import csv
+import tempfile
+import hashlib
+import unicodedata
+import threading
+import queue
+import functools
+import contextlib
+import math
+import bisect
+import difflib
+import sys
+import time
+from collections import Counter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import click
+
+# ===== CONFIGURACIÓN =====
+
+def leer_sucursales(texto):
+    """'centro=centro.db,norte=sqlite:///norte.db' -> {'centro': 'sqlite:///centro.db', 'norte': ...}"""
+    sucursales = {}
+    for parte in texto.split(','):
+        if not parte.strip():
+            continue
+        clave, _, uri = parte.partition('=')
+        uri = uri.strip()
+        if not clave.strip() or not uri:
+            raise ValueError(f'Sucursal mal definida: {parte!r} (use clave=archivo.db)')
+        # Un nombre de archivo solo es una base SQLite dentro de instance/
+        sucursales[clave.strip()] = uri if '://' in uri else f'sqlite:///{uri}'
+    return sucursales
+
+class ConfiguracionBase:
+    SECRET_KEY = os.environ.get('MISANGELES_SECRET_KEY', 'misangeles2025')
+    UPLOAD_FOLDER = 'static/img'
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max
+    SQLALCHEMY_DATABASE_URI = os.environ.get('MISANGELES_DB_URI', 'sqlite:///misangeles.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': 3600
+    }
+    # PRAGMA aplicados a cada conexión de SQLite: WAL para que las lecturas no
+    # esperen a las escrituras, y espera de hasta 5 s cuando la base está ocupada
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'busy_timeout': 5000,
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY'
+    }
+    # Perfilador por muestreo: se activa con un umbral en ms; desactivado (0) en todos los
+    # perfiles salvo que se defina MISANGELES_PERFILAR_MS, y solo muestrea durante las peticiones
+    PERFILADOR_UMBRAL_MS = float(os.environ.get('MISANGELES_PERFILAR_MS', 0))
+    PERFILADOR_INTERVALO_MS = 5
+    # Conexiones de tablero en vivo por proceso: cada una ocupa un hilo mientras está abierta,
+    # por eso gunicorn.conf.py y wsgi.py reservan un hilo por conexión además de MISANGELES_HILOS
+    TABLERO_MAX_CLIENTES = int(os.environ.get('MISANGELES_TABLERO_CLIENTES', 50))
+    # Una base SQLite por sucursal (vacío = una sola tienda con SQLALCHEMY_DATABASE_URI)
+    SUCURSALES = leer_sucursales(os.environ.get('MISANGELES_SUCURSALES', ''))
+    # Ventas de un lote de sincronización que se registran por transacción
+    SINCRONIZACION_VENTAS_POR_TRAMO = 200
+    # Tamaño máximo del lote ya descomprimido
+    SINCRONIZACION_MAX_BYTES = 64 * 1024 * 1024
+
+class ConfiguracionDesarrollo(ConfiguracionBase):
+    DEBUG = True
+    TEMPLATES_AUTO_RELOAD = True
+
+class ConfiguracionProduccion(ConfiguracionBase):
+    DEBUG = False
+
+class ConfiguracionPruebas(ConfiguracionBase):
+    TESTING = True
+    # Base en memoria compartida por todos los hilos del proceso
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'poolclass': StaticPool,
+        'connect_args': {'check_same_thread': False}
+    }
+    SQLITE_PRAGMAS = {'foreign_keys': 'ON'}
+
+# Se elige con create_app(perfil) o con la variable MISANGELES_PERFIL
+PERFILES = {
+    'desarrollo': ConfiguracionDesarrollo,
+    'produccion': ConfiguracionProduccion,
+    'pruebas': ConfiguracionPruebas
+}
+
+# ===== SUCURSALES =====
+
+# Hilos para consultar las bases de todas las sucursales a la vez
+MAX_HILOS_SUCURSALES = 8
+
+_ejecutor_sucursales = ThreadPoolExecutor(max_workers=MAX_HILOS_SUCURSALES, thread_name_prefix='sucursales')
+
+def claves_sucursales():
+    """Sucursales configuradas, o [None] con una sola base"""
+    return list(current_app.config['SUCURSALES']) or [None]
+
+def sucursal_actual():
+    """Sucursal de la petición o del contexto en curso (None con una sola base)"""
+    if not has_app_context():
+        return None
+    sucursal = g.get('sucursal')
+    if sucursal is None and current_app.config['SUCURSALES']:
+        sucursal = next(iter(current_app.config['SUCURSALES']))
+    return sucursal
+
+def motor_sucursal():
+    """Motor de SQLAlchemy de la sucursal en curso"""
+    return db.engines[sucursal_actual()]
+
+@contextlib.contextmanager
+def contexto_sucursal(aplicacion, sucursal):
+    """Contexto de aplicación (con su propia sesión) que trabaja sobre la base de una sucursal"""
+    with aplicacion.app_context():
+        g.sucursal = sucursal
+        yield
+
+def en_todas_las_sucursales(funcion, *args):
+    """Ejecuta funcion en la base de cada sucursal, en paralelo, y devuelve {sucursal: resultado}"""
+    aplicacion = current_app._get_current_object()
+    
+    def ejecutar(sucursal):
+        with contexto_sucursal(aplicacion, sucursal):
+            return funcion(*args)
+    
+    futuros = {sucursal: _ejecutor_sucursales.submit(ejecutar, sucursal) for sucursal in claves_sucursales()}
+    return {sucursal: futuro.result() for sucursal, futuro in futuros.items()}
+
+class SesionSucursal(Session):
+    """Sesión que envía las consultas a la base de la sucursal en curso"""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            sucursal = sucursal_actual()
+            if sucursal is not None:
+                return self._db.engines[sucursal]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def _seleccionar_sucursal():
+    """Fija la sucursal de la petición: ?sucursal= (queda elegida), cabecera X-Sucursal o la elegida antes"""
+    sucursales = current_app.config['SUCURSALES']
+    if not sucursales:
+        return
+    pedida = request.args.get('sucursal') or request.headers.get('X-Sucursal')
+    if pedida:
+        if pedida not in sucursales:
+            abort(404)
+        if 'sucursal' in request.args:
+            session['sucursal'] = pedida
+        g.sucursal = pedida
+    elif session.get('sucursal') in sucursales:
+        g.sucursal = session['sucursal']
+
+db = SQLAlchemy(session_options={'class_': SesionSucursal})
+tienda = Blueprint('tienda', __name__, cli_group=None)
+
+def _configurador_sqlite(pragmas):
+    """Listener 'connect' que aplica los PRAGMA de rendimiento a cada conexión nueva de SQLite"""
+    def configurar(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        # SQLAlchemy emite los BEGIN (ver _iniciar_transaccion) en lugar de pysqlite
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {pragma} = {valor}')
+        cursor.close()
+    return configurar
+
+@event.listens_for(Engine, 'begin')
+def _iniciar_transaccion(conexion):
+    """Las peticiones que escriben toman el bloqueo de escritura desde el inicio"""
+    if conexion.dialect.name != 'sqlite':
+        return
+    # Con BEGIN IMMEDIATE dos cajeros no fallan al pasar de lectura a escritura:
+    # el segundo espera (busy_timeout) a que termine el primero. Los comandos que
+    # leen antes de escribir lo piden con g.transaccion_escritura
+    if (has_request_context() and request.method not in ('GET', 'HEAD', 'OPTIONS')) \
+            or (has_app_context() and g.get('transaccion_escritura')):
+        conexion.exec_driver_sql('BEGIN IMMEDIATE')
+    else:
+        conexion.exec_driver_sql('BEGIN')
+
+# ===== MODELOS DE BASE DE DATOS =====
+
+class Configuracion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    tasa_cambio = db.Column(db.Float, default=35.50)
+    iva_porcentaje = db.Column(db.Float, default=30.0)
+    fecha_dolar = db.Column(db.Date, default=date.today)
+    fecha_programa = db.Column(db.Date, default=date.today)
+    nombre_empresa = db.Column(db.String(100), default="Misangeles")
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tasa_cambio': self.tasa_cambio,
+            'iva_porcentaje': self.iva_porcentaje,
+            'fecha_dolar': self.fecha_dolar.strftime('%Y-%m-%d') if self.fecha_dolar else None,
+            'fecha_programa': self.fecha_programa.strftime('%Y-%m-%d') if self.fecha_programa else None,
+            'nombre_empresa': self.nombre_empresa
+        }
+
+class TasaCambio(db.Model):
+    """Tasa de cambio (Bs por USD) vigente desde una fecha hasta el siguiente registro"""
+    fecha = db.Column(db.Date, primary_key=True)
+    tasa = db.Column(db.Float, nullable=False)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'fecha': self.fecha.strftime('%Y-%m-%d'),
+            'tasa': self.tasa
+        }
+
+class Producto(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    codigo = db.Column(db.String(20), unique=True, nullable=False)
+    nombre = db.Column(db.String(100), nullable=False)
+    descripcion = db.Column(db.Text)
+    categoria = db.Column(db.String(50))
+    precio_detal_usd = db.Column(db.Float, nullable=False)
+    precio_mayor_usd = db.Column(db.Float, nullable=False)
+    equivalencia = db.Column(db.Integer, default=1)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_producto_categoria', 'categoria'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'codigo': self.codigo,
+            'nombre': self.nombre,
+            'descripcion': self.descripcion,
+            'categoria': self.categoria,
+            'precio_detal_usd': self.precio_detal_usd,
+            'precio_mayor_usd': self.precio_mayor_usd,
+            'equivalencia': self.equivalencia,
+            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S') if self.fecha_creacion else None
+        }
+
+class Entrada(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, default=date.today)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
+    tipo_entrada = db.Column(db.String(10), nullable=False)  # 'Mayor' o 'Detal'
+    cantidad = db.Column(db.Float, nullable=False)
+    precio_unitario_usd = db.Column(db.Float, nullable=False)
+    total_usd = db.Column(db.Float, nullable=False)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    producto = db.relationship('Producto', backref='entradas')
+    
+    __table_args__ = (
+        # Listados ordenados por fecha y filtros por rango de fechas
+        db.Index('ix_entrada_fecha_id', 'fecha', 'id'),
+        # Cubre la suma de cantidades por producto y tipo al recalcular el stock
+        db.Index('ix_entrada_producto_tipo', 'producto_id', 'tipo_entrada', 'cantidad'),
+        # Los ids no se reutilizan aunque las filas más nuevas pasen al archivo
+        {'sqlite_autoincrement': True},
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'fecha': self.fecha.strftime('%Y-%m-%d') if self.fecha else None,
+            'producto_id': self.producto_id,
+            'producto_codigo': self.producto.codigo if self.producto else None,
+            'producto_nombre': self.producto.nombre if self.producto else None,
+            'tipo_entrada': self.tipo_entrada,
+            'cantidad': self.cantidad,
+            'precio_unitario_usd': self.precio_unitario_usd,
+            'total_usd': self.total_usd,
+            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S') if self.fecha_creacion else None
+        }
+
+class Venta(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, default=date.today)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
+    tipo_venta = db.Column(db.String(10), nullable=False)  # 'Mayor' o 'Detal'
+    cantidad_mayor = db.Column(db.Float, default=0)
+    cantidad_detal = db.Column(db.Float, default=0)
+    precio_unitario_usd = db.Column(db.Float, nullable=False)
+    total_sin_iva_usd = db.Column(db.Float, nullable=False)
+    iva_usd = db.Column(db.Float, nullable=False)
+    total_con_iva_usd = db.Column(db.Float, nullable=False)
+    total_bs = db.Column(db.Float, nullable=False)
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'))
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    producto = db.relationship('Producto', backref='ventas')
+    
+    __table_args__ = (
+        # Listados ordenados por fecha, ventas del día y filtros por rango de fechas
+        db.Index('ix_venta_fecha_id', 'fecha', 'id'),
+        # Cubre la suma de cantidades por producto y tipo al recalcular el stock
+        db.Index('ix_venta_producto_tipo', 'producto_id', 'tipo_venta', 'cantidad_mayor', 'cantidad_detal'),
+        # Líneas de un ticket
+        db.Index('ix_venta_ticket', 'ticket_id'),
+        # Los ids no se reutilizan aunque las filas más nuevas pasen al archivo
+        {'sqlite_autoincrement': True},
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'fecha': self.fecha.strftime('%Y-%m-%d') if self.fecha else None,
+            'producto_id': self.producto_id,
+            'producto_codigo': self.producto.codigo if self.producto else None,
+            'producto_nombre': self.producto.nombre if self.producto else None,
+            'tipo_venta': self.tipo_venta,
+            'cantidad_mayor': self.cantidad_mayor,
+            'cantidad_detal': self.cantidad_detal,
+            'precio_unitario_usd': self.precio_unitario_usd,
+            'total_sin_iva_usd': self.total_sin_iva_usd,
+            'iva_usd': self.iva_usd,
+            'total_con_iva_usd': self.total_con_iva_usd,
+            'total_bs': self.total_bs,
+            'ticket_id': self.ticket_id,
+            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S') if self.fecha_creacion else None
+        }
+
+class Ticket(db.Model):
+    """Compra cobrada de una sola vez; cada línea es una fila de Venta"""
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, default=date.today)
+    cantidad_lineas = db.Column(db.Integer, nullable=False)
+    total_sin_iva_usd = db.Column(db.Float, nullable=False)
+    iva_usd = db.Column(db.Float, nullable=False)
+    total_con_iva_usd = db.Column(db.Float, nullable=False)
+    total_bs = db.Column(db.Float, nullable=False)
+    tasa_cambio = db.Column(db.Float, nullable=False)
+    iva_porcentaje = db.Column(db.Float, nullable=False)
+    observaciones = db.Column(db.Text)
+    # Generada por la caja; evita registrar dos veces una venta reenviada al sincronizar
+    clave_idempotencia = db.Column(db.String(64))
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    lineas = db.relationship('Venta', backref='ticket', order_by='Venta.id')
+    
+    __table_args__ = (
+        db.Index('ux_ticket_clave_idempotencia', 'clave_idempotencia', unique=True),
+    )
+    
+    def to_dict(self, incluir_lineas=False):
+        datos = {
+            'id': self.id,
+            'fecha': self.fecha.strftime('%Y-%m-%d') if self.fecha else None,
+            'cantidad_lineas': self.cantidad_lineas,
+            'total_sin_iva_usd': self.total_sin_iva_usd,
+            'iva_usd': self.iva_usd,
+            'total_con_iva_usd': self.total_con_iva_usd,
+            'total_bs': self.total_bs,
+            'tasa_cambio': self.tasa_cambio,
+            'iva_porcentaje': self.iva_porcentaje,
+            'observaciones': self.observaciones,
+            'clave_idempotencia': self.clave_idempotencia,
+            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S') if self.fecha_creacion else None
+        }
+        if incluir_lineas:
+            datos['lineas'] = [venta.to_dict() for venta in self.lineas]
+        return datos
+
+class StockProducto(db.Model):
+    """Saldo de stock por producto, actualizado con cada entrada y venta"""
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), primary_key=True)
+    stock_mayor = db.Column(db.Float, nullable=False, default=0)
+    stock_unidades = db.Column(db.Float, nullable=False, default=0)
+    
+    producto = db.relationship('Producto', backref=db.backref('saldo', uselist=False))
+    
+    def to_dict(self):
+        return {
+            'producto_id': self.producto_id,
+            'stock_mayor': self.stock_mayor,
+            'stock_unidades': self.stock_unidades
+        }
+
+class VentaDiaria(db.Model):
+    """Resumen diario de ventas por producto y tipo, actualizado con cada venta"""
+    fecha = db.Column(db.Date, primary_key=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), primary_key=True)
+    tipo_venta = db.Column(db.String(10), primary_key=True)
+    cantidad_ventas = db.Column(db.Integer, nullable=False, default=0)
+    cantidad_mayor = db.Column(db.Float, nullable=False, default=0)
+    cantidad_detal = db.Column(db.Float, nullable=False, default=0)
+    total_sin_iva_usd = db.Column(db.Float, nullable=False, default=0)
+    iva_usd = db.Column(db.Float, nullable=False, default=0)
+    total_con_iva_usd = db.Column(db.Float, nullable=False, default=0)
+    total_bs = db.Column(db.Float, nullable=False, default=0)
+
+class CierreInventario(db.Model):
+    """Cierre del inventario al final de un día, con la tasa de cambio vigente al tomarlo"""
+    fecha = db.Column(db.Date, primary_key=True)
+    periodo = db.Column(db.String(10), nullable=False, default='diario')  # 'diario' o 'mensual'
+    tasa_cambio = db.Column(db.Float, nullable=False)
+    total_usd = db.Column(db.Float, nullable=False, default=0)
+    total_bs = db.Column(db.Float, nullable=False, default=0)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CierreStock(db.Model):
+    """Stock y valoración de un producto en un cierre; los productos sin stock no tienen fila"""
+    fecha = db.Column(db.Date, primary_key=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), primary_key=True)
+    stock_mayor = db.Column(db.Float, nullable=False, default=0)
+    stock_unidades = db.Column(db.Float, nullable=False, default=0)
+    valor_usd = db.Column(db.Float, nullable=False, default=0)
+    valor_bs = db.Column(db.Float, nullable=False, default=0)
+
+class EventoTablero(db.Model):
+    """Cambio publicado para los tableros abiertos; se guarda en la misma transacción que lo produce"""
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    datos = db.Column(db.Text, nullable=False)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class VersionDatos(db.Model):
+    """Contadores de versión compartidos entre procesos para invalidar cachés"""
+    clave = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
+
+class ArchivoAnual(db.Model):
+    """Año cerrado cuyas entradas y ventas se movieron a las tablas entrada_AAAA y venta_AAAA"""
+    anio = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ventas = db.Column(db.Integer, nullable=False, default=0)
+    entradas = db.Column(db.Integer, nullable=False, default=0)
+    total_entradas_usd = db.Column(db.Float, nullable=False, default=0)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SaldoApertura(db.Model):
+    """Sumas de los movimientos archivados de un producto: el historial activo parte de ellas"""
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), primary_key=True)
+    entradas_mayor = db.Column(db.Float, nullable=False, default=0)
+    entradas_detal = db.Column(db.Float, nullable=False, default=0)
+    ventas_mayor = db.Column(db.Float, nullable=False, default=0)
+    ventas_detal = db.Column(db.Float, nullable=False, default=0)
+
+# ===== FUNCIONES AUXILIARES =====
+
+def calcular_iva(monto, porcentaje_iva):
+    """Calcula el IVA de un monto"""
+    return monto * (porcentaje_iva / 100)
+
+def convertir_usd_a_bs(monto_usd, tasa_cambio):
+    """Convierte USD a BS"""
+    return monto_usd * tasa_cambio
+
+def precio_segun_tipo(producto, tipo):
+    """Precio unitario del producto según se mueva al mayor o al detal"""
+    if tipo == 'Mayor':
+        return producto.precio_mayor_usd
+    return producto.precio_detal_usd
+
+def datos_entrada(producto, fecha, tipo_entrada, cantidad, precio_unitario=None):
+    """Valores de las columnas de una entrada; sin precio se usa el del producto"""
+    if precio_unitario is None:
+        precio_unitario = precio_segun_tipo(producto, tipo_entrada)
+    
+    return {
+        'producto_id': producto.id,
+        'tipo_entrada': tipo_entrada,
+        'cantidad': cantidad,
+        'precio_unitario_usd': precio_unitario,
+        'total_usd': cantidad * precio_unitario,
+        'fecha': fecha
+    }
+
+def datos_venta(producto_id, fecha, tipo_venta, cantidad, precio_unitario, config):
+    """Valores de las columnas de una venta con IVA y total en BS según la configuración"""
+    subtotal_usd = cantidad * precio_unitario
+    iva_usd = subtotal_usd * (config.iva_porcentaje / 100)
+    total_con_iva_usd = subtotal_usd + iva_usd
+    total_bs = total_con_iva_usd * config.tasa_cambio
+    
+    return {
+        'fecha': fecha,
+        'producto_id': producto_id,
+        'tipo_venta': tipo_venta,
+        'cantidad_mayor': cantidad if tipo_venta == 'Mayor' else 0,
+        'cantidad_detal': cantidad if tipo_venta == 'Detal' else 0,
+        'precio_unitario_usd': precio_unitario,
+        'total_sin_iva_usd': subtotal_usd,
+        'iva_usd': iva_usd,
+        'total_con_iva_usd': total_con_iva_usd,
+        'total_bs': total_bs
+    }
+
+def leer_version(clave):
+    """Devuelve el valor actual de un contador de versión (0 si nunca se incrementó)"""
+    return db.session.query(VersionDatos.valor).filter_by(clave=clave).scalar() or 0
+
+def incrementar_version(*claves):
+    """Incrementa contadores de versión dentro de la transacción en curso"""
+    if not claves:
+        return
+    # Una sola sentencia ejecutada con executemany para todas las claves
+    insercion = sqlite_insert(VersionDatos.__table__)
+    db.session.execute(insercion.on_conflict_do_update(
+        index_elements=['clave'],
+        set_={'valor': VersionDatos.valor + 1}
+    ), [{'clave': clave, 'valor': 1} for clave in dict.fromkeys(claves)])
+
+class ConfiguracionActual:
+    """Copia de solo lectura de la configuración, segura para compartir entre peticiones"""
+    CAMPOS = ('id', 'tasa_cambio', 'iva_porcentaje', 'fecha_dolar', 'fecha_programa', 'nombre_empresa')
+    
+    def __init__(self, config):
+        for campo in self.CAMPOS:
+            setattr(self, campo, getattr(config, campo))
+    
+    def to_dict(self):
+        return Configuracion.to_dict(self)
+
+def cache_aplicacion(nombre):
+    """Caché en memoria de la aplicación en curso; cada create_app tiene las suyas"""
+    return current_app.extensions['misangeles'][nombre]
+
+def _obtener_configuracion_db():
+    """Obtiene la fila de configuración, creándola si no existe"""
+    config = Configuracion.query.first()
+    if not config:
+        config = Configuracion()
+        db.session.add(config)
+        db.session.commit()
+    return config
+
+def _version_configuracion():
+    """Versión de la configuración, consultada como máximo una vez por petición"""
+    if not has_request_context():
+        return leer_version('configuracion')
+    if 'version_configuracion' not in g:
+        g.version_configuracion = leer_version('configuracion')
+    return g.version_configuracion
+
+def obtener_configuracion():
+    """Obtiene la configuración actual del sistema"""
+    sucursal = sucursal_actual()
+    version = _version_configuracion()
+    cache = cache_aplicacion('configuracion')
+    version_cache, config = cache.get(sucursal, (None, None))
+    if config is None or version_cache != version:
+        config = ConfiguracionActual(_obtener_configuracion_db())
+        cache[sucursal] = (version, config)
+    return config
+
+def _valorar_stock(producto, stock_mayor, stock_unidades, tasa_cambio):
+    """Arma el diccionario de stock de un producto con su valoración en USD y BS"""
+    valor_usd = (stock_mayor * producto.precio_mayor_usd) + (stock_unidades * producto.precio_detal_usd)
+    valor_bs = valor_usd * tasa_cambio
+    
+    return {
+        'stock_mayor': stock_mayor,
+        'stock_unidades': stock_unidades,
+        'valor_usd': round(valor_usd, 2),
+        'valor_bs': round(valor_bs, 2)
+    }
+
+def _sumas_movimientos(producto_ids=None, despues_de=None, hasta=None, solo_activas=False):
+    """Suma por producto las entradas y ventas (en Mayor y en Detal) con fecha posterior a despues_de
+    y hasta 'hasta' inclusive, leyendo de los archivos anuales solo si el rango los incluye"""
+    if solo_activas:
+        E, V = Entrada, Venta
+    else:
+        E = modelo_movimientos(Entrada, despues_de and despues_de + timedelta(days=1), hasta)
+        V = modelo_movimientos(Venta, despues_de and despues_de + timedelta(days=1), hasta)
+    totales_entradas = db.session.query(
+        E.producto_id.label('producto_id'),
+        db.func.sum(db.case((E.tipo_entrada == 'Mayor', E.cantidad))).label('entradas_mayor'),
+        db.func.sum(db.case((E.tipo_entrada == 'Detal', E.cantidad))).label('entradas_detal')
+    )
+    totales_ventas = db.session.query(
+        V.producto_id.label('producto_id'),
+        db.func.sum(db.case((V.tipo_venta == 'Mayor', V.cantidad_mayor))).label('ventas_mayor'),
+        db.func.sum(db.case((V.tipo_venta == 'Detal', V.cantidad_detal))).label('ventas_detal')
+    )
+    productos = db.session.query(Producto)
+    
+    if producto_ids is not None:
+        totales_entradas = totales_entradas.filter(E.producto_id.in_(producto_ids))
+        totales_ventas = totales_ventas.filter(V.producto_id.in_(producto_ids))
+        productos = productos.filter(Producto.id.in_(producto_ids))
+    if despues_de is not None:
+        totales_entradas = totales_entradas.filter(E.fecha > despues_de)
+        totales_ventas = totales_ventas.filter(V.fecha > despues_de)
+    if hasta is not None:
+        totales_entradas = totales_entradas.filter(E.fecha <= hasta)
+        totales_ventas = totales_ventas.filter(V.fecha <= hasta)
+    
+    totales_entradas = totales_entradas.group_by(E.producto_id).subquery()
+    totales_ventas = totales_ventas.group_by(V.producto_id).subquery()
+    
+    filas = productos.add_columns(
+        totales_entradas.c.entradas_mayor,
+        totales_entradas.c.entradas_detal,
+        totales_ventas.c.ventas_mayor,
+        totales_ventas.c.ventas_detal
+    ).outerjoin(
+        totales_entradas, totales_entradas.c.producto_id == Producto.id
+    ).outerjoin(
+        totales_ventas, totales_ventas.c.producto_id == Producto.id
+    ).order_by(Producto.id).all()
+    
+    return [
+        (producto, entradas_mayor or 0, entradas_detal or 0, ventas_mayor or 0, ventas_detal or 0)
+        for producto, entradas_mayor, entradas_detal, ventas_mayor, ventas_detal in filas
+    ]
+
+def _stock_desde_historial(producto_ids=None, despues_de=None, hasta=None):
+    """Recalcula stock_mayor y stock_unidades de cada producto a partir de sus entradas y ventas
+    (todas, o solo las de fecha posterior a despues_de y hasta 'hasta' inclusive)"""
+    apertura = {}
+    corte = fecha_corte_archivo() if despues_de is None else None
+    solo_activas = bool(corte) and (hasta is None or hasta > corte)
+    if solo_activas:
+        # Lo archivado ya está sumado en el saldo de apertura y en las tablas activas solo quedan
+        # fechas posteriores al corte: se recorren completas, sin filtrar por fecha (con el índice cubriente)
+        consulta = SaldoApertura.query
+        if producto_ids is not None:
+            consulta = consulta.filter(SaldoApertura.producto_id.in_(producto_ids))
+        apertura = {
+            saldo.producto_id: (saldo.entradas_mayor, saldo.entradas_detal, saldo.ventas_mayor, saldo.ventas_detal)
+            for saldo in consulta
+        }
+    
+    saldos = []
+    for producto, *sumas in _sumas_movimientos(producto_ids, despues_de, hasta, solo_activas):
+        entradas_mayor, entradas_detal, ventas_mayor, ventas_detal = (
+            suma + previo for suma, previo in zip(sumas, apertura.get(producto.id, (0, 0, 0, 0)))
+        )
+        stock_mayor = entradas_mayor - ventas_mayor
+        stock_unidades = (entradas_mayor * producto.equivalencia + entradas_detal) - ventas_detal
+        saldos.append((producto, stock_mayor, stock_unidades))
+    
+    return saldos
+
+def _stock_desde_saldos(producto_ids=None):
+    """Lee stock_mayor y stock_unidades de cada producto desde la tabla de saldos"""
+    consulta = db.session.query(
+        Producto, StockProducto.stock_mayor, StockProducto.stock_unidades
+    ).outerjoin(StockProducto, StockProducto.producto_id == Producto.id)
+    
+    if producto_ids is not None:
+        consulta = consulta.filter(Producto.id.in_(producto_ids))
+    
+    return [
+        (producto, stock_mayor or 0, stock_unidades or 0)
+        for producto, stock_mayor, stock_unidades in consulta.order_by(Producto.id).all()
+    ]
+
+def calcular_inventario(producto_ids=None, solo_con_stock=False, desde_historial=False, fecha=None, tasas=()):
+    """Calcula el stock de todos los productos (o de los indicados), actual o al cierre de una fecha,
+    valorado con la tasa de esa fecha y, en 'valores_bs', con cada tasa hipotética de 'tasas'"""
+    if fecha is not None:
+        saldos, _ = stock_a_fecha(fecha, producto_ids)
+    elif desde_historial:
+        saldos = _stock_desde_historial(producto_ids)
+    else:
+        saldos = _stock_desde_saldos(producto_ids)
+    
+    if solo_con_stock:
+        saldos = [saldo for saldo in saldos if saldo[1] > 0 or saldo[2] > 0]
+    # Todo el inventario se valora de una vez con la tasa de la fecha y las hipotéticas
+    valor_usd, valor_bs = valorar_saldos(saldos, [tasa_en_fecha(fecha), *tasas])
+    
+    inventario = []
+    for (producto, stock_mayor, stock_unidades), usd, bs in zip(saldos, valor_usd.tolist(), valor_bs.T.tolist()):
+        stock = {
+            'stock_mayor': stock_mayor,
+            'stock_unidades': stock_unidades,
+            'valor_usd': round(usd, 2),
+            'valor_bs': round(bs[0], 2)
+        }
+        if tasas:
+            stock['valores_bs'] = [round(valor, 2) for valor in bs[1:]]
+        inventario.append({'producto': producto.to_dict(), 'stock': stock})
+    
+    return inventario
+
+def calcular_stock_producto(producto_id):
+    """Calcula el stock actual de un producto"""
+    inventario = calcular_inventario(producto_ids=[producto_id])
+    if not inventario:
+        return {'stock_mayor': 0, 'stock_unidades': 0, 'valor_usd': 0, 'valor_bs': 0}
+    return inventario[0]['stock']
+
+def delta_stock_entrada(producto, tipo_entrada, cantidad):
+    """Variación de (stock_mayor, stock_unidades) que produce una entrada"""
+    if tipo_entrada == 'Mayor':
+        return cantidad, cantidad * producto.equivalencia
+    return 0, cantidad
+
+def delta_stock_venta(tipo_venta, cantidad_mayor, cantidad_detal):
+    """Variación de (stock_mayor, stock_unidades) que produce una venta"""
+    if tipo_venta == 'Mayor':
+        return -cantidad_mayor, 0
+    if tipo_venta == 'Detal':
+        return 0, -cantidad_detal
+    return 0, 0
+
+def aplicar_delta_stock(producto_id, delta_mayor, delta_unidades):
+    """Suma una variación al saldo del producto dentro de la transacción en curso"""
+    insercion = sqlite_insert(StockProducto).values(
+        producto_id=producto_id,
+        stock_mayor=delta_mayor,
+        stock_unidades=delta_unidades
+    )
+    db.session.execute(insercion.on_conflict_do_update(
+        index_elements=['producto_id'],
+        set_={
+            'stock_mayor': StockProducto.stock_mayor + insercion.excluded.stock_mayor,
+            'stock_unidades': StockProducto.stock_unidades + insercion.excluded.stock_unidades
+        }
+    ))
+
+# Columnas de Venta que se suman en el resumen diario
+COLUMNAS_VENTA_DIARIA = ('cantidad_mayor', 'cantidad_detal', 'total_sin_iva_usd',
+                         'iva_usd', 'total_con_iva_usd', 'total_bs')
+
+def acumular_ventas_diarias(ventas):
+    """Suma ventas (diccionarios de columnas de Venta) al resumen diario en la transacción en curso"""
+    acumulados = {}
+    for venta in ventas:
+        clave = (venta['fecha'], venta['producto_id'], venta['tipo_venta'])
+        acumulado = acumulados.setdefault(clave, dict.fromkeys(COLUMNAS_VENTA_DIARIA, 0))
+        acumulado['cantidad_ventas'] = acumulado.get('cantidad_ventas', 0) + 1
+        for columna in COLUMNAS_VENTA_DIARIA:
+            acumulado[columna] += venta[columna] or 0
+    
+    if not acumulados:
+        return
+    insercion = sqlite_insert(VentaDiaria.__table__)
+    db.session.execute(insercion.on_conflict_do_update(
+        index_elements=['fecha', 'producto_id', 'tipo_venta'],
+        set_={
+            columna: getattr(VentaDiaria, columna) + getattr(insercion.excluded, columna)
+            for columna in ('cantidad_ventas',) + COLUMNAS_VENTA_DIARIA
+        }
+    ), [
+        {'fecha': fecha, 'producto_id': producto_id, 'tipo_venta': tipo_venta, **valores}
+        for (fecha, producto_id, tipo_venta), valores in acumulados.items()
+    ])
+
+def reconstruir_ventas_diarias():
+    """Recalcula todo el resumen diario desde la tabla de ventas"""
+    VentaDiaria.query.delete()
+    columnas = ['fecha', 'producto_id', 'tipo_venta', 'cantidad_ventas'] + list(COLUMNAS_VENTA_DIARIA)
+    # Incluye los años archivados: el resumen diario cubre todo el historial
+    V = modelo_movimientos(Venta)
+    db.session.execute(db.insert(VentaDiaria).from_select(
+        columnas,
+        db.select(
+            V.fecha, V.producto_id, V.tipo_venta, db.func.count(V.id),
+            *[db.func.coalesce(db.func.sum(getattr(V, columna)), 0) for columna in COLUMNAS_VENTA_DIARIA]
+        ).group_by(V.fecha, V.producto_id, V.tipo_venta)
+    ))
+    db.session.commit()
+
+def resumen_ventas(desde=None, hasta=None):
+    """Cantidad de ventas y totales en USD/BS de un rango de fechas, leídos del resumen diario"""
+    consulta = db.session.query(
+        db.func.sum(VentaDiaria.cantidad_ventas),
+        db.func.sum(VentaDiaria.total_con_iva_usd),
+        db.func.sum(VentaDiaria.total_bs)
+    )
+    if desde:
+        consulta = consulta.filter(VentaDiaria.fecha >= desde)
+    if hasta:
+        consulta = consulta.filter(VentaDiaria.fecha <= hasta)
+    
+    cantidad, total_usd, total_bs = consulta.one()
+    return {
+        'cantidad': cantidad or 0,
+        'total_usd': total_usd or 0,
+        'total_bs': total_bs or 0
+    }
+
+def productos_mas_vendidos(desde, hasta=None, limite=5):
+    """Productos con mayor venta en USD en un rango de fechas, desde el resumen diario"""
+    total_usd = db.func.sum(VentaDiaria.total_con_iva_usd)
+    consulta = db.session.query(
+        Producto.codigo, Producto.nombre,
+        db.func.sum(VentaDiaria.cantidad_mayor),
+        db.func.sum(VentaDiaria.cantidad_detal),
+        total_usd,
+        db.func.sum(VentaDiaria.total_bs)
+    ).join(Producto, VentaDiaria.producto_id == Producto.id).filter(VentaDiaria.fecha >= desde)
+    if hasta:
+        consulta = consulta.filter(VentaDiaria.fecha <= hasta)
+    
+    return [
+        {
+            'codigo': codigo,
+            'nombre': nombre,
+            'cantidad_mayor': cantidad_mayor,
+            'cantidad_detal': cantidad_detal,
+            'total_usd': total,
+            'total_bs': total_bs
+        }
+        for codigo, nombre, cantidad_mayor, cantidad_detal, total, total_bs
+        in consulta.group_by(Producto.id).order_by(total_usd.desc()).limit(limite)
+    ]
+
+def verificar_saldos_stock(reparar=False, tolerancia=1e-6):
+    """Compara los saldos guardados con el historial y devuelve las diferencias encontradas"""
+    guardados = {
+        producto.id: (stock_mayor, stock_unidades)
+        for producto, stock_mayor, stock_unidades in _stock_desde_saldos()
+    }
+    
+    diferencias = []
+    for producto, stock_mayor, stock_unidades in _stock_desde_historial():
+        mayor_guardado, unidades_guardado = guardados.get(producto.id, (0, 0))
+        if abs(mayor_guardado - stock_mayor) > tolerancia or abs(unidades_guardado - stock_unidades) > tolerancia:
+            diferencias.append({
+                'producto_id': producto.id,
+                'codigo': producto.codigo,
+                'stock_mayor_guardado': mayor_guardado,
+                'stock_mayor_historial': stock_mayor,
+                'stock_unidades_guardado': unidades_guardado,
+                'stock_unidades_historial': stock_unidades
+            })
+    
+    if reparar:
+        reconstruir_saldos_stock()
+    
+    return diferencias
+
+def reconstruir_saldos_stock():
+    """Reemplaza todos los saldos de stock por los recalculados desde el historial"""
+    anteriores = {
+        producto_id: (stock_mayor, stock_unidades)
+        for producto_id, stock_mayor, stock_unidades in db.session.query(
+            StockProducto.producto_id, StockProducto.stock_mayor, StockProducto.stock_unidades
+        )
+    }
+    saldos = _stock_desde_historial()
+    StockProducto.query.delete()
+    db.session.add_all([
+        StockProducto(producto_id=producto.id, stock_mayor=stock_mayor, stock_unidades=stock_unidades)
+        for producto, stock_mayor, stock_unidades in saldos
+    ])
+    # Las respuestas en caché del inventario y de los productos corregidos quedan vencidas
+    incrementar_version(*claves_version_productos(*(
+        producto.codigo for producto, stock_mayor, stock_unidades in saldos
+        if anteriores.get(producto.id, (0, 0)) != (stock_mayor, stock_unidades)
+    )))
+    db.session.commit()
+
+# Filas por página en los listados de ventas y entradas
+POR_PAGINA = 50
+
+def _leer_fecha(valor):
+    """Convierte un texto YYYY-MM-DD en fecha, o None si está vacío o es inválido"""
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date() if valor else None
+    except ValueError:
+        return None
+
+def leer_filtros_movimientos():
+    """Lee de la URL los filtros de fecha, producto y tipo de los listados (solo los no vacíos)"""
+    filtros = {}
+    for clave in ('desde', 'hasta', 'producto', 'tipo'):
+        valor = request.args.get(clave, '').strip()
+        if valor:
+            filtros[clave] = valor
+    return filtros
+
+def filtrar_movimientos(consulta, modelo, columna_tipo, filtros):
+    """Aplica los filtros de fecha, código de producto y tipo a una consulta de Venta o Entrada"""
+    desde = _leer_fecha(filtros.get('desde'))
+    hasta = _leer_fecha(filtros.get('hasta'))
+    
+    if desde:
+        consulta = consulta.filter(modelo.fecha >= desde)
+    if hasta:
+        consulta = consulta.filter(modelo.fecha <= hasta)
+    if filtros.get('producto'):
+        producto_id = db.session.query(Producto.id).filter_by(codigo=filtros['producto']).scalar_subquery()
+        consulta = consulta.filter(modelo.producto_id == producto_id)
+    if filtros.get('tipo') in ('Mayor', 'Detal'):
+        consulta = consulta.filter(columna_tipo == filtros['tipo'])
+    
+    return consulta
+
+def paginar_por_fecha(fuentes, cursor):
+    """Devuelve una página ordenada por (fecha, id) descendente y el cursor de la siguiente.
+    Las fuentes son ternas (primer día que cubre, modelo, consulta) de la más reciente a la más antigua:
+    las tablas de archivo solo se consultan cuando la página llega a su año"""
+    fecha_cursor = id_cursor = None
+    if cursor:
+        try:
+            fecha_cursor, id_cursor = cursor.split('_')
+            fecha_cursor, id_cursor = datetime.strptime(fecha_cursor, '%Y-%m-%d').date(), int(id_cursor)
+        except ValueError:
+            fecha_cursor = id_cursor = None
+    
+    filas = []
+    for inicio, modelo, consulta in fuentes:
+        if fecha_cursor is not None:
+            if inicio is not None and fecha_cursor < inicio:
+                continue
+            consulta = consulta.filter(db.tuple_(modelo.fecha, modelo.id) < (fecha_cursor, id_cursor))
+        filas += consulta.order_by(modelo.fecha.desc(), modelo.id.desc()).limit(POR_PAGINA + 1 - len(filas)).all()
+        if len(filas) > POR_PAGINA:
+            break
+    
+    siguiente = None
+    if len(filas) > POR_PAGINA:
+        filas = filas[:POR_PAGINA]
+        ultima = filas[-1]
+        siguiente = f'{ultima.fecha:%Y-%m-%d}_{ultima.id}'
+    
+    return filas, siguiente
+
+# ===== ARCHIVO HISTÓRICO =====
+
+# Tablas entrada_AAAA y venta_AAAA; no están en db.metadata porque se crean al archivar
+_metadata_archivo = db.MetaData()
+_bloqueo_archivo = threading.Lock()
+
+def tabla_archivo(modelo, anio):
+    """Tabla de archivo de un año, con las mismas columnas que la tabla activa del modelo"""
+    nombre = f'{modelo.__tablename__}_{anio}'
+    with _bloqueo_archivo:
+        tabla = _metadata_archivo.tables.get(nombre)
+        if tabla is None:
+            tabla = db.Table(
+                nombre, _metadata_archivo,
+                *(db.Column(columna.name, columna.type, primary_key=columna.primary_key, autoincrement=False)
+                  for columna in modelo.__table__.columns),
+                db.Index(f'ix_{nombre}_fecha_id', 'fecha', 'id'),
+                db.Index(f'ix_{nombre}_producto_fecha', 'producto_id', 'fecha')
+            )
+        return tabla
+
+def anios_archivados():
+    """Registros de los años archivados, del más antiguo al más reciente"""
+    return ArchivoAnual.query.order_by(ArchivoAnual.anio).all()
+
+def fecha_corte_archivo():
+    """Último día archivado (None si no hay archivo): hasta esa fecha no se admiten movimientos nuevos"""
+    anio = db.session.query(db.func.max(ArchivoAnual.anio)).scalar()
+    return date(anio, 12, 31) if anio else None
+
+def validar_periodo_abierto(fecha, corte):
+    """Rechaza movimientos con fecha dentro de un año archivado (corte es fecha_corte_archivo())"""
+    if corte and fecha <= corte:
+        raise ValueError(f'El {fecha:%d/%m/%Y} pertenece a un período archivado (hasta el {corte:%d/%m/%Y})')
+
+def tablas_movimientos(modelo, desde=None, hasta=None):
+    """Pares (primer día que cubre o None, tabla) con movimientos entre dos fechas inclusive,
+    de la tabla activa a los archivos más antiguos: los archivos solo entran si el rango los toca"""
+    archivos = anios_archivados()
+    corte = date(archivos[-1].anio, 12, 31) if archivos else None
+    tablas = []
+    if corte is None or hasta is None or hasta > corte:
+        tablas.append((corte and corte + timedelta(days=1), modelo.__table__))
+    for archivo in reversed(archivos):
+        if not getattr(archivo, modelo.__tablename__ + 's'):
+            continue
+        if (desde is None or desde <= date(archivo.anio, 12, 31)) and (hasta is None or hasta >= date(archivo.anio, 1, 1)):
+            tablas.append((date(archivo.anio, 1, 1), tabla_archivo(modelo, archivo.anio)))
+    return tablas
+
+def modelo_para_filtros(modelo, filtros):
+    """Venta o Entrada sobre las tablas que necesitan los filtros 'desde' y 'hasta' de un listado"""
+    return modelo_movimientos(modelo, _leer_fecha(filtros.get('desde')), _leer_fecha(filtros.get('hasta')))
+
+def fuentes_movimientos(modelo, filtros):
+    """Pares (primer día que cubre, modelo sobre esa tabla) de cada tabla que piden los filtros de un listado,
+    de la más reciente a la más antigua"""
+    tablas = tablas_movimientos(modelo, _leer_fecha(filtros.get('desde')), _leer_fecha(filtros.get('hasta')))
+    return [(inicio, alias_movimientos(modelo, [tabla])) for inicio, tabla in tablas]
+
+def primera_fecha_movimientos():
+    """Fecha de la entrada o venta más antigua, archivada o no (None si no hay movimientos)"""
+    fechas = [
+        db.session.query(db.func.min(tabla.c.fecha)).scalar()
+        for modelo in (Entrada, Venta)
+        for _, tabla in tablas_movimientos(modelo)
+    ]
+    return min([fecha for fecha in fechas if fecha], default=None)
+
+def alias_movimientos(modelo, tablas):
+    """El modelo sobre una o varias tablas (unidas con UNION ALL), para consultarlo como la tabla activa.
+    Las columnas se adaptan por nombre, las relaciones no: los joins con Producto se escriben explícitos"""
+    if not tablas or tablas == [modelo.__table__]:
+        return modelo
+    if len(tablas) == 1:
+        return db.aliased(modelo, tablas[0], adapt_on_names=True)
+    union = db.union_all(*(db.select(tabla) for tabla in tablas)).subquery(f'{modelo.__tablename__}_historial')
+    return db.aliased(modelo, union, adapt_on_names=True)
+
+def modelo_movimientos(modelo, desde=None, hasta=None):
+    """Venta o Entrada sobre la tabla activa y los archivos que necesite el rango de fechas"""
+    return alias_movimientos(modelo, [tabla for _, tabla in tablas_movimientos(modelo, desde, hasta)])
+
+def _archivar_anio(anio):
+    """Mueve las entradas y ventas de un año a sus tablas de archivo y suma su efecto al saldo de apertura"""
+    inicio, fin = date(anio, 1, 1), date(anio, 12, 31)
+    sumas = [
+        {'producto_id': producto.id, 'entradas_mayor': entradas_mayor, 'entradas_detal': entradas_detal,
+         'ventas_mayor': ventas_mayor, 'ventas_detal': ventas_detal}
+        for producto, entradas_mayor, entradas_detal, ventas_mayor, ventas_detal
+        in _sumas_movimientos(despues_de=inicio - timedelta(days=1), hasta=fin)
+        if entradas_mayor or entradas_detal or ventas_mayor or ventas_detal
+    ]
+    if sumas:
+        insercion = sqlite_insert(SaldoApertura.__table__)
+        db.session.execute(insercion.on_conflict_do_update(
+            index_elements=['producto_id'],
+            set_={
+                columna: getattr(SaldoApertura, columna) + getattr(insercion.excluded, columna)
+                for columna in ('entradas_mayor', 'entradas_detal', 'ventas_mayor', 'ventas_detal')
+            }
+        ), sumas)
+    
+    registro = ArchivoAnual(anio=anio)
+    conexion = db.session.connection()
+    for modelo in (Venta, Entrada):
+        activa = modelo.__table__
+        en_rango = db.and_(activa.c.fecha >= inicio, activa.c.fecha <= fin)
+        filas = db.session.query(db.func.count()).select_from(activa).filter(en_rango).scalar()
+        setattr(registro, modelo.__tablename__ + 's', filas)
+        if not filas:
+            continue
+        if modelo is Entrada:
+            registro.total_entradas_usd = db.session.query(
+                db.func.sum(activa.c.total_usd)
+            ).filter(en_rango).scalar() or 0
+        archivo = tabla_archivo(modelo, anio)
+        archivo.create(conexion, checkfirst=True)
+        db.session.execute(archivo.insert().from_select(list(activa.c.keys()), db.select(activa).where(en_rango)))
+        db.session.execute(activa.delete().where(en_rango))
+    
+    db.session.add(registro)
+    incrementar_version('datos')
+    db.session.commit()
+    return registro
+
+def archivar_historial(hasta_anio):
+    """Archiva los años cerrados hasta hasta_anio, uno por transacción y del más antiguo al más reciente"""
+    if hasta_anio >= date.today().year:
+        raise ValueError('Solo se pueden archivar años ya cerrados')
+    ultimo = db.session.query(db.func.max(ArchivoAnual.anio)).scalar() or 0
+    primeras = [
+        fecha for fecha in (db.session.query(db.func.min(Entrada.fecha)).scalar(),
+                            db.session.query(db.func.min(Venta.fecha)).scalar()) if fecha
+    ]
+    db.session.rollback()
+    if not primeras:
+        return []
+    
+    archivados = []
+    g.transaccion_escritura = True
+    try:
+        for anio in range(max(min(primeras).year, ultimo + 1), hasta_anio + 1):
+            archivados.append(_archivar_anio(anio))
+    finally:
+        g.transaccion_escritura = False
+    return archivados
+
+def compactar_base():
+    """VACUUM: reescribe la base sin las páginas que dejó libres el archivo (requiere que nadie más escriba)"""
+    db.session.remove()
+    conexion = motor_sucursal().raw_connection()
+    try:
+        conexion.cursor().execute('VACUUM')
+    finally:
+        conexion.close()
+
+def tamano_tablas(*nombres):
+    """Filas y bytes (tabla más sus índices) de cada tabla; bytes es None si SQLite no tiene dbstat"""
+    tamanos = {}
+    for nombre in nombres:
+        filas = db.session.execute(db.text(f'SELECT COUNT(*) FROM "{nombre}"')).scalar()
+        try:
+            bytes_ = db.session.execute(db.text(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE tbl_name = :tabla)"
+            ), {'tabla': nombre}).scalar()
+        except exc.OperationalError:
+            db.session.rollback()
+            bytes_ = None
+        tamanos[nombre] = {'filas': filas, 'bytes': bytes_}
+    return tamanos
+
+# ===== CIERRES DE INVENTARIO =====
+
+# Los cierres diarios se conservan estos días; los de fin de mes se conservan siempre
+DIAS_CIERRES_DIARIOS = 62
+
+def fecha_inventario(valor):
+    """Fecha pasada para consultar el inventario, o None para el inventario actual"""
+    fecha = _leer_fecha(valor)
+    return fecha if fecha is not None and fecha < date.today() else None
+
+def stock_a_fecha(fecha, producto_ids=None):
+    """Stock al final de un día: el cierre más cercano anterior más los movimientos posteriores a él.
+    Devuelve (saldos, cierre usado o None)"""
+    cierre = CierreInventario.query.filter(CierreInventario.fecha <= fecha) \
+        .order_by(CierreInventario.fecha.desc()).first()
+    if cierre is None:
+        return _stock_desde_historial(producto_ids, hasta=fecha), None
+    
+    base = db.session.query(CierreStock.producto_id, CierreStock.stock_mayor, CierreStock.stock_unidades) \
+        .filter(CierreStock.fecha == cierre.fecha)
+    if producto_ids is not None:
+        base = base.filter(CierreStock.producto_id.in_(producto_ids))
+    base = {producto_id: (stock_mayor, stock_unidades) for producto_id, stock_mayor, stock_unidades in base}
+    
+    saldos = []
+    for producto, delta_mayor, delta_unidades in _stock_desde_historial(producto_ids, cierre.fecha, fecha):
+        stock_mayor, stock_unidades = base.get(producto.id, (0, 0))
+        saldos.append((producto, stock_mayor + delta_mayor, stock_unidades + delta_unidades))
+    return saldos, cierre
+
+def tomar_cierre_inventario(fecha, periodo='diario'):
+    """Guarda (o rehace) el cierre de inventario de una fecha con la tasa de cambio vigente ese día"""
+    anterior = db.session.get(CierreInventario, fecha)
+    if anterior is not None:
+        if anterior.periodo == 'mensual':
+            periodo = 'mensual'
+        db.session.expunge(anterior)
+    invalidar_cierres(fecha, fecha)
+    
+    saldos, _ = stock_a_fecha(fecha)
+    tasa_cambio = tasa_en_fecha(fecha)
+    filas = []
+    for producto, stock_mayor, stock_unidades in saldos:
+        if stock_mayor == 0 and stock_unidades == 0:
+            continue
+        stock = _valorar_stock(producto, stock_mayor, stock_unidades, tasa_cambio)
+        filas.append({'fecha': fecha, 'producto_id': producto.id, **stock})
+    
+    cierre = CierreInventario(
+        fecha=fecha,
+        periodo=periodo,
+        tasa_cambio=tasa_cambio,
+        total_usd=round(sum(fila['valor_usd'] for fila in filas), 2),
+        total_bs=round(sum(fila['valor_bs'] for fila in filas), 2)
+    )
+    db.session.add(cierre)
+    if filas:
+        db.session.execute(db.insert(CierreStock), filas)
+    incrementar_version('datos')
+    db.session.commit()
+    return cierre
+
+def invalidar_cierres(desde, hasta=None):
+    """Borra los cierres desde una fecha (inclusive) hasta otra"""
+    for modelo in (CierreStock, CierreInventario):
+        consulta = modelo.query.filter(modelo.fecha >= desde)
+        if hasta is not None:
+            consulta = consulta.filter(modelo.fecha <= hasta)
+        consulta.delete(synchronize_session=False)
+
+def ajustar_cierres(movimientos):
+    """Suma a los cierres ya tomados lo que cambian movimientos con fecha pasada, en la transacción en curso.
+    movimientos: [(fecha, producto, delta_mayor, delta_unidades)]; cada uno cambia los cierres de su fecha
+    en adelante. La variación se valora con los precios actuales del producto y la tasa de cada cierre"""
+    movimientos = [movimiento for movimiento in movimientos if movimiento[2] or movimiento[3]]
+    if not movimientos:
+        return
+    # Lo normal es que el movimiento sea de hoy y no haya cierres que tocar
+    cierres = db.session.query(CierreInventario.fecha, CierreInventario.tasa_cambio).filter(
+        CierreInventario.fecha >= min(fecha for fecha, *_ in movimientos)
+    ).all()
+    if not cierres:
+        return
+    
+    deltas = {}
+    for fecha_cierre, _ in cierres:
+        for fecha, producto, delta_mayor, delta_unidades in movimientos:
+            if fecha <= fecha_cierre:
+                delta = deltas.setdefault((fecha_cierre, producto), [0, 0])
+                delta[0] += delta_mayor
+                delta[1] += delta_unidades
+    
+    tasas = dict(cierres)
+    filas = [
+        {'fecha': fecha_cierre, 'producto_id': producto.id,
+         **_valorar_stock(producto, delta_mayor, delta_unidades, tasas[fecha_cierre])}
+        for (fecha_cierre, producto), (delta_mayor, delta_unidades) in deltas.items()
+    ]
+    # Los productos sin stock al cerrar no tienen fila: la suma la crea
+    insercion = sqlite_insert(CierreStock)
+    db.session.execute(insercion.on_conflict_do_update(
+        index_elements=['fecha', 'producto_id'],
+        set_={
+            columna: getattr(CierreStock, columna) + getattr(insercion.excluded, columna)
+            for columna in ('stock_mayor', 'stock_unidades', 'valor_usd', 'valor_bs')
+        }
+    ), filas)
+    
+    totales = {}
+    for fila in filas:
+        total = totales.setdefault(fila['fecha'], {'fecha_cierre': fila['fecha'], 'delta_usd': 0, 'delta_bs': 0})
+        total['delta_usd'] += fila['valor_usd']
+        total['delta_bs'] += fila['valor_bs']
+    tabla = CierreInventario.__table__
+    db.session.execute(db.update(tabla).where(tabla.c.fecha == db.bindparam('fecha_cierre')).values(
+        total_usd=db.func.round(tabla.c.total_usd + db.bindparam('delta_usd'), 2),
+        total_bs=db.func.round(tabla.c.total_bs + db.bindparam('delta_bs'), 2)
+    ), list(totales.values()))
+
+def cerrar_periodos_pendientes(hoy=None):
+    """Toma los cierres de fin de mes que falten y el de ayer, y depura los diarios antiguos"""
+    hoy = hoy or date.today()
+    primera = primera_fecha_movimientos()
+    if primera is None:
+        return []
+    
+    existentes = {fecha for fecha, in db.session.query(CierreInventario.fecha)}
+    pendientes = []
+    fin_mes = _mes_siguiente(primera) - timedelta(days=1)
+    while fin_mes < hoy:
+        if fin_mes not in existentes:
+            pendientes.append((fin_mes, 'mensual'))
+        fin_mes = _mes_siguiente(fin_mes + timedelta(days=1)) - timedelta(days=1)
+    ayer = hoy - timedelta(days=1)
+    if ayer >= primera and ayer not in existentes and (ayer, 'mensual') not in pendientes:
+        pendientes.append((ayer, 'diario'))
+    
+    # En orden: cada cierre parte del anterior y solo suma los movimientos de su periodo
+    creados = [tomar_cierre_inventario(fecha, periodo) for fecha, periodo in sorted(pendientes)]
+    
+    antiguos = [fecha for fecha, in db.session.query(CierreInventario.fecha).filter(
+        CierreInventario.periodo == 'diario',
+        CierreInventario.fecha < hoy - timedelta(days=DIAS_CIERRES_DIARIOS)
+    )]
+    if antiguos:
+        CierreStock.query.filter(CierreStock.fecha.in_(antiguos)).delete(synchronize_session=False)
+        CierreInventario.query.filter(CierreInventario.fecha.in_(antiguos)).delete(synchronize_session=False)
+        incrementar_version('datos')
+        db.session.commit()
+    return creados
+
+# ===== TASAS DE CAMBIO =====
+
+# Tasas hipotéticas que se aceptan en una consulta (?tasas=40,45.5)
+MAX_TASAS_ESCENARIO = 10
+
+def leer_tasas(texto):
+    """Tasas hipotéticas de un texto como '40, 45.5' (ValueError si alguna no es un número positivo)"""
+    tasas = []
+    for parte in (texto or '').replace(';', ',').split(','):
+        parte = parte.strip()
+        if not parte:
+            continue
+        try:
+            tasa = float(parte)
+        except ValueError:
+            raise ValueError(f'Tasa inválida: {parte}') from None
+        if not 0 < tasa < float('inf'):
+            raise ValueError(f'La tasa debe ser mayor que cero: {parte}')
+        tasas.append(tasa)
+    if len(tasas) > MAX_TASAS_ESCENARIO:
+        raise ValueError(f'Se aceptan hasta {MAX_TASAS_ESCENARIO} tasas')
+    return tasas
+
+def registrar_tasas(tasas):
+    """Guarda (o reemplaza) la tasa de cada fecha de una lista de (fecha, tasa), dentro de la transacción en curso"""
+    if not tasas:
+        return
+    insercion = sqlite_insert(TasaCambio.__table__)
+    db.session.execute(insercion.on_conflict_do_update(
+        index_elements=['fecha'],
+        set_={'tasa': insercion.excluded.tasa, 'fecha_creacion': insercion.excluded.fecha_creacion}
+    ), [{'fecha': fecha, 'tasa': tasa, 'fecha_creacion': datetime.utcnow()} for fecha, tasa in tasas])
+
+def tasa_en_fecha(fecha=None):
+    """Tasa vigente al final de una fecha pasada según el historial; la de hoy (o sin fecha) es la de la configuración"""
+    if fecha is None or fecha >= date.today():
+        return obtener_configuracion().tasa_cambio
+    tasa = db.session.query(TasaCambio.tasa).filter(TasaCambio.fecha <= fecha) \
+        .order_by(TasaCambio.fecha.desc()).limit(1).scalar()
+    if tasa is None:
+        # Antes del primer registro se usa el más antiguo
+        tasa = db.session.query(TasaCambio.tasa).order_by(TasaCambio.fecha).limit(1).scalar()
+    return tasa if tasa is not None else obtener_configuracion().tasa_cambio
+
+def tasas_por_dia(desde, hasta):
+    """Tasa vigente en cada día de desde a hasta (incluidos), como vector de NumPy"""
+    import numpy as np
+    
+    dias = max((hasta - desde).days + 1, 0)
+    cambios = db.session.query(TasaCambio.fecha, TasaCambio.tasa).filter(
+        TasaCambio.fecha > desde, TasaCambio.fecha <= hasta
+    ).order_by(TasaCambio.fecha).all()
+    posiciones = np.array([(fecha - desde).days for fecha, _ in cambios], dtype=np.int64)
+    valores = np.array([tasa_en_fecha(desde)] + [tasa for _, tasa in cambios], dtype=float)
+    # Cada día toma el último cambio ocurrido hasta él (o la tasa de 'desde' si no hubo)
+    tasas = valores[np.searchsorted(posiciones, np.arange(dias), side='right')]
+    
+    hoy = date.today()
+    if hoy <= hasta:
+        tasas[max((hoy - desde).days, 0):] = obtener_configuracion().tasa_cambio
+    return tasas
+
+def valorar_columnas(filas, tasas, solo_con_stock=False):
+    """Valor en USD de cada fila (precio_mayor, precio_detal, stock_mayor, stock_unidades) y en Bs con cada tasa:
+    devuelve (vector [producto], matriz [tasa, producto])"""
+    import numpy as np
+    
+    columnas = list(zip(*filas)) or [()] * 4
+    precio_mayor, precio_detal, stock_mayor, stock_unidades = (np.array(columna, dtype=float) for columna in columnas)
+    valor_usd = (stock_mayor * precio_mayor) + (stock_unidades * precio_detal)
+    if solo_con_stock:
+        valor_usd = valor_usd[(stock_mayor > 0) | (stock_unidades > 0)]
+    return valor_usd, np.outer(np.asarray(tasas, dtype=float), valor_usd)
+
+def valorar_saldos(saldos, tasas):
+    """Valor en USD y en Bs con cada tasa de los saldos (producto, stock_mayor, stock_unidades)"""
+    return valorar_columnas([
+        (producto.precio_mayor_usd, producto.precio_detal_usd, stock_mayor, stock_unidades)
+        for producto, stock_mayor, stock_unidades in saldos
+    ], tasas)
+
+def escenarios_tasa(tasas=(), desde=None, hasta=None):
+    """Inventario al final de 'hasta' (hoy si no se indica) y ventas de desde a hasta valorados en Bs con la tasa
+    histórica de cada día, la actual y cada tasa hipotética, en una sola operación matricial"""
+    import numpy as np
+    
+    hoy = date.today()
+    hasta = min(hasta or hoy, hoy)
+    desde = min(desde or date(hasta.year, hasta.month, 1), hasta)
+    dias = (hasta - desde).days + 1
+    
+    ventas_usd = np.zeros(dias)
+    ventas_bs_registradas = 0.0
+    for fecha, total_usd, total_bs in db.session.query(
+        VentaDiaria.fecha, db.func.sum(VentaDiaria.total_con_iva_usd), db.func.sum(VentaDiaria.total_bs)
+    ).filter(VentaDiaria.fecha >= desde, VentaDiaria.fecha <= hasta).group_by(VentaDiaria.fecha):
+        ventas_usd[(fecha - desde).days] = total_usd
+        ventas_bs_registradas += total_bs
+    
+    # Una fila por escenario y una columna por día: la tasa histórica, la actual y cada hipotética
+    nombres = ['Histórica', 'Actual'] + [f'Tasa {tasa:g}' for tasa in tasas]
+    matriz = np.empty((len(nombres), dias))
+    matriz[0] = tasas_por_dia(desde, hasta)
+    matriz[1:] = np.array([obtener_configuracion().tasa_cambio, *tasas], dtype=float)[:, None]
+    ventas_bs = matriz @ ventas_usd
+    
+    # El inventario, como en /inventario, son los productos con stock al final de 'hasta';
+    # el actual se lee como columnas, sin cargar los productos en el ORM
+    if hasta < hoy:
+        filas = [
+            (producto.precio_mayor_usd, producto.precio_detal_usd, stock_mayor, stock_unidades)
+            for producto, stock_mayor, stock_unidades in stock_a_fecha(hasta)[0]
+        ]
+    else:
+        filas = db.session.query(
+            Producto.precio_mayor_usd, Producto.precio_detal_usd,
+            db.func.coalesce(StockProducto.stock_mayor, 0), db.func.coalesce(StockProducto.stock_unidades, 0)
+        ).outerjoin(StockProducto, StockProducto.producto_id == Producto.id).all()
+    valor_usd, valor_bs = valorar_columnas(filas, matriz[:, -1], solo_con_stock=True)
+    inventario_bs = valor_bs.sum(axis=1)
+    
+    return {
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'inventario_usd': round(float(valor_usd.sum()), 2),
+        'ventas_usd': round(float(ventas_usd.sum()), 2),
+        'ventas_bs_registradas': round(ventas_bs_registradas, 2),
+        'escenarios': [
+            {
+                'nombre': nombre,
+                'tasa': round(float(matriz[posicion, -1]), 4),
+                'inventario_bs': round(float(inventario_bs[posicion]), 2),
+                'ventas_bs': round(float(ventas_bs[posicion]), 2),
+                'diferencia_ventas_bs': round(float(ventas_bs[posicion]) - ventas_bs_registradas, 2)
+            }
+            for posicion, nombre in enumerate(nombres)
+        ]
+    }
+
+# ===== ANALÍTICA DE VENTAS =====
+
+# Promedios móviles de venta diaria, en días; la ventana más larga es también la del ranking ABC
+VENTANAS_PROMEDIO = (7, 30, 90)
+# Ventana del promedio con que se calculan la cobertura y el pedido sugerido
+VENTANA_REPOSICION = 30
+# Días de venta que debe alcanzar el stock después de reponer
+DIAS_COBERTURA_OBJETIVO = 30
+# Participación acumulada en las ventas en USD hasta donde llegan las clases A y B
+LIMITES_ABC = (0.8, 0.95)
+# Días de la serie diaria de todo el negocio que se muestran
+DIAS_SERIE_ANALITICA = 30
+# Productos por reponer que se listan en la página de reportes
+LIMITE_REPOSICION_REPORTE = 20
+
+_bloqueo_analitica = threading.Lock()
+
+def _matriz_por_producto(consulta, ids, columnas):
+    """Reparte las filas (producto_id, valores...) de una consulta en una matriz [columna, producto] alineada con ids"""
+    import numpy as np
+    
+    matriz = np.zeros((columnas, len(ids)))
+    filas = consulta.all()
+    if filas:
+        # Por columnas: NumPy convierte tuplas de números mucho más rápido que filas de SQLAlchemy
+        datos = np.array(list(zip(*filas)), dtype=float)
+        matriz[:, np.searchsorted(ids, datos[0].astype(np.int64))] = datos[1:]
+    return matriz
+
+def _series_analitica(hoy, ids):
+    """Ventas Mayor y Detal de cada producto en cada ventana de VENTANAS_PROMEDIO, USD de la más larga
+    y entradas (Mayor, Detal, cantidad y días desde la última) dentro de ella"""
+    inicio = hoy - timedelta(days=max(VENTANAS_PROMEDIO) - 1)
+    
+    # Cada ventana se suma en SQL: traer una fila por producto y día costaba más que todo el cálculo
+    sumas = []
+    for ventana in VENTANAS_PROMEDIO:
+        desde = hoy - timedelta(days=ventana - 1)
+        sumas.append(db.func.sum(db.case((VentaDiaria.fecha >= desde, VentaDiaria.cantidad_mayor), else_=0)))
+        sumas.append(db.func.sum(db.case((VentaDiaria.fecha >= desde, VentaDiaria.cantidad_detal), else_=0)))
+    ventas = _matriz_por_producto(
+        db.session.query(VentaDiaria.producto_id, *sumas, db.func.sum(VentaDiaria.total_con_iva_usd)).filter(
+            VentaDiaria.fecha >= inicio, VentaDiaria.fecha <= hoy
+        ).group_by(VentaDiaria.producto_id),
+        ids, 2 * len(VENTANAS_PROMEDIO) + 1
+    )
+    
+    E = modelo_movimientos(Entrada, inicio, hoy)
+    entradas = _matriz_por_producto(
+        db.session.query(
+            E.producto_id,
+            db.func.sum(db.case((E.tipo_entrada == 'Mayor', E.cantidad), else_=0)),
+            db.func.sum(db.case((E.tipo_entrada == 'Detal', E.cantidad), else_=0)),
+            db.func.count(),
+            db.func.julianday(hoy.isoformat()) - db.func.julianday(db.func.max(E.fecha))
+        ).filter(E.fecha >= inicio, E.fecha <= hoy).group_by(E.producto_id),
+        ids, 4
+    )
+    return ventas, entradas
+
+def _serie_diaria_analitica(hoy):
+    """Unidades y USD vendidos por día en todo el negocio, con su promedio móvil de 7 días"""
+    import numpy as np
+    
+    dias = DIAS_SERIE_ANALITICA + 6
+    inicio = hoy - timedelta(days=dias - 1)
+    equivalencia = db.func.max(db.func.coalesce(Producto.equivalencia, 1), 1)
+    filas = db.session.query(
+        VentaDiaria.fecha,
+        db.func.sum(VentaDiaria.cantidad_mayor * equivalencia + VentaDiaria.cantidad_detal),
+        db.func.sum(VentaDiaria.total_con_iva_usd)
+    ).join(Producto, Producto.id == VentaDiaria.producto_id).filter(
+        VentaDiaria.fecha >= inicio, VentaDiaria.fecha <= hoy
+    ).group_by(VentaDiaria.fecha).all()
+    
+    unidades, usd = np.zeros(dias), np.zeros(dias)
+    for fecha, cantidad, total in filas:
+        unidades[(fecha - inicio).days] = cantidad
+        usd[(fecha - inicio).days] = total
+    acumuladas = np.concatenate(([0.0], np.cumsum(unidades)))
+    promedio_7 = (acumuladas[7:] - acumuladas[:-7]) / 7
+    
+    return [
+        {
+            'fecha': (inicio + timedelta(days=dia)).isoformat(),
+            'unidades': round(float(unidades[dia]), 2),
+            'ventas_usd': round(float(usd[dia]), 2),
+            'promedio_7': round(float(promedio_7[dia - 6]), 2)
+        }
+        for dia in range(6, dias)
+    ]
+
+def calcular_analitica(hoy=None):
+    """Promedios móviles, clase ABC, días de cobertura y pedido sugerido (en Mayor) de cada producto,
+    calculados con NumPy sobre todos los productos a la vez"""
+    import numpy as np
+    
+    hoy = hoy or date.today()
+    
+    productos = db.session.query(
+        Producto.id, Producto.codigo, Producto.nombre, Producto.categoria, Producto.equivalencia,
+        db.func.coalesce(StockProducto.stock_mayor, 0), db.func.coalesce(StockProducto.stock_unidades, 0)
+    ).outerjoin(StockProducto, StockProducto.producto_id == Producto.id).order_by(Producto.id).all()
+    columnas = list(zip(*productos)) or [()] * 7
+    ids = np.array(columnas[0], dtype=np.int64)
+    equivalencia = np.maximum(np.array([valor or 1 for valor in columnas[4]], dtype=float), 1)
+    stock_mayor = np.array(columnas[5], dtype=float)
+    stock_unidades = np.array(columnas[6], dtype=float)
+    
+    ventas, entradas = _series_analitica(hoy, ids)
+    por_ventana = {
+        ventana: (ventas[2 * posicion], ventas[2 * posicion + 1])
+        for posicion, ventana in enumerate(VENTANAS_PROMEDIO)
+    }
+    total_usd = ventas[-1]
+    
+    # Lo vendido en Mayor se lleva a unidades con la equivalencia de cada producto
+    promedios = {
+        ventana: (mayor * equivalencia + detal) / ventana
+        for ventana, (mayor, detal) in por_ventana.items()
+    }
+    
+    # Clase ABC por participación acumulada en las ventas en USD, de mayor a menor
+    orden = np.argsort(-total_usd, kind='stable')
+    acumulado = np.cumsum(total_usd[orden])
+    if len(orden) and acumulado[-1] > 0:
+        previo = (acumulado - total_usd[orden]) / acumulado[-1]
+    else:
+        previo = np.ones(len(orden))
+    clases = np.empty(len(ids), dtype='<U1')
+    clases[orden] = np.where(previo < LIMITES_ABC[0], 'A', np.where(previo < LIMITES_ABC[1], 'B', 'C'))
+    clases[total_usd <= 0] = 'C'
+    ranking = np.empty(len(ids), dtype=np.int64)
+    ranking[orden] = np.arange(1, len(ids) + 1)
+    
+    # Las ventas en Mayor descuentan stock_mayor y las de Detal stock_unidades: cada saldo
+    # se cubre por separado y una entrada en Mayor repone los dos (equivalencia unidades por bulto)
+    demanda_mayor, demanda_detal = (total / VENTANA_REPOSICION for total in por_ventana[VENTANA_REPOSICION])
+    disponible_mayor = np.maximum(stock_mayor, 0)
+    disponible_unidades = np.maximum(stock_unidades, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cobertura = np.minimum(
+            np.where(demanda_mayor > 0, disponible_mayor / demanda_mayor, np.inf),
+            np.where(demanda_detal > 0, disponible_unidades / demanda_detal, np.inf)
+        )
+    faltante = np.maximum(
+        demanda_mayor * DIAS_COBERTURA_OBJETIVO - disponible_mayor,
+        (demanda_detal * DIAS_COBERTURA_OBJETIVO - disponible_unidades) / equivalencia
+    )
+    pedido = np.ceil(np.maximum(faltante, 0) - TOLERANCIA_STOCK)
+    
+    # Las columnas pasan a listas de Python de una vez; armar los diccionarios es lo único que recorre producto a producto
+    valores = zip(
+        orden.tolist(), ranking[orden].tolist(), clases[orden].tolist(),
+        *(np.round(promedios[ventana][orden], 3).tolist() for ventana in VENTANAS_PROMEDIO),
+        np.round(total_usd[orden], 2).tolist(),
+        entradas[0][orden].tolist(), entradas[1][orden].tolist(),
+        np.where(entradas[2] > 0, entradas[3], -1)[orden].astype(np.int64).tolist(),
+        stock_mayor[orden].tolist(), stock_unidades[orden].tolist(),
+        np.round(cobertura[orden], 1).tolist(), pedido[orden].astype(np.int64).tolist()
+    )
+    filas = []
+    for posicion, puesto, clase, *promedios_producto, usd, mayor, detal, dias, stock_m, stock_u, dias_cobertura, pedir in valores:
+        _, codigo, nombre, categoria, _, _, _ = productos[posicion]
+        filas.append({
+            'codigo': codigo,
+            'nombre': nombre,
+            'categoria': categoria,
+            'ranking': puesto,
+            'clase': clase,
+            **{f'promedio_{ventana}': promedio for ventana, promedio in zip(VENTANAS_PROMEDIO, promedios_producto)},
+            'ventas_usd': usd,
+            'entradas_mayor': mayor,
+            'entradas_detal': detal,
+            'dias_sin_entrada': dias if dias >= 0 else None,
+            'stock_mayor': stock_m,
+            'stock_unidades': stock_u,
+            'dias_cobertura': dias_cobertura if dias_cobertura != float('inf') else None,
+            'pedido_mayor': pedir
+        })
+    
+    return {
+        'fecha': hoy.isoformat(),
+        'ventanas': list(VENTANAS_PROMEDIO),
+        'dias_cobertura_objetivo': DIAS_COBERTURA_OBJETIVO,
+        'resumen': {
+            'clases': {
+                clase: {
+                    'productos': int((clases == clase).sum()),
+                    'ventas_usd': round(float(total_usd[clases == clase].sum()), 2)
+                }
+                for clase in 'ABC'
+            },
+            'por_reponer': int((pedido > 0).sum()),
+            'sin_stock_con_demanda': int((cobertura == 0).sum())
+        },
+        'serie': _serie_diaria_analitica(hoy),
+        'productos': filas
+    }
+
+def obtener_analitica():
+    """Analítica de la sucursal en curso; se recalcula al cambiar los datos o el día"""
+    sucursal = sucursal_actual()
+    firma = (leer_versiones('datos', 'productos'), date.today())
+    cache = cache_aplicacion('analitica')
+    with _bloqueo_analitica:
+        guardada = cache.get(sucursal)
+    if guardada and guardada[0] == firma:
+        return guardada[1]
+    
+    analitica = calcular_analitica(firma[1])
+    with _bloqueo_analitica:
+        cache[sucursal] = (firma, analitica)
+    return analitica
+
+# ===== EXPORTACIONES =====
+
+# Filas que se leen de la base de datos por lote al exportar
+FILAS_POR_LOTE = 1000
+
+ENCABEZADOS_EXPORTACION = {
+    'inventario': ['Código', 'Nombre', 'Descripción', 'Categoría',
+                   'Stock Mayor', 'Stock Unidades', 'Valor USD', 'Valor BS'],
+    'ventas': ['Fecha', 'Código', 'Producto', 'Tipo', 'Cantidad Mayor', 'Cantidad Detal',
+               'Precio Unitario USD', 'Total sin IVA USD', 'IVA USD', 'Total con IVA USD', 'Total BS'],
+    'entradas': ['Fecha', 'Código', 'Producto', 'Tipo', 'Cantidad',
+                 'Precio Unitario USD', 'Total USD']
+}
+# Columna en Bs que se repite con cada tasa hipotética de filtros['tasas']
+COLUMNA_BS_EXPORTACION = {'inventario': 'Valor BS', 'ventas': 'Total BS'}
+
+def encabezados_exportacion(recurso, filtros):
+    """Encabezados de una exportación, con una columna en Bs más por cada tasa hipotética"""
+    if recurso not in COLUMNA_BS_EXPORTACION:
+        return ENCABEZADOS_EXPORTACION[recurso]
+    return ENCABEZADOS_EXPORTACION[recurso] + [
+        f'{COLUMNA_BS_EXPORTACION[recurso]} a {tasa:g}' for tasa in leer_tasas(filtros.get('tasas'))
+    ]
+
+def _filas_inventario(filtros):
+    """Filas del inventario para exportar: actual, o al cierre de la fecha 'hasta'"""
+    tasas = leer_tasas(filtros.get('tasas'))
+    for item in calcular_inventario(fecha=fecha_inventario(filtros.get('hasta')), tasas=tasas):
+        producto = item['producto']
+        stock = item['stock']
+        yield (
+            producto['codigo'], producto['nombre'], producto['descripcion'], producto['categoria'],
+            stock['stock_mayor'], stock['stock_unidades'], stock['valor_usd'], stock['valor_bs'],
+            *stock.get('valores_bs', ())
+        )
+
+def _filas_ventas(filtros):
+    """Filas de ventas para exportar, leídas por lotes sin crear objetos del ORM"""
+    V = modelo_para_filtros(Venta, filtros)
+    consulta = db.session.query(
+        V.fecha, Producto.codigo, Producto.nombre, V.tipo_venta,
+        V.cantidad_mayor, V.cantidad_detal, V.precio_unitario_usd,
+        V.total_sin_iva_usd, V.iva_usd, V.total_con_iva_usd, V.total_bs
+    ).join(Producto, V.producto_id == Producto.id)
+    consulta = filtrar_movimientos(consulta, V, V.tipo_venta, filtros)
+    tasas = leer_tasas(filtros.get('tasas'))
+    for fila in consulta.order_by(V.fecha, V.id).yield_per(FILAS_POR_LOTE):
+        yield tuple(fila) + tuple(round(fila.total_con_iva_usd * tasa, 2) for tasa in tasas)
+
+def _filas_entradas(filtros):
+    """Filas de entradas para exportar, leídas por lotes sin crear objetos del ORM"""
+    E = modelo_para_filtros(Entrada, filtros)
+    consulta = db.session.query(
+        E.fecha, Producto.codigo, Producto.nombre, E.tipo_entrada,
+        E.cantidad, E.precio_unitario_usd, E.total_usd
+    ).join(Producto, E.producto_id == Producto.id)
+    consulta = filtrar_movimientos(consulta, E, E.tipo_entrada, filtros)
+    for fila in consulta.order_by(E.fecha, E.id).yield_per(FILAS_POR_LOTE):
+        yield tuple(fila)
+
+FILAS_EXPORTACION = {
+    'inventario': _filas_inventario,
+    'ventas': _filas_ventas,
+    'entradas': _filas_entradas
+}
+
+def exportar_xlsx(recurso, filtros):
+    """Genera un Excel en modo de solo escritura, volcando las filas a disco a medida que llegan"""
+    import openpyxl
+    
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=recurso.capitalize())
+    ws.append(encabezados_exportacion(recurso, filtros))
+    for fila in FILAS_EXPORTACION[recurso](filtros):
+        ws.append(fila)
+    
+    # El archivo temporal se elimina al cerrarse cuando termina la respuesta
+    archivo = tempfile.TemporaryFile()
+    wb.save(archivo)
+    archivo.seek(0)
+    
+    return send_file(
+        archivo,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'{recurso}_misangeles_{date.today()}.xlsx'
+    )
+
+def exportar_csv(recurso, filtros):
+    """Envía un CSV que se va escribiendo en la respuesta mientras se leen las filas"""
+    def generar():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        # BOM para que Excel reconozca el archivo como UTF-8
+        buffer.write('\ufeff')
+        escritor.writerow(encabezados_exportacion(recurso, filtros))
+        for numero, fila in enumerate(FILAS_EXPORTACION[recurso](filtros), 1):
+            escritor.writerow(fila)
+            if numero % FILAS_POR_LOTE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    return Response(
+        stream_with_context(generar()),
+        mimetype='text/csv; charset=utf-8',
+        headers={'Content-Disposition': f'attachment; filename={recurso}_misangeles_{date.today()}.csv'}
+    )
+
+# ===== REPORTES EN SEGUNDO PLANO =====
+
+# Días que se conservan en disco los reportes generados
+DIAS_CACHE_REPORTES = 7
+
+_ejecutor_reportes = ThreadPoolExecutor(max_workers=2, thread_name_prefix='reportes')
+_bloqueo_reportes = threading.Lock()
+
+def _mes_siguiente(inicio):
+    """Primer día del mes siguiente a una fecha dada"""
+    if inicio.month == 12:
+        return date(inicio.year + 1, 1, 1)
+    return date(inicio.year, inicio.month + 1, 1)
+
+def _ventas_por_producto(inicio, fin):
+    """Totales del resumen diario de ventas por producto entre inicio (incluido) y fin"""
+    filas = db.session.query(
+        Producto.codigo, Producto.nombre,
+        db.func.sum(VentaDiaria.cantidad_ventas),
+        db.func.sum(VentaDiaria.cantidad_mayor),
+        db.func.sum(VentaDiaria.cantidad_detal),
+        db.func.sum(VentaDiaria.total_sin_iva_usd),
+        db.func.sum(VentaDiaria.iva_usd),
+        db.func.sum(VentaDiaria.total_con_iva_usd),
+        db.func.sum(VentaDiaria.total_bs)
+    ).join(Producto, VentaDiaria.producto_id == Producto.id).filter(
+        VentaDiaria.fecha >= inicio, VentaDiaria.fecha < fin
+    ).group_by(Producto.id).order_by(db.func.sum(VentaDiaria.total_con_iva_usd).desc()).all()
+    return [tuple(fila) for fila in filas]
+
+def _reporte_ventas_mensual(parametros):
+    """Ventas de un mes agrupadas por producto"""
+    inicio = date(int(parametros['anio']), int(parametros['mes']), 1)
+    filas = _ventas_por_producto(inicio, _mes_siguiente(inicio))
+    totales = ['TOTAL', ''] + [sum(fila[i] or 0 for fila in filas) for i in range(2, 9)]
+    
+    return {
+        'titulo': f'Ventas del mes {inicio:%m/%Y}',
+        'encabezados': ['Código', 'Producto', 'Ventas', 'Cant. Mayor', 'Cant. Detal',
+                        'Sin IVA USD', 'IVA USD', 'Total USD', 'Total BS'],
+        'filas': filas,
+        'totales': totales
+    }
+
+def _reporte_valoracion_inventario(parametros):
+    """Stock y valoración de cada producto, actual o al cierre de la fecha 'hasta'"""
+    fecha = fecha_inventario(parametros.get('hasta')) or date.today()
+    filas = list(_filas_inventario(parametros))
+    encabezados = encabezados_exportacion('inventario', parametros)
+    totales = ['TOTAL', '', '', '', '', ''] + [
+        round(sum(fila[i] for fila in filas), 2) for i in range(6, len(encabezados))
+    ]
+    
+    return {
+        'titulo': f'Valoración del inventario al {fecha:%d/%m/%Y}',
+        'encabezados': encabezados,
+        'filas': filas,
+        'totales': totales
+    }
+
+def _reporte_movimientos_producto(parametros):
+    """Entradas y ventas de un producto en un rango de fechas, en orden cronológico"""
+    producto = Producto.query.filter_by(codigo=parametros.get('codigo', '')).first()
+    if not producto:
+        raise ValueError('Producto no encontrado')
+    
+    desde = _leer_fecha(parametros.get('desde')) or date.min
+    hasta = _leer_fecha(parametros.get('hasta')) or date.max
+    E = modelo_movimientos(Entrada, desde, hasta)
+    V = modelo_movimientos(Venta, desde, hasta)
+    
+    entradas = db.session.query(
+        E.fecha, E.id, db.literal('Entrada'), E.tipo_entrada,
+        E.cantidad, E.total_usd
+    ).filter(E.producto_id == producto.id, E.fecha >= desde, E.fecha <= hasta)
+    ventas = db.session.query(
+        V.fecha, V.id, db.literal('Venta'), V.tipo_venta,
+        V.cantidad_mayor + V.cantidad_detal, V.total_con_iva_usd
+    ).filter(V.producto_id == producto.id, V.fecha >= desde, V.fecha <= hasta)
+    
+    filas = [
+        (fecha, movimiento, tipo, cantidad, total_usd)
+        for fecha, _, movimiento, tipo, cantidad, total_usd in entradas.union_all(ventas).order_by(db.text('1, 2'))
+    ]
+    
+    return {
+        'titulo': f'Movimientos de {producto.codigo} - {producto.nombre}',
+        'encabezados': ['Fecha', 'Movimiento', 'Tipo', 'Cantidad', 'Total USD'],
+        'filas': filas,
+        'totales': None
+    }
+
+def _consolidar_filas(parciales, columnas_clave, columna_sucursal):
+    """Suma por código las filas de cada sucursal y agrega, tras las columnas clave, el valor de cada sucursal"""
+    sucursales = list(parciales)
+    consolidadas = {}
+    for posicion, sucursal in enumerate(sucursales):
+        for fila in parciales[sucursal]:
+            valores = fila[columnas_clave:]
+            clave, por_sucursal, sumas = consolidadas.setdefault(
+                fila[0], (fila[:columnas_clave], [0.0] * len(sucursales), [0.0] * len(valores))
+            )
+            por_sucursal[posicion] += valores[columna_sucursal] or 0
+            for indice, valor in enumerate(valores):
+                sumas[indice] += valor or 0
+    return [tuple(clave) + tuple(por_sucursal) + tuple(sumas) for clave, por_sucursal, sumas in consolidadas.values()]
+
+def _totales_consolidados(filas, columnas_clave, columnas):
+    """Fila TOTAL con la suma de cada columna numérica"""
+    return ['TOTAL'] + [''] * (columnas_clave - 1) + [
+        round(sum(fila[i] for fila in filas), 2) for i in range(columnas_clave, columnas)
+    ]
+
+def _reporte_ventas_consolidado(parametros):
+    """Ventas de un mes de todas las sucursales, con el total en USD de cada una"""
+    inicio = date(int(parametros['anio']), int(parametros['mes']), 1)
+    parciales = en_todas_las_sucursales(_ventas_por_producto, inicio, _mes_siguiente(inicio))
+    # Columna 5 de los valores: total con IVA en USD
+    filas = sorted(_consolidar_filas(parciales, 2, 5), key=lambda fila: fila[-2], reverse=True)
+    encabezados = (['Código', 'Producto'] + [f'USD {sucursal or "principal"}' for sucursal in parciales] +
+                   ['Ventas', 'Cant. Mayor', 'Cant. Detal', 'Sin IVA USD', 'IVA USD', 'Total USD', 'Total BS'])
+    
+    return {
+        'titulo': f'Ventas consolidadas del mes {inicio:%m/%Y}',
+        'encabezados': encabezados,
+        'filas': filas,
+        'totales': _totales_consolidados(filas, 2, len(encabezados))
+    }
+
+def _reporte_inventario_consolidado(parametros):
+    """Stock y valoración de todas las sucursales, actual o al cierre de la fecha 'hasta'"""
+    fecha = fecha_inventario(parametros.get('hasta')) or date.today()
+    # Las columnas por tasa hipotética no se consolidan: se valora con la tasa de cada sucursal
+    parametros = {clave: valor for clave, valor in parametros.items() if clave != 'tasas'}
+    parciales = en_todas_las_sucursales(lambda: list(_filas_inventario(parametros)))
+    # Columna 2 de los valores: valor en USD
+    filas = sorted(_consolidar_filas(parciales, 4, 2), key=lambda fila: fila[0])
+    encabezados = (ENCABEZADOS_EXPORTACION['inventario'][:4] +
+                   [f'USD {sucursal or "principal"}' for sucursal in parciales] +
+                   ENCABEZADOS_EXPORTACION['inventario'][4:])
+    
+    return {
+        'titulo': f'Inventario consolidado al {fecha:%d/%m/%Y}',
+        'encabezados': encabezados,
+        'filas': filas,
+        'totales': _totales_consolidados(filas, 4, len(encabezados))
+    }
+
+TIPOS_REPORTE = {
+    'ventas_mensual': _reporte_ventas_mensual,
+    'valoracion_inventario': _reporte_valoracion_inventario,
+    'movimientos_producto': _reporte_movimientos_producto,
+    'ventas_consolidado': _reporte_ventas_consolidado,
+    'inventario_consolidado': _reporte_inventario_consolidado
+}
+# Reportes que leen las bases de todas las sucursales
+REPORTES_CONSOLIDADOS = {'ventas_consolidado', 'inventario_consolidado'}
+# Reportes del inventario a una fecha: sin 'hasta' son del día en que se piden
+REPORTES_INVENTARIO = {'valoracion_inventario', 'inventario_consolidado'}
+
+def _formatear_celda(valor):
+    """Texto de una celda del PDF"""
+    if isinstance(valor, float):
+        return f'{valor:,.2f}'
+    if isinstance(valor, date):
+        return valor.strftime('%d/%m/%Y')
+    return '' if valor is None else str(valor)
+
+def _escribir_pdf(reporte, ruta):
+    """Escribe el reporte como tabla PDF con reportlab"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter, landscape
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+    from reportlab.lib.styles import getSampleStyleSheet
+    
+    estilos = getSampleStyleSheet()
+    documento = SimpleDocTemplate(ruta, pagesize=landscape(letter), title=reporte['titulo'])
+    
+    datos = [reporte['encabezados']] + [[_formatear_celda(v) for v in fila] for fila in reporte['filas']]
+    if reporte['totales']:
+        datos.append([_formatear_celda(v) for v in reporte['totales']])
+    
+    tabla = Table(datos, repeatRows=1)
+    estilo = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#366092')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('ALIGN', (2, 1), (-1, -1), 'RIGHT')
+    ]
+    if reporte['totales']:
+        estilo.append(('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'))
+    tabla.setStyle(TableStyle(estilo))
+    
+    documento.build([
+        Paragraph(reporte['titulo'], estilos['Title']),
+        tabla
+    ])
+
+def _escribir_xlsx(reporte, ruta):
+    """Escribe el reporte como Excel en modo de solo escritura"""
+    import openpyxl
+    
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title='Reporte')
+    ws.append([reporte['titulo']])
+    ws.append(reporte['encabezados'])
+    for fila in reporte['filas']:
+        ws.append(fila)
+    if reporte['totales']:
+        ws.append(reporte['totales'])
+    wb.save(ruta)
+
+FORMATOS_REPORTE = {
+    'pdf': ('application/pdf', _escribir_pdf),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', _escribir_xlsx)
+}
+
+def _carpeta_reportes():
+    return os.path.join(current_app.instance_path, 'reportes')
+
+def _ruta_reporte(clave, formato):
+    return os.path.join(_carpeta_reportes(), f'{clave}.{formato}')
+
+def _archivo_disponible(trabajo):
+    """Indica si el archivo de un trabajo terminado sigue en disco"""
+    return os.path.exists(_ruta_reporte(trabajo['id'], trabajo['formato']))
+
+def _limpiar_reportes_antiguos():
+    """Elimina del disco los reportes generados hace más de DIAS_CACHE_REPORTES
+    y olvida los trabajos terminados sin archivo o fallidos de esa antigüedad"""
+    limite = datetime.now() - timedelta(days=DIAS_CACHE_REPORTES)
+    carpeta = _carpeta_reportes()
+    for nombre in os.listdir(carpeta):
+        ruta = os.path.join(carpeta, nombre)
+        if os.path.getmtime(ruta) < limite.timestamp():
+            os.remove(ruta)
+    
+    creado_limite = limite.strftime('%Y-%m-%d %H:%M:%S')
+    trabajos = cache_aplicacion('trabajos_reportes')
+    with _bloqueo_reportes:
+        for clave, trabajo in list(trabajos.items()):
+            if trabajo['estado'] == 'terminado' and not _archivo_disponible(trabajo):
+                del trabajos[clave]
+            elif trabajo['estado'] == 'error' and trabajo['creado'] < creado_limite:
+                del trabajos[clave]
+
+def _ejecutar_trabajo(aplicacion, trabajo, ruta):
+    """Genera el archivo de un trabajo de reporte fuera de la petición web"""
+    trabajo['estado'] = 'en_proceso'
+    temporal = f'{ruta}.{threading.get_ident()}.tmp'
+    try:
+        with contexto_sucursal(aplicacion, trabajo['sucursal']):
+            reporte = TIPOS_REPORTE[trabajo['tipo']](trabajo['parametros'])
+        FORMATOS_REPORTE[trabajo['formato']][1](reporte, temporal)
+        # Se publica con un reemplazo atómico para que nunca se sirva un archivo a medias
+        os.replace(temporal, ruta)
+        trabajo['estado'] = 'terminado'
+    except Exception as e:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        trabajo['estado'] = 'error'
+        trabajo['error'] = str(e)
+
+def encolar_reporte(tipo, formato, parametros):
+    """Encola un reporte y devuelve su trabajo; si ya existe en caché no se vuelve a generar"""
+    if tipo not in TIPOS_REPORTE or formato not in FORMATOS_REPORTE:
+        raise ValueError('Tipo de reporte o formato no válido')
+    leer_tasas(parametros.get('tasas'))
+    
+    # La clave depende de los parámetros y de la versión de los datos, así que
+    # cualquier entrada, venta o cambio de configuración genera una clave nueva
+    sucursal = sucursal_actual()
+    if tipo in REPORTES_CONSOLIDADOS:
+        version = list(en_todas_las_sucursales(leer_version, 'datos').values())
+    else:
+        version = leer_version('datos')
+    # El inventario sin 'hasta' es el del día, así que un reporte de ayer no sirve hoy
+    fecha = (fecha_inventario(parametros.get('hasta')) or date.today()) if tipo in REPORTES_INVENTARIO else None
+    firma = json.dumps([tipo, formato, parametros, version, sucursal, fecha], sort_keys=True, default=str)
+    clave = hashlib.sha1(firma.encode('utf-8')).hexdigest()
+    
+    trabajos = cache_aplicacion('trabajos_reportes')
+    with _bloqueo_reportes:
+        trabajo = trabajos.get(clave)
+        # Un trabajo terminado cuyo archivo ya se limpió del disco se vuelve a generar
+        if trabajo and trabajo['estado'] != 'error' and (trabajo['estado'] != 'terminado' or _archivo_disponible(trabajo)):
+            return trabajo
+        
+        trabajo = {
+            'id': clave,
+            'tipo': tipo,
+            'formato': formato,
+            'parametros': parametros,
+            'sucursal': sucursal,
+            'estado': 'pendiente',
+            'error': None,
+            'creado': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        trabajos[clave] = trabajo
+    
+    os.makedirs(_carpeta_reportes(), exist_ok=True)
+    ruta = _ruta_reporte(clave, formato)
+    if os.path.exists(ruta):
+        trabajo['estado'] = 'terminado'
+    else:
+        _limpiar_reportes_antiguos()
+        _ejecutor_reportes.submit(_ejecutar_trabajo, current_app._get_current_object(), trabajo, ruta)
+    return trabajo
+
+def obtener_trabajo_reporte(clave):
+    """Busca un trabajo en este proceso o, si lo generó otro worker, su archivo en disco"""
+    trabajo = cache_aplicacion('trabajos_reportes').get(clave)
+    if trabajo and (trabajo['estado'] != 'terminado' or _archivo_disponible(trabajo)):
+        return trabajo
+    for formato in FORMATOS_REPORTE:
+        if os.path.exists(_ruta_reporte(clave, formato)):
+            return {'id': clave, 'formato': formato, 'estado': 'terminado', 'error': None}
+    return None
+
+def _trabajo_a_dict(trabajo):
+    datos = {
+        'id': trabajo['id'],
+        'estado': trabajo['estado'],
+        'error': trabajo['error'],
+        'url_estado': url_for('tienda.estado_reporte', clave=trabajo['id'])
+    }
+    if trabajo['estado'] == 'terminado':
+        datos['url_descarga'] = url_for('tienda.descargar_reporte', clave=trabajo['id'])
+    return datos
+
+# ===== IMPORTACIÓN MASIVA =====
+
+# Filas que se insertan y confirman en cada transacción al importar
+FILAS_POR_TRANSACCION = 500
+
+def _normalizar_encabezado(texto):
+    """'Código Producto' -> 'codigo_producto'"""
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode('ascii')
+    return texto.strip().lower().replace(' ', '_')
+
+def leer_filas_importacion(archivo):
+    """Recorre un CSV o XLSX subido como diccionarios, sin cargarlo completo en memoria"""
+    nombre = (archivo.filename or '').lower()
+    
+    if nombre.endswith('.xlsx'):
+        import openpyxl
+        
+        wb = openpyxl.load_workbook(archivo.stream, read_only=True, data_only=True)
+        filas = wb.active.iter_rows(values_only=True)
+    elif nombre.endswith('.csv'):
+        filas = csv.reader(io.TextIOWrapper(archivo.stream, encoding='utf-8-sig'))
+    else:
+        raise ValueError('El archivo debe ser .csv o .xlsx')
+    
+    encabezados = [_normalizar_encabezado(columna) for columna in next(filas, [])]
+    for fila in filas:
+        if not any(valor not in (None, '') for valor in fila):
+            continue
+        yield dict(zip(encabezados, fila))
+
+def _valor_fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return datetime.strptime(str(valor).strip(), '%Y-%m-%d').date()
+
+def _valor_numero(valor, campo):
+    try:
+        numero = float(valor) if isinstance(valor, (int, float)) else float(str(valor).strip().replace(',', '.'))
+    except (TypeError, ValueError):
+        raise ValueError(f'{campo} no es un número') from None
+    if numero < 0:
+        raise ValueError(f'{campo} no puede ser negativo')
+    return numero
+
+def _preparar_movimiento(recurso, fila, productos, config, corte=None):
+    """Valida una fila importada y devuelve (producto, valores de columnas)"""
+    codigo = str(fila.get('codigo') or fila.get('codigo_producto') or '').strip()
+    producto = productos.get(codigo)
+    if not producto:
+        raise ValueError(f'Producto {codigo or "(vacío)"} no encontrado')
+    
+    tipo = str(fila.get('tipo') or '').strip().capitalize()
+    if tipo not in ('Mayor', 'Detal'):
+        raise ValueError('El tipo debe ser Mayor o Detal')
+    
+    cantidad = _valor_numero(fila.get('cantidad'), 'cantidad')
+    if cantidad <= 0:
+        raise ValueError('La cantidad debe ser mayor que cero')
+    
+    try:
+        fecha = _valor_fecha(fila.get('fecha')) if fila.get('fecha') not in (None, '') else date.today()
+    except ValueError:
+        raise ValueError('La fecha debe tener el formato YYYY-MM-DD') from None
+    validar_periodo_abierto(fecha, corte)
+    
+    precio = fila.get('precio_unitario')
+    precio = _valor_numero(precio, 'precio_unitario') if precio not in (None, '') else None
+    
+    if recurso == 'entradas':
+        return producto, datos_entrada(producto, fecha, tipo, cantidad, precio)
+    
+    if precio is None:
+        precio = precio_segun_tipo(producto, tipo)
+    return producto, datos_venta(producto.id, fecha, tipo, cantidad, precio, config)
+
+def _ventas_sin_stock(lote):
+    """Como al cobrar un ticket: ventas del lote para las que no alcanza el stock, en el orden del archivo.
+    Devuelve {posición en el lote: mensaje de error}"""
+    saldos = _leer_saldos({producto for producto, _ in lote})
+    rechazadas = {}
+    for posicion, (producto, valores) in enumerate(lote):
+        delta_mayor, delta_unidades = delta_stock_venta(
+            valores['tipo_venta'], valores['cantidad_mayor'], valores['cantidad_detal']
+        )
+        faltantes = _faltantes({producto: (-delta_mayor, -delta_unidades)}, saldos)
+        if faltantes:
+            rechazadas[posicion] = str(StockInsuficiente(faltantes))
+            continue
+        # Las ventas siguientes se comparan con el saldo que dejan las anteriores
+        stock_mayor, stock_unidades = saldos[producto.id]
+        saldos[producto.id] = (stock_mayor + delta_mayor, stock_unidades + delta_unidades)
+    return rechazadas
+
+def _guardar_lote(recurso, lote):
+    """Inserta un lote con executemany y actualiza los saldos en la misma transacción"""
+    modelo = Entrada if recurso == 'entradas' else Venta
+    db.session.execute(db.insert(modelo), [valores for _, valores in lote])
+    
+    movimientos = []
+    if recurso == 'entradas':
+        deltas = {}
+        for producto, valores in lote:
+            delta = delta_stock_entrada(producto, valores['tipo_entrada'], valores['cantidad'])
+            movimientos.append((valores['fecha'], producto, *delta))
+            mayor, unidades = deltas.get(producto.id, (0, 0))
+            deltas[producto.id] = (mayor + delta[0], unidades + delta[1])
+        for producto_id, (delta_mayor, delta_unidades) in deltas.items():
+            aplicar_delta_stock(producto_id, delta_mayor, delta_unidades)
+    else:
+        acumular_ventas_diarias([valores for _, valores in lote])
+        pedidos = {}
+        for producto, valores in lote:
+            delta_mayor, delta_unidades = delta_stock_venta(
+                valores['tipo_venta'], valores['cantidad_mayor'], valores['cantidad_detal']
+            )
+            movimientos.append((valores['fecha'], producto, delta_mayor, delta_unidades))
+            pedido = pedidos.setdefault(producto, [0, 0])
+            pedido[0] -= delta_mayor
+            pedido[1] -= delta_unidades
+        # Mismo descuento condicional que los tickets: nunca deja el stock en negativo
+        _descontar_stock(pedidos)
+    ajustar_cierres(movimientos)
+    publicar_evento('importacion', {'recurso': recurso, 'filas': len(lote)})
+    
+    incrementar_version(*claves_version_productos(*(producto.codigo for producto, _ in lote)))
+    db.session.commit()
+
+def importar_movimientos(recurso, filas):
+    """Importa entradas o ventas por lotes y devuelve el resumen con los errores por fila"""
+    config = obtener_configuracion()
+    productos = {}
+    importadas = 0
+    errores = []
+    
+    def procesar(bloque):
+        # Una sola consulta por bloque para los códigos que aún no se conocen
+        nuevos = {
+            str(fila.get('codigo') or fila.get('codigo_producto') or '').strip()
+            for _, fila in bloque
+        } - productos.keys()
+        if nuevos:
+            for producto in Producto.query.filter(Producto.codigo.in_(nuevos)):
+                productos[producto.codigo] = producto
+        
+        corte = fecha_corte_archivo()
+        lote = []
+        numeros = []
+        for numero, fila in bloque:
+            try:
+                lote.append(_preparar_movimiento(recurso, fila, productos, config, corte))
+                numeros.append(numero)
+            except ValueError as e:
+                errores.append({'fila': numero, 'error': str(e)})
+        
+        if lote and recurso == 'ventas':
+            rechazadas = _ventas_sin_stock(lote)
+            errores.extend({'fila': numeros[posicion], 'error': error} for posicion, error in rechazadas.items())
+            lote = [movimiento for posicion, movimiento in enumerate(lote) if posicion not in rechazadas]
+        
+        if lote:
+            try:
+                _guardar_lote(recurso, lote)
+            except Exception as e:
+                db.session.rollback()
+                errores.extend({'fila': numero, 'error': f'Lote no guardado: {e}'} for numero, _ in bloque)
+                return 0
+        return len(lote)
+    
+    bloque = []
+    # La fila 1 es el encabezado
+    for numero, fila in enumerate(filas, 2):
+        bloque.append((numero, fila))
+        if len(bloque) == FILAS_POR_TRANSACCION:
+            importadas += procesar(bloque)
+            bloque = []
+    if bloque:
+        importadas += procesar(bloque)
+    
+    return {
+        'importadas': importadas,
+        'con_errores': len(errores),
+        'errores': sorted(errores, key=lambda error: error['fila'])
+    }
+
+# ===== API EN STREAMING =====
+
+def _columnas_api(modelo, columnas):
+    """Columnas de la API: las del movimiento más el código y nombre del producto unidos en la consulta"""
+    seleccion = [getattr(modelo, columna) for columna in columnas[:3]]
+    seleccion += [Producto.codigo.label('producto_codigo'), Producto.nombre.label('producto_nombre')]
+    seleccion += [getattr(modelo, columna) for columna in columnas[3:]]
+    return seleccion
+
+# Mismas claves y orden que Venta.to_dict() y Entrada.to_dict()
+COLUMNAS_API = {
+    'ventas': (Venta, 'tipo_venta', [
+        'id', 'fecha', 'producto_id', 'tipo_venta', 'cantidad_mayor', 'cantidad_detal',
+        'precio_unitario_usd', 'total_sin_iva_usd', 'iva_usd', 'total_con_iva_usd',
+        'total_bs', 'fecha_creacion'
+    ]),
+    'entradas': (Entrada, 'tipo_entrada', [
+        'id', 'fecha', 'producto_id', 'tipo_entrada', 'cantidad', 'precio_unitario_usd',
+        'total_usd', 'fecha_creacion'
+    ])
+}
+
+def _valor_json(valor):
+    """Fechas con el mismo formato que los to_dict() de los modelos"""
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    return valor
+
+def generar_movimientos_json(recurso, filtros, ndjson=True):
+    """Serializa ventas o entradas por lotes, sin crear objetos del ORM"""
+    modelo, columna_tipo, nombres = COLUMNAS_API[recurso]
+    modelo = modelo_para_filtros(modelo, filtros)
+    columnas = _columnas_api(modelo, nombres)
+    claves = [columna.key for columna in columnas]
+    
+    consulta = db.session.query(*columnas).join(Producto, modelo.producto_id == Producto.id)
+    consulta = filtrar_movimientos(consulta, modelo, getattr(modelo, columna_tipo), filtros)
+    consulta = consulta.order_by(modelo.fecha, modelo.id).yield_per(FILAS_POR_LOTE)
+    
+    codificar = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    
+    def unir(lote, primero):
+        if ndjson:
+            return '\n'.join(lote) + '\n'
+        return ('' if primero else ',') + ','.join(lote)
+    
+    if not ndjson:
+        yield '['
+    lote = []
+    enviadas = 0
+    for fila in consulta:
+        lote.append(codificar(dict(zip(claves, map(_valor_json, fila)))))
+        if len(lote) == FILAS_POR_LOTE:
+            yield unir(lote, enviadas == 0)
+            enviadas += len(lote)
+            lote = []
+    if lote:
+        yield unir(lote, enviadas == 0)
+    if not ndjson:
+        yield ']'
+
+# ===== TABLERO EN VIVO =====
+
+INTERVALO_EVENTOS = 1.0
+SEGUNDOS_LATIDO = 15
+# Las conexiones se cierran cada tanto para que el navegador se reconecte (y se repartan entre procesos)
+DURACION_CONEXION_TABLERO = 600
+MAX_EVENTOS_PENDIENTES = 500
+HORAS_EVENTOS = 24
+
+def publicar_evento(tipo, datos):
+    """Registra un cambio para los tableros dentro de la transacción en curso"""
+    db.session.add(EventoTablero(tipo=tipo, datos=json.dumps(datos, default=str)))
+
+def evento_stock(producto, delta_mayor, delta_unidades, saldo=None):
+    """Stock nuevo de un producto y la variación de su valoración, para el tablero"""
+    stock_mayor, stock_unidades = saldo or db.session.query(
+        StockProducto.stock_mayor, StockProducto.stock_unidades
+    ).filter_by(producto_id=producto.id).one()
+    tasa_cambio = obtener_configuracion().tasa_cambio
+    delta = _valorar_stock(producto, delta_mayor, delta_unidades, tasa_cambio)
+    return {
+        'id': producto.id,
+        'codigo': producto.codigo,
+        'nombre': producto.nombre,
+        'descripcion': producto.descripcion,
+        **_valorar_stock(producto, stock_mayor, stock_unidades, tasa_cambio),
+        'delta_valor_usd': delta['valor_usd'],
+        'delta_valor_bs': delta['valor_bs']
+    }
+
+def ultimo_evento_tablero():
+    """Id del último evento publicado (0 si no hay)"""
+    return db.session.query(db.func.max(EventoTablero.id)).scalar() or 0
+
+class DifusorEventos:
+    """Un solo hilo por proceso y sucursal lee los eventos nuevos y los reparte a las colas de los clientes"""
+    
+    def __init__(self, aplicacion, intervalo, sucursal=None):
+        self.aplicacion = aplicacion
+        self.intervalo = intervalo
+        self.sucursal = sucursal
+        self.clientes = set()
+        self._bloqueo = threading.Lock()
+        self._hilo = None
+    
+    def suscribir(self, maximo):
+        """Cola para un cliente nuevo, o None si el proceso ya tiene el máximo"""
+        with self._bloqueo:
+            if len(self.clientes) >= maximo:
+                return None
+            cola = queue.Queue(maxsize=MAX_EVENTOS_PENDIENTES)
+            self.clientes.add(cola)
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._ejecutar, name='difusor-tablero', daemon=True)
+                self._hilo.start()
+        return cola
+    
+    def cancelar(self, cola):
+        with self._bloqueo:
+            self.clientes.discard(cola)
+    
+    def activo(self, cola):
+        return cola in self.clientes
+    
+    def _repartir(self, eventos):
+        with self._bloqueo:
+            clientes = list(self.clientes)
+        for cola in clientes:
+            try:
+                for evento in eventos:
+                    cola.put_nowait(evento)
+            except queue.Full:
+                # Un cliente que no lee no frena a los demás: se desconecta y al volver recarga
+                self.cancelar(cola)
+    
+    def _ejecutar(self):
+        with contexto_sucursal(self.aplicacion, self.sucursal):
+            ultimo_id = ultimo_evento_tablero()
+        proxima_depuracion = time.time()
+        while True:
+            time.sleep(self.intervalo)
+            if not self.clientes:
+                continue
+            try:
+                with contexto_sucursal(self.aplicacion, self.sucursal):
+                    eventos = [
+                        (evento.id, evento.tipo, evento.datos)
+                        for evento in EventoTablero.query.filter(EventoTablero.id > ultimo_id)
+                        .order_by(EventoTablero.id).limit(MAX_EVENTOS_PENDIENTES)
+                    ]
+                    if time.time() >= proxima_depuracion:
+                        limite = datetime.utcnow() - timedelta(hours=HORAS_EVENTOS)
+                        EventoTablero.query.filter(EventoTablero.fecha_creacion < limite).delete()
+                        db.session.commit()
+                        proxima_depuracion = time.time() + 3600
+            except Exception:
+                self.aplicacion.logger.exception('No se pudieron leer los eventos del tablero')
+                continue
+            if eventos:
+                ultimo_id = eventos[-1][0]
+                self._repartir(eventos)
+
+def _mensaje_sse(evento_id, tipo, datos):
+    return f'id: {evento_id}\nevent: {tipo}\ndata: {datos}\n\n'
+
+def generar_eventos_tablero(difusor, cola, pendientes, desde):
+    """Flujo SSE de un cliente: primero los eventos que se perdió y luego los que van llegando"""
+    ultimo = desde or 0
+    fin = time.time() + DURACION_CONEXION_TABLERO
+    try:
+        yield 'retry: 5000\n\n'
+        if len(pendientes) >= MAX_EVENTOS_PENDIENTES:
+            # Se perdió demasiado: es más barato que recargue la página completa
+            yield _mensaje_sse(pendientes[-1][0], 'recargar', '{}')
+            ultimo = pendientes[-1][0]
+            pendientes = []
+        for evento_id, tipo, datos in pendientes:
+            ultimo = evento_id
+            yield _mensaje_sse(evento_id, tipo, datos)
+        
+        while time.time() < fin and difusor.activo(cola):
+            try:
+                evento_id, tipo, datos = cola.get(timeout=SEGUNDOS_LATIDO)
+            except queue.Empty:
+                yield ': latido\n\n'
+                continue
+            # Los eventos repetidos (ya enviados como pendientes) se ignoran
+            if evento_id <= ultimo:
+                continue
+            ultimo = evento_id
+            yield _mensaje_sse(evento_id, tipo, datos)
+    finally:
+        difusor.cancelar(cola)
+
+# ===== TICKETS DE VENTA =====
+
+# Margen para comparar cantidades en coma flotante al verificar el stock
+TOLERANCIA_STOCK = 1e-9
+
+class StockInsuficiente(ValueError):
+    """El stock no alcanza para una o más líneas del ticket"""
+    
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        if not faltantes:
+            super().__init__('El stock cambió mientras se cobraba el ticket, intente de nuevo')
+            return
+        super().__init__('Stock insuficiente: ' + ', '.join(
+            f"{f['codigo']} (pide {f['pedido_mayor']:g} al mayor y {f['pedido_unidades']:g} unidades, "
+            f"hay {f['stock_mayor']:g} y {f['stock_unidades']:g})" for f in faltantes
+        ))
+
+def _numero_finito(valor):
+    """float de un valor, o None si no es un número finito (texto, lista, NaN, infinito...)"""
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return numero if math.isfinite(numero) else None
+
+def linea_ticket(codigo, tipo_venta, cantidad, precio_unitario=None):
+    """Valida una línea de ticket; sin precio se cobra el del producto según el tipo"""
+    codigo = str(codigo or '').strip()
+    if not codigo:
+        raise ValueError('Falta el código del producto en una línea')
+    if tipo_venta not in ('Mayor', 'Detal'):
+        raise ValueError(f'Tipo de venta inválido en {codigo}: {tipo_venta}')
+    cantidad = _numero_finito(cantidad)
+    if cantidad is None or cantidad <= 0:
+        raise ValueError(f'La cantidad de {codigo} debe ser un número mayor que cero')
+    if precio_unitario in (None, ''):
+        precio_unitario = None
+    else:
+        precio_unitario = _numero_finito(precio_unitario)
+        if precio_unitario is None or precio_unitario < 0:
+            raise ValueError(f'El precio de {codigo} debe ser un número no negativo')
+    return {'codigo': codigo, 'tipo_venta': tipo_venta, 'cantidad': cantidad, 'precio_unitario': precio_unitario}
+
+def _descuento_stock():
+    """UPDATE condicional: solo descuenta si el saldo alcanza en las columnas que se venden"""
+    tabla = StockProducto.__table__
+    mayor, unidades = db.bindparam('pedido_mayor'), db.bindparam('pedido_unidades')
+    return db.update(tabla).where(
+        tabla.c.producto_id == db.bindparam('id_producto'),
+        db.or_(mayor == 0, tabla.c.stock_mayor >= mayor - TOLERANCIA_STOCK),
+        db.or_(unidades == 0, tabla.c.stock_unidades >= unidades - TOLERANCIA_STOCK)
+    ).values(stock_mayor=tabla.c.stock_mayor - mayor, stock_unidades=tabla.c.stock_unidades - unidades)
+
+def _productos_por_codigo(codigos):
+    """Productos de varios códigos con una sola consulta"""
+    return {producto.codigo: producto for producto in Producto.query.filter(Producto.codigo.in_(codigos))}
+
+def _ventas_ticket(lineas, fecha, productos, config):
+    """Valores de Venta de cada línea y lo que el ticket descuenta de cada producto"""
+    ventas = []
+    pedidos = {}
+    for linea in lineas:
+        producto = productos[linea['codigo']]
+        precio_unitario = linea['precio_unitario']
+        if precio_unitario is None:
+            precio_unitario = precio_segun_tipo(producto, linea['tipo_venta'])
+        valores = datos_venta(producto.id, fecha, linea['tipo_venta'], linea['cantidad'], precio_unitario, config)
+        ventas.append(valores)
+        delta_mayor, delta_unidades = delta_stock_venta(
+            linea['tipo_venta'], valores['cantidad_mayor'], valores['cantidad_detal']
+        )
+        pedido = pedidos.setdefault(producto, [0, 0])
+        pedido[0] -= delta_mayor
+        pedido[1] -= delta_unidades
+    return ventas, pedidos
+
+def _leer_saldos(productos):
+    """Saldos actuales de varios productos en una consulta; la transacción ya tiene el bloqueo de escritura"""
+    saldos = dict.fromkeys((producto.id for producto in productos), (0, 0))
+    saldos.update((fila.producto_id, (fila.stock_mayor, fila.stock_unidades)) for fila in db.session.query(
+        StockProducto.producto_id, StockProducto.stock_mayor, StockProducto.stock_unidades
+    ).filter(StockProducto.producto_id.in_(saldos)))
+    return saldos
+
+def _faltantes(pedidos, saldos):
+    """Productos cuyo saldo no alcanza para lo pedido"""
+    return [
+        {'codigo': producto.codigo, 'nombre': producto.nombre,
+         'pedido_mayor': mayor, 'pedido_unidades': unidades,
+         'stock_mayor': saldos[producto.id][0], 'stock_unidades': saldos[producto.id][1]}
+        for producto, (mayor, unidades) in pedidos.items()
+        if (mayor and saldos[producto.id][0] < mayor - TOLERANCIA_STOCK)
+        or (unidades and saldos[producto.id][1] < unidades - TOLERANCIA_STOCK)
+    ]
+
+def _descontar_stock(pedidos):
+    """Descuenta lo pedido de cada producto con una sola sentencia ejecutada con executemany"""
+    resultado = db.session.execute(_descuento_stock(), [
+        {'id_producto': producto.id, 'pedido_mayor': mayor, 'pedido_unidades': unidades}
+        for producto, (mayor, unidades) in pedidos.items()
+    ])
+    if resultado.rowcount != len(pedidos):
+        # Solo pasa si otra conexión escribió sin tomar el bloqueo de la transacción
+        raise StockInsuficiente([])
+
+def _datos_ticket(ventas, fecha, config, observaciones, clave_idempotencia=None):
+    """Columnas de un ticket con los totales de sus líneas"""
+    return {
+        'fecha': fecha,
+        'cantidad_lineas': len(ventas),
+        'total_sin_iva_usd': sum(venta['total_sin_iva_usd'] for venta in ventas),
+        'iva_usd': sum(venta['iva_usd'] for venta in ventas),
+        'total_con_iva_usd': sum(venta['total_con_iva_usd'] for venta in ventas),
+        'total_bs': sum(venta['total_bs'] for venta in ventas),
+        'tasa_cambio': config.tasa_cambio,
+        'iva_porcentaje': config.iva_porcentaje,
+        'observaciones': observaciones or None,
+        'clave_idempotencia': clave_idempotencia
+    }
+
+def cobrar_ticket(lineas, fecha, observaciones=''):
+    """Registra un ticket y todas sus líneas en una sola transacción, sin vender más de lo que hay"""
+    if not lineas:
+        raise ValueError('El ticket no tiene productos')
+    validar_periodo_abierto(fecha, fecha_corte_archivo())
+    
+    codigos = {linea['codigo'] for linea in lineas}
+    productos = _productos_por_codigo(codigos)
+    desconocidos = sorted(codigos - set(productos))
+    if desconocidos:
+        raise ValueError(f'Productos no encontrados: {", ".join(desconocidos)}')
+    
+    config = obtener_configuracion()
+    ventas, pedidos = _ventas_ticket(lineas, fecha, productos, config)
+    saldos = _leer_saldos(pedidos)
+    faltantes = _faltantes(pedidos, saldos)
+    if faltantes:
+        raise StockInsuficiente(faltantes)
+    _descontar_stock(pedidos)
+    
+    ticket = Ticket(**_datos_ticket(ventas, fecha, config, observaciones))
+    db.session.add(ticket)
+    db.session.flush()
+    db.session.execute(db.insert(Venta), [{**venta, 'ticket_id': ticket.id} for venta in ventas])
+    acumular_ventas_diarias(ventas)
+    ajustar_cierres([(fecha, producto, -mayor, -unidades) for producto, (mayor, unidades) in pedidos.items()])
+    
+    publicar_evento('venta', {
+        'fecha': fecha.isoformat(),
+        'ticket_id': ticket.id,
+        'lineas': len(ventas),
+        'total_usd': ticket.total_con_iva_usd,
+        'total_bs': ticket.total_bs,
+        'productos': [
+            evento_stock(producto, -mayor, -unidades,
+                         saldo=(saldos[producto.id][0] - mayor, saldos[producto.id][1] - unidades))
+            for producto, (mayor, unidades) in pedidos.items()
+        ]
+    })
+    incrementar_version(*claves_version_productos(*codigos))
+    db.session.commit()
+    return ticket
+
+# ===== SINCRONIZACIÓN DE CAJAS SIN CONEXIÓN =====
+
+LARGO_CLAVE_IDEMPOTENCIA = 64
+
+def leer_lote_sincronizacion():
+    """JSON del lote enviado por una caja, comprimido con gzip o no"""
+    cuerpo = request.get_data(cache=False)
+    maximo = current_app.config['SINCRONIZACION_MAX_BYTES']
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        try:
+            with gzip.GzipFile(fileobj=io.BytesIO(cuerpo)) as archivo:
+                # Se lee uno de más para detectar lotes que exceden el máximo sin descomprimirlos enteros
+                cuerpo = archivo.read(maximo + 1)
+        except (OSError, EOFError):
+            raise ValueError('El lote comprimido está dañado')
+    if len(cuerpo) > maximo:
+        raise RequestEntityTooLarge()
+    lote = json.loads(cuerpo)
+    if not isinstance(lote, dict) or not isinstance(lote.get('ventas'), list):
+        raise ValueError('El lote debe ser un objeto con la lista "ventas"')
+    return lote
+
+def _venta_sincronizada(item):
+    """Valida una venta guardada por la caja y devuelve (clave, fecha, observaciones, líneas)"""
+    if not isinstance(item, dict):
+        raise ValueError('Cada venta debe ser un objeto')
+    clave = item.get('clave')
+    if not isinstance(clave, str) or not clave.strip() or len(clave) > LARGO_CLAVE_IDEMPOTENCIA:
+        raise ValueError(f'La clave de idempotencia es obligatoria (hasta {LARGO_CLAVE_IDEMPOTENCIA} caracteres)')
+    if not item.get('fecha'):
+        raise ValueError('Falta la fecha de la venta')
+    # Los mensajes no dependen de los de Python: la caja los muestra tal cual
+    try:
+        fecha = datetime.strptime(item['fecha'], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError('La fecha de la venta debe tener el formato AAAA-MM-DD') from None
+    lineas = item.get('lineas') or []
+    if not isinstance(lineas, list) or not all(isinstance(linea, dict) for linea in lineas):
+        raise ValueError('Las líneas deben ser una lista de objetos {codigo, tipo_venta, cantidad}')
+    observaciones = item.get('observaciones') or ''
+    if not isinstance(observaciones, str):
+        raise ValueError('Las observaciones deben ser texto')
+    lineas = [
+        linea_ticket(linea.get('codigo'), linea.get('tipo_venta'), linea.get('cantidad', 0), linea.get('precio_unitario'))
+        for linea in lineas
+    ]
+    if not lineas:
+        raise ValueError('La venta no tiene productos')
+    return clave, fecha, observaciones, lineas
+
+def _sincronizar_tramo(tramo):
+    """Registra un tramo del lote en una transacción y devuelve el resultado de cada venta y los productos usados"""
+    resultados = []
+    pendientes = []
+    for item in tramo:
+        resultado = {'clave': item.get('clave') if isinstance(item, dict) else None}
+        resultados.append(resultado)
+        try:
+            pendientes.append((resultado, *_venta_sincronizada(item)))
+        except ValueError as e:
+            resultado.update(estado='rechazada', error=str(e))
+    
+    # Claves ya registradas en una consulta por el índice único, y productos y saldos del tramo
+    claves = {clave for _, clave, *_ in pendientes}
+    existentes = dict(db.session.query(Ticket.clave_idempotencia, Ticket.id).filter(
+        Ticket.clave_idempotencia.in_(claves)
+    )) if claves else {}
+    productos = _productos_por_codigo({linea['codigo'] for *_, lineas in pendientes for linea in lineas})
+    saldos = _leer_saldos(productos.values())
+    config = obtener_configuracion()
+    corte = fecha_corte_archivo()
+    
+    nuevas = {}
+    repetidas = []
+    pedidos_tramo = {}
+    movimientos = []
+    for resultado, clave, fecha, observaciones, lineas in pendientes:
+        if clave in existentes:
+            resultado.update(estado='duplicada', ticket_id=existentes[clave])
+            continue
+        if clave in nuevas:
+            repetidas.append((resultado, clave))
+            continue
+        desconocidos = sorted({linea['codigo'] for linea in lineas} - set(productos))
+        if desconocidos:
+            resultado.update(estado='rechazada', error=f'Productos no encontrados: {", ".join(desconocidos)}')
+            continue
+        try:
+            validar_periodo_abierto(fecha, corte)
+        except ValueError as e:
+            resultado.update(estado='rechazada', error=str(e))
+            continue
+        
+        ventas, pedidos = _ventas_ticket(lineas, fecha, productos, config)
+        faltantes = _faltantes(pedidos, saldos)
+        if faltantes:
+            resultado.update(estado='rechazada', error=str(StockInsuficiente(faltantes)), faltantes=faltantes)
+            continue
+        # Las ventas siguientes del tramo se comparan con el saldo que dejan las anteriores
+        for producto, (mayor, unidades) in pedidos.items():
+            stock_mayor, stock_unidades = saldos[producto.id]
+            saldos[producto.id] = (stock_mayor - mayor, stock_unidades - unidades)
+            total = pedidos_tramo.setdefault(producto, [0, 0])
+            total[0] += mayor
+            total[1] += unidades
+            movimientos.append((fecha, producto, -mayor, -unidades))
+        nuevas[clave] = (resultado, _datos_ticket(ventas, fecha, config, observaciones, clave), ventas)
+    
+    if nuevas:
+        _descontar_stock(pedidos_tramo)
+        ids = db.session.scalars(
+            db.insert(Ticket).returning(Ticket.id, sort_by_parameter_order=True),
+            [datos for _, datos, _ in nuevas.values()]
+        ).all()
+        ventas = []
+        for ticket_id, (resultado, _, ventas_ticket) in zip(ids, nuevas.values()):
+            resultado.update(estado='registrada', ticket_id=ticket_id)
+            ventas.extend({**venta, 'ticket_id': ticket_id} for venta in ventas_ticket)
+        db.session.execute(db.insert(Venta), ventas)
+        acumular_ventas_diarias(ventas)
+        ajustar_cierres(movimientos)
+        publicar_evento('importacion', {'recurso': 'ventas', 'filas': len(ventas)})
+        incrementar_version(*claves_version_productos(*(producto.codigo for producto in pedidos_tramo)))
+    
+    for resultado, clave in repetidas:
+        resultado.update(estado='duplicada', ticket_id=nuevas[clave][0]['ticket_id'])
+    db.session.commit()
+    return resultados, productos.values()
+
+def sincronizar_ventas(ventas, ventas_por_tramo):
+    """Registra las ventas guardadas por una caja sin conexión, un tramo por transacción.
+    
+    Si el proceso se corta a mitad, los tramos ya confirmados quedan registrados y
+    al reenviar el lote completo aparecen como duplicados.
+    """
+    resultados = []
+    tocados = set()
+    for inicio in range(0, len(ventas), ventas_por_tramo):
+        parciales, productos = _sincronizar_tramo(ventas[inicio:inicio + ventas_por_tramo])
+        resultados.extend(parciales)
+        tocados.update(producto.id for producto in productos)
+    
+    stock = {
+        producto.codigo: {'stock_mayor': stock_mayor, 'stock_unidades': stock_unidades}
+        for producto, stock_mayor, stock_unidades in _stock_desde_saldos(tocados)
+    } if tocados else {}
+    return {
+        'resumen': dict(Counter(resultado['estado'] for resultado in resultados)),
+        'resultados': resultados,
+        'stock': stock
+    }
+
+def respuesta_json_comprimida(datos, estado=200):
+    """JSON comprimido con gzip si el cliente lo acepta"""
+    cuerpo = json.dumps(datos, default=str).encode('utf-8')
+    respuesta = Response(cuerpo, status=estado, mimetype='application/json')
+    respuesta.vary.add('Accept-Encoding')
+    if 'gzip' in request.accept_encodings:
+        respuesta.set_data(gzip.compress(cuerpo, compresslevel=6))
+        respuesta.headers['Content-Encoding'] = 'gzip'
+    return respuesta
+
+# ===== ÍNDICE DE PRODUCTOS =====
+
+MAX_SUGERENCIAS = 20
+CAMPOS_SUGERENCIA = ('codigo', 'nombre', 'categoria', 'precio_detal_usd', 'precio_mayor_usd', 'equivalencia')
+
+def _normalizar_busqueda(texto):
+    """'Azúcar Refinada' -> 'azucar refinada'"""
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(texto.lower().split())
+
+class IndiceProductos:
+    """Índice en memoria del catálogo: mapa exacto por código y términos ordenados para búsqueda por prefijo"""
+    
+    def __init__(self):
+        self.version = None
+        self.ultimo_id = 0
+        self.por_codigo = {}
+        self.codigos_normalizados = {}
+        self.terminos = []
+        self.terminos_unicos = []
+        self._bloqueo = threading.Lock()
+    
+    def _terminos_producto(self, producto):
+        codigo = _normalizar_busqueda(producto.codigo)
+        nombre = _normalizar_busqueda(producto.nombre)
+        terminos = {codigo, nombre} | set(nombre.split())
+        return [(termino, producto.codigo) for termino in terminos if termino]
+    
+    def actualizar(self):
+        """Incorpora los productos creados desde la última lectura (el catálogo solo crece)"""
+        version, = leer_versiones('productos')
+        if version == self.version:
+            return self
+        with self._bloqueo:
+            if version == self.version:
+                return self
+            nuevos = Producto.query.filter(Producto.id > self.ultimo_id).order_by(Producto.id).all()
+            por_codigo = dict(self.por_codigo)
+            codigos_normalizados = dict(self.codigos_normalizados)
+            terminos = list(self.terminos)
+            terminos_unicos = list(self.terminos_unicos)
+            agregados = []
+            for producto in nuevos:
+                por_codigo[producto.codigo] = {campo: getattr(producto, campo) for campo in CAMPOS_SUGERENCIA}
+                codigos_normalizados[_normalizar_busqueda(producto.codigo)] = producto.codigo
+                agregados.extend(self._terminos_producto(producto))
+            
+            if len(agregados) > 100:
+                terminos.extend(agregados)
+                terminos.sort()
+                terminos_unicos = sorted({termino for termino, _ in terminos})
+            else:
+                for termino in agregados:
+                    bisect.insort(terminos, termino)
+                    posicion = bisect.bisect_left(terminos_unicos, termino[0])
+                    if posicion == len(terminos_unicos) or terminos_unicos[posicion] != termino[0]:
+                        terminos_unicos.insert(posicion, termino[0])
+            
+            # Reemplazo de una vez: las lecturas concurrentes nunca ven listas a medio actualizar
+            self.por_codigo, self.codigos_normalizados = por_codigo, codigos_normalizados
+            self.terminos, self.terminos_unicos = terminos, terminos_unicos
+            self.ultimo_id = nuevos[-1].id if nuevos else self.ultimo_id
+            self.version = version
+        return self
+    
+    def buscar(self, texto, limite=10):
+        """Sugerencias por prefijo de código o de palabras del nombre; si no hay, las más parecidas"""
+        limite = max(1, min(limite, MAX_SUGERENCIAS))
+        texto = _normalizar_busqueda(texto)
+        terminos, por_codigo = self.terminos, self.por_codigo
+        codigos = []
+        
+        exacto = self.codigos_normalizados.get(texto)
+        if exacto:
+            codigos.append(exacto)
+        
+        posicion = bisect.bisect_left(terminos, (texto, ''))
+        while posicion < len(terminos) and len(codigos) < limite:
+            termino, codigo = terminos[posicion]
+            if not termino.startswith(texto):
+                break
+            if codigo not in codigos:
+                codigos.append(codigo)
+            posicion += 1
+        
+        if not codigos and len(texto) >= 3:
+            parecidos = difflib.get_close_matches(texto, self.terminos_unicos, n=limite, cutoff=0.75)
+            for parecido in parecidos:
+                posicion = bisect.bisect_left(terminos, (parecido, ''))
+                while posicion < len(terminos) and terminos[posicion][0] == parecido and len(codigos) < limite:
+                    if terminos[posicion][1] not in codigos:
+                        codigos.append(terminos[posicion][1])
+                    posicion += 1
+        
+        return [por_codigo[codigo] for codigo in codigos[:limite]]
+
+_bloqueo_indices = threading.Lock()
+
+def obtener_indice_productos():
+    """Índice de productos de la sucursal en curso, al día con la versión 'productos'"""
+    sucursal = sucursal_actual()
+    with _bloqueo_indices:
+        indice = cache_aplicacion('indices_productos').setdefault(sucursal, IndiceProductos())
+    return indice.actualizar()
+
+# ===== BÚSQUEDA DE PRODUCTOS =====
+
+# Tabla FTS5 creada por la migración 2; pesos de bm25 por columna en el mismo orden
+producto_fts = table('producto_fts', column('rowid'))
+PESOS_BUSQUEDA = (10.0, 5.0, 1.0, 2.0)
+
+def consulta_fts(texto):
+    """'arroz blan' -> '"arroz"* "blan"*': todas las palabras, cada una como prefijo"""
+    palabras = _normalizar_busqueda(texto).split()
+    return ' '.join('"{}"*'.format(palabra.replace('"', '""')) for palabra in palabras)
+
+def buscar_productos(texto='', categoria=None, pagina=1, por_pagina=POR_PAGINA):
+    """Productos que coinciden con el texto ordenados por relevancia, con facetas de categoría y paginación"""
+    consulta = Producto.query
+    orden = [Producto.codigo]
+    expresion = consulta_fts(texto)
+    if expresion:
+        coincidencias = db.select(
+            producto_fts.c.rowid.label('id'),
+            func.bm25(literal_column('producto_fts'), *PESOS_BUSQUEDA).label('rango')
+        ).where(literal_column('producto_fts').op('MATCH')(expresion)).subquery()
+        consulta = consulta.join(coincidencias, Producto.id == coincidencias.c.id)
+        orden = [coincidencias.c.rango, Producto.codigo]
+    
+    # Las facetas se cuentan antes de filtrar por categoría para poder cambiar de una a otra
+    facetas = consulta.with_entities(Producto.categoria, func.count()) \
+        .group_by(Producto.categoria).order_by(Producto.categoria).all()
+    
+    if categoria:
+        consulta = consulta.filter(Producto.categoria == categoria)
+    total = consulta.order_by(None).count()
+    paginas = max(1, -(-total // por_pagina))
+    pagina = min(max(1, pagina), paginas)
+    productos = consulta.order_by(*orden).offset((pagina - 1) * por_pagina).limit(por_pagina).all()
+    
+    return {
+        'productos': productos,
+        'total': total,
+        'pagina': pagina,
+        'paginas': paginas,
+        'facetas': [{'categoria': nombre, 'cantidad': cantidad} for nombre, cantidad in facetas]
+    }
+
+# ===== MIGRACIONES =====
+
+def _columnas_tabla(conexion, tabla):
+    """Nombres de las columnas que tiene hoy una tabla en la base"""
+    return {fila[1] for fila in conexion.exec_driver_sql(f'PRAGMA table_info({tabla})')}
+
+def _crear_indices(conexion, modelo):
+    """Crea los índices del modelo que falten; los de columnas que agrega una migración posterior esperan a esa migración"""
+    columnas = _columnas_tabla(conexion, modelo.__tablename__)
+    for indice in modelo.__table__.indexes:
+        if {columna.name for columna in indice.columns} <= columnas:
+            indice.create(conexion, checkfirst=True)
+
+def _migracion_indices(conexion):
+    """Crea los índices de las consultas frecuentes en bases existentes"""
+    for modelo in (Producto, Entrada, Venta):
+        _crear_indices(conexion, modelo)
+
+def _migracion_busqueda_productos(conexion):
+    """Crea la tabla FTS5 de productos, los triggers que la mantienen al día y la llena"""
+    conexion.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS producto_fts USING fts5("
+        "codigo, nombre, descripcion, categoria, "
+        "content='producto', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+    columnas = 'codigo, nombre, descripcion, categoria'
+    nuevos = 'new.codigo, new.nombre, new.descripcion, new.categoria'
+    viejos = 'old.codigo, old.nombre, old.descripcion, old.categoria'
+    conexion.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS producto_fts_insertar AFTER INSERT ON producto BEGIN "
+        f"INSERT INTO producto_fts(rowid, {columnas}) VALUES (new.id, {nuevos}); END"
+    )
+    conexion.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS producto_fts_eliminar AFTER DELETE ON producto BEGIN "
+        f"INSERT INTO producto_fts(producto_fts, rowid, {columnas}) VALUES ('delete', old.id, {viejos}); END"
+    )
+    conexion.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS producto_fts_actualizar AFTER UPDATE ON producto BEGIN "
+        f"INSERT INTO producto_fts(producto_fts, rowid, {columnas}) VALUES ('delete', old.id, {viejos}); "
+        f"INSERT INTO producto_fts(rowid, {columnas}) VALUES (new.id, {nuevos}); END"
+    )
+    conexion.exec_driver_sql("INSERT INTO producto_fts(producto_fts) VALUES ('rebuild')")
+
+def _migracion_tickets(conexion):
+    """Agrega a venta la columna del ticket y su índice; la tabla ticket la crea create_all"""
+    if 'ticket_id' not in _columnas_tabla(conexion, 'venta'):
+        conexion.exec_driver_sql('ALTER TABLE venta ADD COLUMN ticket_id INTEGER REFERENCES ticket (id)')
+    _crear_indices(conexion, Venta)
+
+def _migracion_idempotencia_tickets(conexion):
+    """Agrega a ticket la clave de idempotencia de las cajas y su índice único"""
+    if 'clave_idempotencia' not in _columnas_tabla(conexion, 'ticket'):
+        conexion.exec_driver_sql('ALTER TABLE ticket ADD COLUMN clave_idempotencia VARCHAR(64)')
+    _crear_indices(conexion, Ticket)
+
+def _migracion_ids_sin_reutilizar(conexion):
+    """Reconstruye venta y entrada con AUTOINCREMENT para que los ids archivados no se repitan"""
+    for modelo in (Venta, Entrada):
+        tabla = modelo.__tablename__
+        definicion = conexion.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)
+        ).scalar()
+        if 'AUTOINCREMENT' in definicion.upper():
+            continue
+        for indice in modelo.__table__.indexes:
+            conexion.exec_driver_sql(f'DROP INDEX IF EXISTS {indice.name}')
+        conexion.exec_driver_sql(f'ALTER TABLE {tabla} RENAME TO {tabla}_anterior')
+        modelo.__table__.create(conexion)
+        columnas = ', '.join(columna.name for columna in modelo.__table__.columns)
+        conexion.exec_driver_sql(f'INSERT INTO {tabla} ({columnas}) SELECT {columnas} FROM {tabla}_anterior')
+        conexion.exec_driver_sql(f'DROP TABLE {tabla}_anterior')
+
+def _migracion_historial_tasas(conexion):
+    """Crea el historial de tasas de cambio y lo llena con la tasa de cada cierre de inventario,
+    la del último ticket de cada día y, en los demás días con ventas, la que resulta de sus totales"""
+    TasaCambio.__table__.create(conexion, checkfirst=True)
+    ahora = datetime.utcnow()
+    conexion.exec_driver_sql(
+        'INSERT OR IGNORE INTO tasa_cambio (fecha, tasa, fecha_creacion) '
+        'SELECT fecha, tasa_cambio, ? FROM cierre_inventario', (ahora,)
+    )
+    conexion.exec_driver_sql(
+        'INSERT OR IGNORE INTO tasa_cambio (fecha, tasa, fecha_creacion) '
+        'SELECT fecha, tasa_cambio, ? FROM ticket '
+        'WHERE id IN (SELECT MAX(id) FROM ticket GROUP BY fecha)', (ahora,)
+    )
+    conexion.exec_driver_sql(
+        'INSERT OR IGNORE INTO tasa_cambio (fecha, tasa, fecha_creacion) '
+        'SELECT fecha, ROUND(SUM(total_bs) / SUM(total_con_iva_usd), 4), ? FROM venta_diaria '
+        'GROUP BY fecha HAVING SUM(total_con_iva_usd) > 0', (ahora,)
+    )
+
+# Lista ordenada de (versión, descripción, función). Cada migración debe ser
+# idempotente: si falla a mitad se puede volver a ejecutar sin perder datos.
+MIGRACIONES = [
+    (1, 'Índices de fecha y de producto/tipo en venta y entrada', _migracion_indices),
+    (2, 'Búsqueda de texto completo de productos (FTS5)', _migracion_busqueda_productos),
+    (3, 'Tickets de venta con varias líneas', _migracion_tickets),
+    (4, 'Clave de idempotencia de los tickets sincronizados', _migracion_idempotencia_tickets),
+    (5, 'Ids de venta y entrada sin reutilizar (AUTOINCREMENT) para el archivo histórico', _migracion_ids_sin_reutilizar),
+    (6, 'Historial de tasas de cambio por fecha', _migracion_historial_tasas),
+]
+
+def version_esquema(conexion):
+    """Versión del esquema guardada en PRAGMA user_version"""
+    return conexion.exec_driver_sql('PRAGMA user_version').scalar()
+
+def aplicar_migraciones():
+    """Aplica las migraciones pendientes y devuelve las que se ejecutaron"""
+    aplicadas = []
+    with motor_sucursal().begin() as conexion:
+        actual = version_esquema(conexion)
+        for version, descripcion, migracion in MIGRACIONES:
+            if version <= actual:
+                continue
+            migracion(conexion)
+            conexion.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+            aplicadas.append((version, descripcion))
+    return aplicadas
+
+MENSAJE_ESQUEMA_PENDIENTE = ("❌ La base de datos no está inicializada o tiene migraciones pendientes.\n"
+                             "   Ejecute: flask --app wsgi inicializar-db")
+
+def esquema_actualizado():
+    """Indica si las bases de todas las sucursales tienen las tablas y migraciones (comprobación rápida al arrancar)"""
+    for sucursal in claves_sucursales():
+        with db.engines[sucursal].connect() as conexion:
+            tablas = set(inspect(conexion).get_table_names())
+            if not set(db.metadata.tables) <= tablas or version_esquema(conexion) < MIGRACIONES[-1][0]:
+                return False
+    return True
+
+# Consultas frecuentes de la aplicación que deben resolverse con un índice
+CONSULTAS_FRECUENTES = [
+    ('Ventas del día',
+     "SELECT id, total_con_iva_usd, total_bs FROM venta WHERE fecha = '2025-01-01'"),
+    ('Listado de ventas por fecha',
+     'SELECT id FROM venta ORDER BY fecha DESC, id DESC LIMIT 50'),
+    ('Página siguiente de ventas',
+     "SELECT id FROM venta WHERE (fecha, id) < ('2025-01-01', 100) ORDER BY fecha DESC, id DESC LIMIT 51"),
+    ('Ventas de un rango de fechas',
+     "SELECT id FROM venta WHERE fecha >= '2025-01-01' AND fecha <= '2025-01-31' ORDER BY fecha DESC, id DESC"),
+    ('Ventas de un producto por tipo',
+     "SELECT SUM(cantidad_mayor) FROM venta WHERE producto_id = 1 AND tipo_venta = 'Mayor'"),
+    ('Stock vendido por producto',
+     "SELECT producto_id, SUM(CASE WHEN tipo_venta = 'Mayor' THEN cantidad_mayor END), "
+     "SUM(CASE WHEN tipo_venta = 'Detal' THEN cantidad_detal END) FROM venta GROUP BY producto_id"),
+    ('Entradas del día',
+     "SELECT COUNT(*) FROM entrada WHERE fecha = '2025-01-01'"),
+    ('Listado de entradas por fecha',
+     'SELECT id FROM entrada ORDER BY fecha DESC, id DESC LIMIT 50'),
+    ('Página siguiente de entradas',
+     "SELECT id FROM entrada WHERE (fecha, id) < ('2025-01-01', 100) ORDER BY fecha DESC, id DESC LIMIT 51"),
+    ('Entradas de un producto por tipo',
+     "SELECT SUM(cantidad) FROM entrada WHERE producto_id = 1 AND tipo_entrada = 'Mayor'"),
+    ('Stock recibido por producto',
+     "SELECT producto_id, SUM(CASE WHEN tipo_entrada = 'Mayor' THEN cantidad END), "
+     "SUM(CASE WHEN tipo_entrada = 'Detal' THEN cantidad END) FROM entrada GROUP BY producto_id"),
+    ('Resumen de ventas de un rango de fechas',
+     "SELECT SUM(total_con_iva_usd) FROM venta_diaria WHERE fecha >= '2025-01-01' AND fecha <= '2025-01-31'"),
+    ('Producto por código',
+     "SELECT id FROM producto WHERE codigo = 'H001'"),
+    ('Productos de una categoría',
+     "SELECT id FROM producto WHERE categoria = 'Granos'"),
+    ('Cierre de inventario más cercano',
+     "SELECT fecha FROM cierre_inventario WHERE fecha <= '2025-01-31' ORDER BY fecha DESC LIMIT 1"),
+    ('Stock de un cierre de inventario',
+     "SELECT producto_id, stock_mayor, stock_unidades FROM cierre_stock WHERE fecha = '2025-01-31'"),
+    ('Tasa de cambio vigente en una fecha',
+     "SELECT tasa FROM tasa_cambio WHERE fecha <= '2025-01-31' ORDER BY fecha DESC LIMIT 1"),
+    ('Búsqueda de productos por texto',
+     "SELECT rowid FROM producto_fts WHERE producto_fts MATCH '\"arroz\"*' ORDER BY rank LIMIT 50"),
+]
+
+def explicar_consultas_frecuentes():
+    """Ejecuta EXPLAIN QUERY PLAN sobre las consultas frecuentes e indica si usan índice"""
+    resultados = []
+    with motor_sucursal().connect() as conexion:
+        for nombre, sql in CONSULTAS_FRECUENTES:
+            plan = [fila[-1] for fila in conexion.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+            # Un recorrido sin índice aparece como "SCAN tabla" sin "USING ... INDEX"
+            sin_indice = [
+                paso for paso in plan
+                if (paso.startswith('SCAN') and 'INDEX' not in paso) or 'TEMP B-TREE' in paso
+            ]
+            resultados.append({
+                'nombre': nombre,
+                'plan': plan,
+                'usa_indice': not sin_indice
+            })
+    return resultados
+
+# ===== MÉTRICAS Y PERFILADO =====
+
+# Límites (en segundos) de los histogramas de latencia, como en Prometheus
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class MetricasEndpoint:
+    """Acumulados de un endpoint desde que arrancó el proceso"""
+    
+    def __init__(self):
+        self.buckets = [0] * len(LIMITES_LATENCIA)
+        self.peticiones = 0
+        self.segundos = 0.0
+        self.consultas = 0
+        self.sql_segundos = 0.0
+        self.render_segundos = 0.0
+        self.bytes = 0
+    
+    def registrar(self, duracion, medidas):
+        for posicion, limite in enumerate(LIMITES_LATENCIA):
+            if duracion <= limite:
+                self.buckets[posicion] += 1
+        self.peticiones += 1
+        self.segundos += duracion
+        self.consultas += medidas['consultas']
+        self.sql_segundos += medidas['sql']
+        self.render_segundos += medidas['render']
+        self.bytes += medidas['bytes']
+
+_bloqueo_metricas = threading.Lock()
+
+def _medidas_peticion():
+    """Medidas de la petición en curso, o None fuera de una petición"""
+    return g.get('medidas') if has_request_context() else None
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_consulta(conexion, cursor, sentencia, parametros, contexto, executemany):
+    # Las sentencias de una conexión son secuenciales: basta con el inicio de la última
+    conexion.info['inicio_consulta'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_consulta(conexion, cursor, sentencia, parametros, contexto, executemany):
+    medidas = _medidas_peticion()
+    if medidas is not None:
+        medidas['consultas'] += 1
+        medidas['sql'] += time.perf_counter() - conexion.info['inicio_consulta']
+
+def _antes_de_render(emisor, template, context, **extra):
+    medidas = _medidas_peticion()
+    if medidas is not None:
+        medidas['inicio_render'] = time.perf_counter()
+
+def _despues_de_render(emisor, template, context, **extra):
+    medidas = _medidas_peticion()
+    if medidas is not None and 'inicio_render' in medidas:
+        medidas['render'] += time.perf_counter() - medidas.pop('inicio_render')
+
+def _pila_colapsada(marco):
+    """Pila de un hilo en formato colapsado de flame graph: 'raiz;...;hoja'"""
+    funciones = []
+    while marco is not None:
+        codigo = marco.f_code
+        funciones.append(f'{os.path.basename(codigo.co_filename)}:{codigo.co_name}')
+        marco = marco.f_back
+    return ';'.join(reversed(funciones))
+
+class PerfiladorMuestreo:
+    """Hilo que toma muestras periódicas de la pila de los hilos que atienden peticiones.
+    Solo corre mientras hay peticiones perfilándose: sin ninguna en curso, termina"""
+    
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self.muestras = {}
+        self._bloqueo = threading.Lock()
+        self._hilo = None
+    
+    def iniciar(self, hilo_id):
+        with self._bloqueo:
+            self.muestras[hilo_id] = Counter()
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._muestrear, name='perfilador', daemon=True)
+                self._hilo.start()
+    
+    def terminar(self, hilo_id):
+        with self._bloqueo:
+            return self.muestras.pop(hilo_id, Counter())
+    
+    def _muestrear(self):
+        while True:
+            time.sleep(self.intervalo)
+            marcos = sys._current_frames()
+            with self._bloqueo:
+                if not self.muestras:
+                    # La próxima petición perfilada arranca un hilo nuevo
+                    self._hilo = None
+                    return
+                for hilo_id, pilas in self.muestras.items():
+                    if hilo_id in marcos:
+                        pilas[_pila_colapsada(marcos[hilo_id])] += 1
+
+def guardar_perfil(endpoint, duracion, pilas):
+    """Escribe las pilas de una petición lenta en instance/perfiles (formato de flamegraph.pl)"""
+    carpeta = os.path.join(current_app.instance_path, 'perfiles')
+    os.makedirs(carpeta, exist_ok=True)
+    nombre = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{endpoint}_{int(duracion * 1000)}ms.folded"
+    with open(os.path.join(carpeta, nombre), 'w', encoding='utf-8') as archivo:
+        for pila, muestras in pilas.most_common():
+            archivo.write(f'{pila} {muestras}\n')
+
+def _iniciar_medidas():
+    g.medidas = {'inicio': time.perf_counter(), 'consultas': 0, 'sql': 0.0, 'render': 0.0, 'bytes': 0}
+    if current_app.config['PERFILADOR_UMBRAL_MS']:
+        current_app.extensions['perfilador'].iniciar(threading.get_ident())
+
+def _agregar_server_timing(respuesta):
+    medidas = g.get('medidas')
+    if medidas is None:
+        return respuesta
+    total = time.perf_counter() - medidas['inicio']
+    medidas['bytes'] = respuesta.content_length or 0
+    respuesta.headers['Server-Timing'] = (
+        f'sql;dur={medidas["sql"] * 1000:.1f};desc="{medidas["consultas"]} consultas", '
+        f'render;dur={medidas["render"] * 1000:.1f}, '
+        f'total;dur={total * 1000:.1f}'
+    )
+    return respuesta
+
+def _registrar_medidas(error=None):
+    medidas = g.pop('medidas', None)
+    if medidas is None:
+        return
+    # En las respuestas en streaming esto ocurre al terminar de enviar el cuerpo
+    duracion = time.perf_counter() - medidas['inicio']
+    endpoint = request.endpoint or 'desconocido'
+    metricas = cache_aplicacion('metricas')
+    with _bloqueo_metricas:
+        metricas.setdefault(endpoint, MetricasEndpoint()).registrar(duracion, medidas)
+    
+    if current_app.config['PERFILADOR_UMBRAL_MS']:
+        pilas = current_app.extensions['perfilador'].terminar(threading.get_ident())
+        if pilas and duracion * 1000 >= current_app.config['PERFILADOR_UMBRAL_MS']:
+            guardar_perfil(endpoint, duracion, pilas)
+
+def metricas_prometheus():
+    """Métricas del proceso en formato de texto de Prometheus"""
+    with _bloqueo_metricas:
+        metricas = sorted(cache_aplicacion('metricas').items())
+        lineas = [
+            '# HELP misangeles_peticion_segundos Duración de las peticiones por endpoint',
+            '# TYPE misangeles_peticion_segundos histogram'
+        ]
+        for endpoint, datos in metricas:
+            for limite, cantidad in zip(LIMITES_LATENCIA, datos.buckets):
+                lineas.append(f'misangeles_peticion_segundos_bucket{{endpoint="{endpoint}",le="{limite}"}} {cantidad}')
+            lineas.append(f'misangeles_peticion_segundos_bucket{{endpoint="{endpoint}",le="+Inf"}} {datos.peticiones}')
+            lineas.append(f'misangeles_peticion_segundos_sum{{endpoint="{endpoint}"}} {datos.segundos:.6f}')
+            lineas.append(f'misangeles_peticion_segundos_count{{endpoint="{endpoint}"}} {datos.peticiones}')
+        
+        contadores = [
+            ('consultas_sql_total', 'Consultas SQL ejecutadas', 'consultas'),
+            ('sql_segundos_total', 'Tiempo total en SQL', 'sql_segundos'),
+            ('render_segundos_total', 'Tiempo total renderizando plantillas', 'render_segundos'),
+            ('respuesta_bytes_total', 'Bytes enviados (sin contar respuestas en streaming)', 'bytes'),
+        ]
+        for nombre, ayuda, campo in contadores:
+            lineas.append(f'# HELP misangeles_{nombre} {ayuda}')
+            lineas.append(f'# TYPE misangeles_{nombre} counter')
+            for endpoint, datos in metricas:
+                lineas.append(f'misangeles_{nombre}{{endpoint="{endpoint}"}} {getattr(datos, campo)}')
+    return '\n'.join(lineas) + '\n'
+
+# ===== CACHÉ HTTP CONDICIONAL =====
+
+# Respuestas renderizadas que se guardan en memoria por aplicación
+MAX_RESPUESTAS_CACHE = 256
+_bloqueo_respuestas = threading.Lock()
+
+def leer_versiones(*claves):
+    """Lee varios contadores de versión en una sola consulta, sin cargar modelos"""
+    consulta = db.select(VersionDatos.clave, VersionDatos.valor).where(VersionDatos.clave.in_(claves))
+    valores = dict(db.session.execute(consulta).all())
+    return tuple(valores.get(clave, 0) for clave in claves)
+
+def respuesta_versionada(*claves):
+    """Decorador: ETag fuerte según contadores de versión y el día, 304 con If-None-Match y caché del render en memoria"""
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(**kwargs):
+            claves_vista = [clave.format(**kwargs) for clave in claves]
+            versiones = leer_versiones(*claves_vista)
+            sucursal = sucursal_actual()
+            clave_cache = (sucursal, request.full_path)
+            # El día entra en la firma: "hoy", la tasa vigente y qué fechas son pasadas cambian a medianoche
+            firma = '|'.join([str(sucursal), request.full_path, date.today().isoformat()] +
+                             [f'{c}={v}' for c, v in zip(claves_vista, versiones)])
+            etag = hashlib.sha1(firma.encode('utf-8')).hexdigest()
+            
+            if request.if_none_match.contains(etag):
+                respuesta = Response(status=304)
+                respuesta.set_etag(etag)
+                return respuesta
+            
+            cache = cache_aplicacion('respuestas')
+            with _bloqueo_respuestas:
+                guardada = cache.get(clave_cache)
+            if guardada and guardada[0] == etag:
+                respuesta = Response(guardada[1], mimetype=guardada[2])
+            else:
+                respuesta = make_response(vista(**kwargs))
+                if respuesta.status_code != 200:
+                    return respuesta
+                with _bloqueo_respuestas:
+                    cache[clave_cache] = (etag, respuesta.get_data(), respuesta.mimetype)
+                    cache.move_to_end(clave_cache)
+                    while len(cache) > MAX_RESPUESTAS_CACHE:
+                        cache.popitem(last=False)
+            
+            respuesta.set_etag(etag)
+            respuesta.headers['Cache-Control'] = 'no-cache'
+            return respuesta
+        return envoltura
+    return decorador
+
+def claves_version_productos(*codigos):
+    """Claves de versión a incrementar cuando cambian los datos de uno o más productos"""
+    return ['datos'] + [f'producto:{codigo}' for codigo in sorted(set(codigos))]
+
+# ===== RUTAS DE LA APLICACIÓN =====
+
+@tienda.app_context_processor
+def _contexto_sucursales():
+    """Sucursales para el selector de la barra superior"""
+    return {'sucursales': list(current_app.config['SUCURSALES']), 'sucursal_actual': sucursal_actual()}
+
+@tienda.route('/')
+def dashboard():
+    """Pantalla principal del sistema"""
+    # Los cambios posteriores a este evento llegan por /tablero/eventos
+    ultimo_evento = ultimo_evento_tablero()
+    config = obtener_configuracion()
+    
+    # Obtener estadísticas del día
+    hoy = date.today()
+    ventas_hoy = resumen_ventas(desde=hoy, hasta=hoy)
+    
+    # Obtener productos con stock
+    inventario = calcular_inventario(solo_con_stock=True)
+    total_inventario_usd = sum(item['stock']['valor_usd'] for item in inventario)
+    total_inventario_bs = sum(item['stock']['valor_bs'] for item in inventario)
+    
+    return render_template('dashboard.html',
+                         ultimo_evento=ultimo_evento,
+                         hoy=hoy.isoformat(),
+                         config=config.to_dict(),
+                         ventas_hoy=ventas_hoy['cantidad'],
+                         total_ventas_usd=round(ventas_hoy['total_usd'], 2),
+                         total_ventas_bs=round(ventas_hoy['total_bs'], 2),
+                         inventario=inventario,
+                         total_inventario_usd=round(total_inventario_usd, 2),
+                         total_inventario_bs=round(total_inventario_bs, 2))
+
+@tienda.route('/tablero/eventos')
+def eventos_tablero():
+    """Cambios del dashboard en vivo (Server-Sent Events)"""
+    # Al reconectarse el navegador envía Last-Event-ID; la primera vez se usa ?desde=
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None:
+        desde = request.args.get('desde', type=int)
+    difusores = current_app.extensions['difusor_tablero']
+    difusor = difusores[sucursal_actual()]
+    # El límite es por proceso: cuenta las conexiones de todas las sucursales
+    conectados = sum(len(otro.clientes) for otro in difusores.values() if otro is not difusor)
+    cola = difusor.suscribir(current_app.config['TABLERO_MAX_CLIENTES'] - conectados)
+    if cola is None:
+        # Con 204 el navegador no reintenta y el dashboard vuelve a recargarse periódicamente
+        return Response(status=204)
+    
+    pendientes = []
+    if desde is not None:
+        pendientes = [
+            (evento.id, evento.tipo, evento.datos)
+            for evento in EventoTablero.query.filter(EventoTablero.id > desde)
+            .order_by(EventoTablero.id).limit(MAX_EVENTOS_PENDIENTES)
+        ]
+    respuesta = Response(generar_eventos_tablero(difusor, cola, pendientes, desde), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
+
+@tienda.route('/configuracion', methods=['GET', 'POST'])
+def configuracion():
+    """Gestión de configuración del sistema"""
+    if request.method == 'POST':
+        config = _obtener_configuracion_db()
+        
+        # Actualizar configuración
+        tasa_anterior = config.tasa_cambio
+        config.tasa_cambio = float(request.form.get('tasa_cambio', 35.50))
+        config.iva_porcentaje = float(request.form.get('iva_porcentaje', 30.0))
+        config.nombre_empresa = request.form.get('nombre_empresa', 'Misangeles')
+        if config.tasa_cambio != tasa_anterior:
+            config.fecha_dolar = date.today()
+        # La tasa del día queda en el historial con que se valoran las fechas pasadas
+        registrar_tasas([(date.today(), config.tasa_cambio)])
+        
+        # Invalida la caché de configuración de todos los procesos
+        incrementar_version('configuracion', 'datos')
+        publicar_evento('configuracion', {
+            'tasa_cambio': config.tasa_cambio,
+            'iva_porcentaje': config.iva_porcentaje,
+            'nombre_empresa': config.nombre_empresa
+        })
+        db.session.commit()
+        flash('Configuración actualizada correctamente', 'success')
+        return redirect(url_for('tienda.configuracion'))
+    
+    config = obtener_configuracion()
+    
+    # Obtener URL del logo actual
+    logo_url = get_logo_url()
+    
+    return render_template('configuracion.html', config=config, logo_url=logo_url)
+
+@tienda.route('/productos')
+@respuesta_versionada('productos')
+def productos():
+    """Lista de productos con búsqueda de texto, facetas de categoría y paginación"""
+    busqueda = request.args.get('q', '').strip()
+    categoria = request.args.get('categoria', '').strip()
+    resultado = buscar_productos(busqueda, categoria, request.args.get('pagina', 1, type=int))
+    return render_template('productos.html', busqueda=busqueda, categoria=categoria, **resultado)
+
+@tienda.route('/productos/nuevo', methods=['GET', 'POST'])
+def nuevo_producto():
+    """Crear nuevo producto"""
+    if request.method == 'POST':
+        producto = Producto(
+            codigo=request.form['codigo'],
+            nombre=request.form['nombre'],
+            descripcion=request.form['descripcion'],
+            categoria=request.form['categoria'],
+            precio_detal_usd=float(request.form['precio_detal_usd']),
+            precio_mayor_usd=float(request.form['precio_mayor_usd']),
+            equivalencia=int(request.form['equivalencia'])
+        )
+        
+        db.session.add(producto)
+        incrementar_version('productos', *claves_version_productos(producto.codigo))
+        db.session.commit()
+        flash('Producto creado correctamente', 'success')
+        return redirect(url_for('tienda.productos'))
+    
+    return render_template('nuevo_producto.html')
+
+@tienda.route('/entradas')
+def entradas():
+    """Lista de entradas de inventario"""
+    filtros = leer_filtros_movimientos()
+    fuentes = fuentes_movimientos(Entrada, filtros)
+    
+    entradas, siguiente = paginar_por_fecha([
+        (inicio, E, filtrar_movimientos(
+            db.session.query(E).outerjoin(Producto, Producto.id == E.producto_id).options(db.contains_eager(E.producto)),
+            E, E.tipo_entrada, filtros
+        ))
+        for inicio, E in fuentes
+    ], request.args.get('despues'))
+    
+    # Calcular estadísticas sobre todas las entradas filtradas; de los años archivados
+    # que el filtro cubre completos se usan los totales guardados al archivarlos
+    archivos = {archivo.anio: archivo for archivo in anios_archivados()}
+    desde, hasta = _leer_fecha(filtros.get('desde')), _leer_fecha(filtros.get('hasta'))
+    total_entradas, total_usd = 0, 0
+    for inicio, E in fuentes:
+        archivo = inicio and archivos.get(inicio.year)
+        if (archivo and not filtros.keys() & {'producto', 'tipo'}
+                and (desde is None or desde <= inicio) and (hasta is None or hasta >= date(inicio.year, 12, 31))):
+            cantidad, suma = archivo.entradas, archivo.total_entradas_usd
+        else:
+            cantidad, suma = filtrar_movimientos(
+                db.session.query(db.func.count(E.id), db.func.sum(E.total_usd)), E, E.tipo_entrada, filtros
+            ).one()
+        total_entradas += cantidad
+        total_usd += suma or 0
+    
+    hoy = date.today()
+    entradas_hoy = Entrada.query.filter_by(fecha=hoy).count()
+    config = obtener_configuracion()
+    total_bs = total_usd * config.tasa_cambio
+    
+    return render_template('entradas.html', 
+                         entradas=[e.to_dict() for e in entradas],
+                         total_entradas=total_entradas,
+                         entradas_hoy=entradas_hoy,
+                         total_usd=total_usd,
+                         total_bs=total_bs,
+                         tasa_cambio=config.tasa_cambio,
+                         filtros=filtros,
+                         cursor=request.args.get('despues'),
+                         siguiente=siguiente)
+
+@tienda.route('/entradas/nueva', methods=['GET', 'POST'])
+def nueva_entrada():
+    """Crear nueva entrada de inventario"""
+    if request.method == 'POST':
+        producto = Producto.query.filter_by(codigo=request.form['codigo_producto']).first()
+        if not producto:
+            flash('Producto no encontrado', 'error')
+            return redirect(url_for('tienda.nueva_entrada'))
+        
+        tipo_entrada = request.form['tipo_entrada']
+        cantidad = float(request.form['cantidad'])
+        fecha_entrada = datetime.strptime(request.form['fecha'], '%Y-%m-%d').date()
+        try:
+            validar_periodo_abierto(fecha_entrada, fecha_corte_archivo())
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('tienda.nueva_entrada'))
+        
+        # El precio se determina según el tipo de entrada
+        entrada = Entrada(**datos_entrada(producto, fecha_entrada, tipo_entrada, cantidad))
+        
+        db.session.add(entrada)
+        delta = delta_stock_entrada(producto, tipo_entrada, cantidad)
+        aplicar_delta_stock(producto.id, *delta)
+        ajustar_cierres([(fecha_entrada, producto, *delta)])
+        publicar_evento('entrada', {'fecha': fecha_entrada.isoformat(), 'producto': evento_stock(producto, *delta)})
+        incrementar_version(*claves_version_productos(producto.codigo))
+        db.session.commit()
+        flash('Entrada registrada correctamente', 'success')
+        return redirect(url_for('tienda.entradas'))
+    
+    config = obtener_configuracion()
+    today = date.today()
+    
+    return render_template('nueva_entrada.html', 
+                         config=config.to_dict(),
+                         today=today)
+
+@tienda.route('/ventas')
+def ventas():
+    """Lista de ventas"""
+    filtros = leer_filtros_movimientos()
+    
+    ventas, siguiente = paginar_por_fecha([
+        (inicio, V, filtrar_movimientos(
+            db.session.query(V).outerjoin(Producto, Producto.id == V.producto_id).options(db.contains_eager(V.producto)),
+            V, V.tipo_venta, filtros
+        ))
+        for inicio, V in fuentes_movimientos(Venta, filtros)
+    ], request.args.get('despues'))
+    
+    # Calcular estadísticas sobre todas las ventas filtradas, desde el resumen diario
+    # (cubre también los años archivados)
+    total_ventas, total_usd, total_bs = filtrar_movimientos(
+        db.session.query(
+            db.func.sum(VentaDiaria.cantidad_ventas),
+            db.func.sum(VentaDiaria.total_con_iva_usd),
+            db.func.sum(VentaDiaria.total_bs)
+        ),
+        VentaDiaria, VentaDiaria.tipo_venta, filtros
+    ).one()
+    
+    hoy = date.today()
+    ventas_hoy = resumen_ventas(desde=hoy, hasta=hoy)['cantidad']
+    
+    return render_template('ventas.html', 
+                         ventas=[v.to_dict() for v in ventas],
+                         total_ventas=total_ventas or 0,
+                         ventas_hoy=ventas_hoy,
+                         total_usd=total_usd or 0,
+                         total_bs=total_bs or 0,
+                         filtros=filtros,
+                         cursor=request.args.get('despues'),
+                         siguiente=siguiente)
+
+@tienda.route('/ventas/nueva', methods=['GET', 'POST'])
+def nueva_venta():
+    """Registrar nueva venta (un ticket con una o varias líneas)"""
+    if request.method == 'POST':
+        # Cada línea llega como campos repetidos del formulario
+        codigos = request.form.getlist('codigo')
+        tipos = request.form.getlist('tipo_venta')
+        cantidades = request.form.getlist('cantidad')
+        precios = request.form.getlist('precio_unitario')
+        # Sin campo de precio se cobra el del producto; con él, cada línea debe traer los cuatro
+        if not precios:
+            precios = [None] * len(codigos)
+        if not len(codigos) == len(tipos) == len(cantidades) == len(precios):
+            abort(400, description='Las líneas de la venta están incompletas: cada una debe tener código, tipo, cantidad y precio')
+        try:
+            fecha_venta = datetime.strptime(request.form['fecha'], '%Y-%m-%d').date()
+            lineas = [linea_ticket(*campos) for campos in zip(codigos, tipos, cantidades, precios)]
+            
+            ticket = cobrar_ticket(lineas, fecha_venta, request.form.get('observaciones', ''))
+            
+            texto_lineas = 'línea' if ticket.cantidad_lineas == 1 else 'líneas'
+            flash(f'Venta registrada exitosamente (ticket #{ticket.id}, {ticket.cantidad_lineas} {texto_lineas})', 'success')
+            return redirect(url_for('tienda.ventas'))
+            
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al registrar la venta: {str(e)}', 'danger')
+            return redirect(url_for('tienda.nueva_venta'))
+    
+    config = obtener_configuracion()
+    today = date.today()
+    
+    return render_template('nueva_venta.html', 
+                         config=config.to_dict(),
+                         today=today)
+
+@tienda.route('/api/tickets', methods=['POST'])
+def api_crear_ticket():
+    """Cobra un ticket enviado como JSON: {fecha, observaciones, lineas: [{codigo, tipo_venta, cantidad}]}"""
+    datos = request.get_json(silent=True) or {}
+    try:
+        fecha_venta = datetime.strptime(datos['fecha'], '%Y-%m-%d').date() if datos.get('fecha') else date.today()
+        lineas = [
+            linea_ticket(linea.get('codigo'), linea.get('tipo_venta'), linea.get('cantidad', 0), linea.get('precio_unitario'))
+            for linea in datos.get('lineas') or []
+        ]
+        ticket = cobrar_ticket(lineas, fecha_venta, datos.get('observaciones', ''))
+    except StockInsuficiente as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'faltantes': e.faltantes}), 409
+    except (ValueError, TypeError, AttributeError) as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return jsonify(ticket.to_dict(incluir_lineas=True)), 201
+
+@tienda.route('/api/tickets/<int:ticket_id>')
+def api_ticket(ticket_id):
+    """Ticket con sus líneas"""
+    ticket = db.session.get(Ticket, ticket_id)
+    if not ticket:
+        return jsonify({'error': 'Ticket no encontrado'}), 404
+    # Las líneas de un ticket de un año archivado están en la tabla de ese año
+    V = modelo_movimientos(Venta, ticket.fecha, ticket.fecha)
+    datos = ticket.to_dict()
+    datos['lineas'] = [venta.to_dict() for venta in db.session.query(V).filter(V.ticket_id == ticket.id).order_by(V.id)]
+    return jsonify(datos)
+
+@tienda.route('/api/sincronizacion/ventas', methods=['POST'])
+def api_sincronizar_ventas():
+    """Recibe las ventas que una caja guardó sin conexión: {ventas: [{clave, fecha, lineas}]}, con o sin gzip"""
+    try:
+        lote = leer_lote_sincronizacion()
+        resultado = sincronizar_ventas(lote['ventas'], current_app.config['SINCRONIZACION_VENTAS_POR_TRAMO'])
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return respuesta_json_comprimida(resultado)
+
+@tienda.route('/importar/<recurso>', methods=['POST'])
+def importar(recurso):
+    """Importación masiva de entradas o ventas desde CSV o XLSX"""
+    if recurso not in ('entradas', 'ventas'):
+        return jsonify({'error': 'Solo se pueden importar entradas o ventas'}), 404
+    
+    archivo = request.files.get('archivo')
+    if not archivo or archivo.filename == '':
+        return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
+    
+    try:
+        resultado = importar_movimientos(recurso, leer_filas_importacion(archivo))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(resultado)
+
+@tienda.route('/inventario')
+@respuesta_versionada('datos')
+def inventario():
+    """Vista del inventario actual, o al cierre de una fecha pasada con ?fecha=AAAA-MM-DD"""
+    fecha = fecha_inventario(request.args.get('fecha'))
+    error_tasas = None
+    try:
+        tasas = leer_tasas(request.args.get('tasas'))
+    except ValueError as e:
+        error_tasas = str(e)
+        tasas = []
+    inventario = calcular_inventario(solo_con_stock=True, fecha=fecha, tasas=tasas)
+    total_inventario_usd = sum(item['stock']['valor_usd'] for item in inventario)
+    total_inventario_bs = sum(item['stock']['valor_bs'] for item in inventario)
+    totales_escenarios = [
+        sum(item['stock']['valores_bs'][posicion] for item in inventario) for posicion in range(len(tasas))
+    ]
+    
+    return render_template('inventario.html', 
+                         inventario=inventario,
+                         fecha=fecha,
+                         tasa_cambio=tasa_en_fecha(fecha),
+                         tasas=tasas,
+                         error_tasas=error_tasas,
+                         totales_escenarios=totales_escenarios,
+                         total_inventario_usd=total_inventario_usd,
+                         total_inventario_bs=total_inventario_bs)
+
+@tienda.route('/reportes')
+def reportes():
+    """Página de reportes"""
+    # Obtener estadísticas básicas
+    total_productos = Producto.query.count()
+    
+    # Obtener ventas del mes y del año actual desde el resumen diario
+    hoy = date.today()
+    inicio_mes = date(hoy.year, hoy.month, 1)
+    ventas_mes = resumen_ventas(desde=inicio_mes)
+    ventas_anio = resumen_ventas(desde=date(hoy.year, 1, 1))
+    analitica = obtener_analitica()
+    
+    # Escenarios de tasa de cambio: ventas del rango (el mes por omisión) e inventario al final de él
+    error_tasas = None
+    try:
+        tasas = leer_tasas(request.args.get('tasas'))
+    except ValueError as e:
+        error_tasas = str(e)
+        tasas = []
+    escenarios = escenarios_tasa(
+        tasas, _leer_fecha(request.args.get('desde')) or inicio_mes, _leer_fecha(request.args.get('hasta'))
+    )
+    
+    return render_template('reportes.html',
+                         total_productos=total_productos,
+                         ventas_mes=ventas_mes['cantidad'],
+                         total_ventas_usd=ventas_mes['total_usd'],
+                         total_ventas_bs=ventas_mes['total_bs'],
+                         ventas_anio=ventas_anio,
+                         mas_vendidos=productos_mas_vendidos(inicio_mes),
+                         analitica=analitica,
+                         escenarios=escenarios,
+                         error_tasas=error_tasas,
+                         por_reponer=[fila for fila in sorted(
+                             analitica['productos'],
+                             key=lambda fila: fila['dias_cobertura'] if fila['dias_cobertura'] is not None else float('inf')
+                         ) if fila['pedido_mayor'] > 0][:LIMITE_REPOSICION_REPORTE])
+
+@tienda.route('/reportes/generar', methods=['POST'])
+def generar_reporte():
+    """Encola la generación de un reporte PDF o Excel"""
+    datos = request.get_json(silent=True) or request.form.to_dict()
+    parametros = {
+        clave: valor for clave, valor in datos.items()
+        if clave not in ('tipo', 'formato') and valor not in (None, '')
+    }
+    try:
+        trabajo = encolar_reporte(datos.get('tipo'), datos.get('formato', 'pdf'), parametros)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_trabajo_a_dict(trabajo)), 202
+
+@tienda.route('/reportes/trabajos/<clave>')
+def estado_reporte(clave):
+    """Estado de un trabajo de reporte"""
+    trabajo = obtener_trabajo_reporte(clave)
+    if not trabajo:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(_trabajo_a_dict(trabajo))
+
+@tienda.route('/reportes/trabajos/<clave>/descargar')
+def descargar_reporte(clave):
+    """Descarga el archivo de un reporte terminado"""
+    trabajo = obtener_trabajo_reporte(clave)
+    if not trabajo:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if trabajo['estado'] != 'terminado':
+        return jsonify(_trabajo_a_dict(trabajo)), 409
+    
+    mimetype = FORMATOS_REPORTE[trabajo['formato']][0]
+    try:
+        return send_file(
+            _ruta_reporte(clave, trabajo['formato']),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=f"{trabajo.get('tipo', 'reporte')}_misangeles_{date.today()}.{trabajo['formato']}"
+        )
+    except FileNotFoundError:
+        # El archivo se limpió entre la consulta del trabajo y el envío
+        return jsonify({'error': 'El reporte ya no está disponible, vuelve a generarlo'}), 410
+
+@tienda.route('/exportar/excel')
+def exportar_excel():
+    """Exportar inventario a Excel"""
+    return exportar_xlsx('inventario', {})
+
+@tienda.route('/exportar/<recurso>.<formato>')
+def exportar(recurso, formato):
+    """Exportar inventario, ventas o entradas (filtradas por fecha y producto) a Excel o CSV"""
+    if recurso not in FILAS_EXPORTACION or formato not in ('xlsx', 'csv'):
+        abort(404)
+    
+    filtros = leer_filtros_movimientos()
+    if request.args.get('tasas', '').strip():
+        try:
+            leer_tasas(request.args['tasas'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        filtros['tasas'] = request.args['tasas']
+    if formato == 'csv':
+        return exportar_csv(recurso, filtros)
+    return exportar_xlsx(recurso, filtros)
+
+@tienda.route('/api/productos/autocompletar')
+def api_autocompletar_productos():
+    """Sugerencias de productos por código o nombre, acotadas a MAX_SUGERENCIAS"""
+    limite = request.args.get('limite', 10, type=int)
+    return jsonify(obtener_indice_productos().buscar(request.args.get('q', ''), limite))
+
+@tienda.route('/api/productos/buscar')
+@respuesta_versionada('productos')
+def api_buscar_productos():
+    """API de búsqueda de productos: resultados por relevancia, facetas y paginación"""
+    resultado = buscar_productos(
+        request.args.get('q', ''),
+        request.args.get('categoria', '').strip(),
+        request.args.get('pagina', 1, type=int)
+    )
+    resultado['productos'] = [producto.to_dict() for producto in resultado['productos']]
+    return jsonify(resultado)
+
+@tienda.route('/api/productos/<codigo>')
+@respuesta_versionada('producto:{codigo}')
+def api_producto_por_codigo(codigo):
+    """API para buscar producto por código"""
+    producto = Producto.query.filter_by(codigo=codigo).first()
+    if producto:
+        _, stock_mayor, stock_unidades = _stock_desde_saldos([producto.id])[0]
+        return jsonify({**producto.to_dict(), 'stock_mayor': stock_mayor, 'stock_unidades': stock_unidades})
+    return jsonify({'error': 'Producto no encontrado'}), 404
+
+@tienda.route('/api/inventario')
+@respuesta_versionada('datos')
+def api_inventario():
+    """API para obtener inventario completo"""
+    inventario = calcular_inventario()
+    return jsonify(inventario)
+
+@tienda.route('/api/tasas', methods=['GET', 'POST'])
+def api_tasas():
+    """Historial de tasas de cambio (?desde, ?hasta); por POST carga tasas de días pasados: {tasas: [{fecha, tasa}]}"""
+    if request.method == 'POST':
+        datos = request.get_json(silent=True) or {}
+        tasas = []
+        for posicion, item in enumerate(datos.get('tasas') or [], 1):
+            fecha = _leer_fecha(str(item.get('fecha', ''))) if isinstance(item, dict) else None
+            try:
+                tasa = float(item.get('tasa'))
+            except (AttributeError, TypeError, ValueError):
+                tasa = 0
+            if fecha is None or not 0 < tasa < float('inf'):
+                return jsonify({'error': f'Tasa {posicion}: se espera {{"fecha": "AAAA-MM-DD", "tasa": número mayor que cero}}'}), 400
+            if fecha >= date.today():
+                return jsonify({'error': f'Tasa {posicion}: la tasa de hoy se cambia en la configuración'}), 400
+            tasas.append((fecha, tasa))
+        
+        registrar_tasas(tasas)
+        # Cambia la valoración de los inventarios a fechas pasadas
+        incrementar_version('datos')
+        db.session.commit()
+        return jsonify({'registradas': len(tasas)})
+    
+    consulta = TasaCambio.query
+    desde = _leer_fecha(request.args.get('desde'))
+    hasta = _leer_fecha(request.args.get('hasta'))
+    if desde:
+        consulta = consulta.filter(TasaCambio.fecha >= desde)
+    if hasta:
+        consulta = consulta.filter(TasaCambio.fecha <= hasta)
+    return jsonify({
+        'tasa_actual': obtener_configuracion().tasa_cambio,
+        'tasas': [tasa.to_dict() for tasa in consulta.order_by(TasaCambio.fecha)]
+    })
+
+@tienda.route('/api/escenarios-tasa')
+def api_escenarios_tasa():
+    """Inventario y ventas de ?desde a ?hasta valorados con la tasa histórica, la actual y cada una de ?tasas="""
+    try:
+        tasas = leer_tasas(request.args.get('tasas'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(escenarios_tasa(
+        tasas, _leer_fecha(request.args.get('desde')), _leer_fecha(request.args.get('hasta'))
+    ))
+
+@tienda.route('/api/analitica/productos')
+def api_analitica_productos():
+    """Analítica por producto: ?clase=A|B|C, ?reponer=1 para solo los que hay que pedir,
+    ?orden=ventas|cobertura y ?limite"""
+    analitica = obtener_analitica()
+    productos = analitica['productos']
+    
+    clase = request.args.get('clase', '').upper()
+    if clase:
+        productos = [fila for fila in productos if fila['clase'] == clase]
+    if request.args.get('reponer') in ('1', 'true', 'si'):
+        productos = [fila for fila in productos if fila['pedido_mayor'] > 0]
+    if request.args.get('orden') == 'cobertura':
+        productos = sorted(
+            productos,
+            key=lambda fila: fila['dias_cobertura'] if fila['dias_cobertura'] is not None else float('inf')
+        )
+    limite = request.args.get('limite', type=int)
+    if limite is not None:
+        productos = productos[:max(limite, 0)]
+    
+    return jsonify({**analitica, 'productos': productos})
+
+@tienda.route('/api/consolidado/<any(inventario, ventas):recurso>')
+def api_consolidado(recurso):
+    """Inventario o ventas del mes de todas las sucursales, consultadas en paralelo"""
+    hoy = date.today()
+    parametros = {'anio': hoy.year, 'mes': hoy.month, **request.args.to_dict()}
+    try:
+        reporte = TIPOS_REPORTE[f'{recurso}_consolidado'](parametros)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(reporte)
+
+@tienda.route('/metrics')
+def metricas():
+    """Métricas de este proceso en formato Prometheus"""
+    return Response(metricas_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@tienda.route('/api/<any(ventas, entradas):recurso>')
+def api_movimientos(recurso):
+    """API de ventas o entradas en streaming: NDJSON, o un arreglo JSON con ?formato=json"""
+    ndjson = request.args.get('formato', 'ndjson') != 'json'
+    return Response(
+        stream_with_context(generar_movimientos_json(recurso, leer_filtros_movimientos(), ndjson)),
+        mimetype='application/x-ndjson' if ndjson else 'application/json'
+    )
+
+@tienda.route('/subir_logo', methods=['POST'])
+def subir_logo():
+    try:
+        if 'logo' not in request.files:
+            return jsonify({'success': False, 'message': 'No se seleccionó ningún archivo'})
+        
+        file = request.files['logo']
+        if file.filename == '':
+            return jsonify({'success': False, 'message': 'No se seleccionó ningún archivo'})
+        
+        if file and allowed_file(file.filename):
+            # Guardar como logo.png (reemplaza el anterior)
+            filename = "logo.png"
+            filepath = os.path.join(current_app.root_path, 'static', 'img', filename)
+            
+            # Crear directorio si no existe
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            
+            # Guardar archivo
+            file.save(filepath)
+            
+            # Crear URL para el archivo
+            logo_url = url_for('static', filename=f'img/{filename}')
+            
+            return jsonify({
+                'success': True, 
+                'message': 'Logo subido correctamente',
+                'logo_url': logo_url
+            })
+        else:
+            return jsonify({'success': False, 'message': 'Formato de archivo no permitido'})
+            
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al subir logo: {str(e)}'})
+
+def allowed_file(filename):
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg'}
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def get_logo_url():
+    """Obtiene la URL del logo actual del sistema"""
+    logo_path = os.path.join(current_app.root_path, 'static', 'img', 'logo.png')
+    if os.path.exists(logo_path):
+        return url_for('static', filename='img/logo.png')
+    return url_for('static', filename='img/default-logo.png')
+
+# ===== INICIALIZACIÓN =====
+
+def inicializar_base_datos():
+    """Crea las tablas, aplica las migraciones y carga los datos de ejemplo"""
+    db.metadata.create_all(motor_sucursal())
+    aplicar_migraciones()
+    
+    # Crear configuración por defecto
+    if not Configuracion.query.first():
+        config = Configuracion()
+        db.session.add(config)
+        db.session.commit()
+    
+    # Crear productos de ejemplo
+    if not Producto.query.first():
+        productos_ejemplo = [
+            Producto(
+                codigo='H001',
+                nombre='Huevos',
+                descripcion='Huevos de gallina frescos',
+                categoria='Proteínas',
+                precio_detal_usd=0.15,
+                precio_mayor_usd=0.12,
+                equivalencia=30
+            ),
+            Producto(
+                codigo='A001',
+                nombre='Arroz',
+                descripcion='Arroz blanco premium',
+                categoria='Granos',
+                precio_detal_usd=2.50,
+                precio_mayor_usd=2.00,
+                equivalencia=25
+            ),
+            Producto(
+                codigo='AC001',
+                nombre='Aceite',
+                descripcion='Aceite de cocina vegetal',
+                categoria='Aceites',
+                precio_detal_usd=3.00,
+                precio_mayor_usd=2.40,
+                equivalencia=12
+            )
+        ]
+        
+        for producto in productos_ejemplo:
+            db.session.add(producto)
+        
+        db.session.commit()
+    
+    # Bases de datos anteriores a la tabla de saldos: construirla desde el historial
+    if not StockProducto.query.first() and (Entrada.query.first() or Venta.query.first()):
+        reconstruir_saldos_stock()
+    
+    # Igual para el resumen diario de ventas
+    if not VentaDiaria.query.first() and Venta.query.first():
+        reconstruir_ventas_diarias()
+
+def comando_por_sucursal(comando):
+    """Agrega --sucursal a un comando y lo ejecuta sobre la base de cada sucursal (todas por defecto)"""
+    @click.option('--sucursal', help='Solo esta sucursal (por defecto, todas)')
+    @functools.wraps(comando)
+    def envoltura(sucursal, **kwargs):
+        sucursales = claves_sucursales()
+        if sucursal is not None:
+            if sucursal not in sucursales:
+                raise click.BadParameter(f'Sucursales configuradas: {", ".join(map(str, sucursales))}',
+                                         param_hint='--sucursal')
+            sucursales = [sucursal]
+        for clave in sucursales:
+            if clave is not None:
+                click.echo(f'🏪 Sucursal {clave}')
+            with contexto_sucursal(current_app._get_current_object(), clave):
+                comando(**kwargs)
+    return envoltura
+
+@tienda.cli.command('inicializar-db')
+@comando_por_sucursal
+def inicializar_db_comando():
+    """Crea o actualiza la base de datos (ejecutar al instalar y después de cada actualización)"""
+    inicializar_base_datos()
+    click.echo('✅ Base de datos inicializada')
+
+@tienda.cli.command('verificar-stock')
+@click.option('--reparar', is_flag=True, help='Reconstruye los saldos desde el historial')
+@comando_por_sucursal
+def verificar_stock_comando(reparar):
+    """Verifica los saldos de stock contra el historial de entradas y ventas"""
+    diferencias = verificar_saldos_stock(reparar=reparar)
+    
+    for diferencia in diferencias:
+        click.echo(
+            f"{diferencia['codigo']}: "
+            f"mayor {diferencia['stock_mayor_guardado']} != {diferencia['stock_mayor_historial']}, "
+            f"unidades {diferencia['stock_unidades_guardado']} != {diferencia['stock_unidades_historial']}"
+        )
+    
+    if not diferencias:
+        click.echo('✅ Saldos de stock correctos')
+    elif reparar:
+        click.echo(f'🔧 {len(diferencias)} saldos reconstruidos desde el historial')
+    else:
+        click.echo(f'⚠️ {len(diferencias)} saldos con diferencias (use --reparar)')
+
+@tienda.cli.command('cerrar-inventario')
+@click.option('--fecha', help='Fecha del cierre (AAAA-MM-DD); sin ella se toman los cierres pendientes')
+@click.option('--periodo', type=click.Choice(['diario', 'mensual']), default='diario')
+@comando_por_sucursal
+def cerrar_inventario_comando(fecha, periodo):
+    """Toma cierres de inventario (pensado para ejecutarse a diario con cron o el programador de tareas)"""
+    if fecha:
+        fecha_cierre = _leer_fecha(fecha)
+        if fecha_cierre is None:
+            raise click.BadParameter('Use el formato AAAA-MM-DD', param_hint='--fecha')
+        cierres = [tomar_cierre_inventario(fecha_cierre, periodo)]
+    else:
+        cierres = cerrar_periodos_pendientes()
+    for cierre in cierres:
+        click.echo(f'✅ Cierre {cierre.periodo} del {cierre.fecha:%d/%m/%Y}: '
+                   f'${cierre.total_usd:,.2f} / Bs {cierre.total_bs:,.2f} (tasa {cierre.tasa_cambio})')
+    if not cierres:
+        click.echo('✅ No hay cierres pendientes')
+
+@tienda.cli.command('reconstruir-ventas-diarias')
+@comando_por_sucursal
+def reconstruir_ventas_diarias_comando():
+    """Recalcula el resumen diario de ventas desde el historial"""
+    reconstruir_ventas_diarias()
+    click.echo(f'✅ Resumen diario reconstruido: {VentaDiaria.query.count()} filas')
+
+@tienda.cli.command('archivar-historial')
+@click.option('--hasta-anio', type=int, help='Último año a archivar (por defecto, el año pasado)')
+@click.option('--compactar', is_flag=True, help='Ejecuta VACUUM al terminar para reducir el archivo de la base')
+@comando_por_sucursal
+def archivar_historial_comando(hasta_anio, compactar):
+    """Mueve las entradas y ventas de los años cerrados a sus tablas de archivo (entrada_AAAA, venta_AAAA)"""
+    try:
+        archivados = archivar_historial(hasta_anio or date.today().year - 1)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--hasta-anio')
+    for archivo in archivados:
+        click.echo(f'✅ {archivo.anio}: {archivo.ventas} ventas y {archivo.entradas} entradas archivadas')
+    if not archivados:
+        click.echo('✅ No hay años pendientes de archivar')
+    if compactar:
+        compactar_base()
+    for tabla, tamano in tamano_tablas('venta', 'entrada').items():
+        tamano_kb = f", {tamano['bytes'] / 1024:,.0f} KB" if tamano['bytes'] is not None else ''
+        click.echo(f"   Tabla activa {tabla}: {tamano['filas']} filas{tamano_kb}")
+
+@tienda.cli.command('migrar')
+@comando_por_sucursal
+def migrar_comando():
+    """Aplica las migraciones de esquema pendientes"""
+    db.metadata.create_all(motor_sucursal())
+    aplicadas = aplicar_migraciones()
+    for version, descripcion in aplicadas:
+        click.echo(f'✅ Migración {version}: {descripcion}')
+    if not aplicadas:
+        click.echo('✅ El esquema ya está actualizado')
+
+@tienda.cli.command('explicar-consultas')
+@comando_por_sucursal
+def explicar_consultas_comando():
+    """Verifica con EXPLAIN QUERY PLAN que las consultas frecuentes usan índices"""
+    resultados = explicar_consultas_frecuentes()
+    for resultado in resultados:
+        marca = '✅' if resultado['usa_indice'] else '❌'
+        click.echo(f"{marca} {resultado['nombre']}")
+        for paso in resultado['plan']:
+            click.echo(f'     {paso}')
+    if not all(resultado['usa_indice'] for resultado in resultados):
+        raise SystemExit(1)
+
+# ===== APLICACIÓN =====
+
+def create_app(perfil=None, **configuracion):
+    """Crea la aplicación con un perfil de PERFILES y configuración adicional opcional"""
+    app = Flask(__name__)
+    app.config.from_object(PERFILES[perfil or os.environ.get('MISANGELES_PERFIL', 'produccion')])
+    app.config.update(configuracion)
+    # Cada sucursal es un bind con su propio motor; la sesión elige el de la petición
+    app.config['SQLALCHEMY_BINDS'] = {**app.config.get('SQLALCHEMY_BINDS', {}), **app.config['SUCURSALES']}
+    
+    db.init_app(app)
+    with app.app_context():
+        for motor in db.engines.values():
+            event.listen(motor, 'connect', _configurador_sqlite(app.config['SQLITE_PRAGMAS']))
+    
+    # Cachés en memoria por aplicación, para que dos apps del mismo proceso no compartan datos
+    app.extensions['misangeles'] = {
+        # sucursal -> (versión, ConfiguracionActual)
+        'configuracion': {},
+        # sucursal -> (firma de versiones y día, resultado)
+        'analitica': {},
+        # clave -> trabajo de reporte
+        'trabajos_reportes': {},
+        # sucursal -> IndiceProductos
+        'indices_productos': {},
+        # (sucursal, ruta completa) -> (etag, cuerpo, tipo MIME)
+        'respuestas': OrderedDict(),
+        # endpoint -> MetricasEndpoint
+        'metricas': {}
+    }
+    
+    # Hilos auxiliares por aplicación; arrancan con la primera petición que los usa
+    app.extensions['perfilador'] = PerfiladorMuestreo(app.config['PERFILADOR_INTERVALO_MS'] / 1000)
+    app.extensions['difusor_tablero'] = {
+        sucursal: DifusorEventos(app, INTERVALO_EVENTOS, sucursal)
+        for sucursal in list(app.config['SUCURSALES']) or [None]
+    }
+    
+    app.before_request(_seleccionar_sucursal)
+    app.before_request(_iniciar_medidas)
+    app.after_request(_agregar_server_timing)
+    app.teardown_request(_registrar_medidas)
+    before_render_template.connect(_antes_de_render, app)
+    template_rendered.connect(_despues_de_render, app)
+    
+    app.register_blueprint(tienda)
+    return app
+
+if __name__ == '__main__':
+    app = create_app('desarrollo')
+    with app.app_context():
+        inicializar_base_datos()
+    print("🚀 Sistema de Gestión Mis Angeles iniciado")
+    print("📱 Accede a: http://localhost:5000")
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de las rutas y del motor de stock con datos sintéticos
+Ejecuta: python benchmark.py --productos 10000 --ventas 1000000 --entradas 200000 --salida resultados.json
+Compara: python benchmark.py --comparar antes.json despues.json
+Archivo histórico: python benchmark.py --dias 1095 --archivar 2025 --salida archivado.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+
+FILAS_POR_LOTE = 50000
+
+# (nombre, URL) de las rutas que se miden con el cliente de pruebas de Flask
+RUTAS = [
+    ('dashboard', '/'),
+    ('inventario', '/inventario'),
+    ('inventario_tasas', '/inventario?tasas=40,50,60'),
+    ('ventas', '/ventas'),
+    ('ventas_filtradas', '/ventas?tipo=Mayor'),
+    ('ventas_anio_pasado', '/ventas?desde={inicio_anio_pasado}&hasta={fin_anio_pasado}'),
+    ('entradas', '/entradas'),
+    ('reportes', '/reportes'),
+    ('productos', '/productos'),
+    ('productos_busqueda', '/productos?q=arroz'),
+    ('exportar_excel', '/exportar/excel'),
+    ('api_inventario', '/api/inventario'),
+    ('api_producto', '/api/productos/{codigo}'),
+    ('api_autocompletar', '/api/productos/autocompletar?q=arr'),
+    ('api_buscar', '/api/productos/buscar?q=arroz'),
+    ('api_ventas', '/api/ventas?desde={hace_30_dias}'),
+    ('api_entradas', '/api/entradas?desde={hace_30_dias}'),
+    ('api_analitica', '/api/analitica/productos?reponer=1&orden=cobertura&limite=50'),
+    ('api_escenarios_tasa', '/api/escenarios-tasa?tasas=40,50,60&desde={inicio_anio_pasado}'),
+]
+
+NOMBRES = ['Arroz', 'Harina', 'Aceite', 'Azúcar', 'Café', 'Pasta', 'Leche', 'Huevos', 'Queso', 'Atún']
+CATEGORIAS = ['Granos', 'Aceites', 'Lácteos', 'Proteínas', 'Otros']
+
+def percentil(valores, p):
+    """Percentil p de una lista de tiempos"""
+    if not valores:
+        return 0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+def resumir(tiempos):
+    """Estadísticas en milisegundos de una lista de duraciones en segundos"""
+    return {
+        'min_ms': round(min(tiempos) * 1000, 2),
+        'p50_ms': round(percentil(tiempos, 50) * 1000, 2),
+        'p95_ms': round(percentil(tiempos, 95) * 1000, 2),
+        'max_ms': round(max(tiempos) * 1000, 2)
+    }
+
+def commit_actual():
+    """Commit de git del árbol medido, si está disponible"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def generar_datos(m, aplicacion, parametros):
+    """Llena una base vacía con productos, entradas y ventas repartidos en los últimos días"""
+    rng = random.Random(parametros['semilla'])
+    hoy = date.today()
+    
+    with aplicacion.app_context():
+        m.db.session.execute(m.db.insert(m.Producto), [
+            {
+                'codigo': f'B{i:06d}',
+                'nombre': f'{rng.choice(NOMBRES)} {i}',
+                'descripcion': f'Producto sintético {i}',
+                'categoria': rng.choice(CATEGORIAS),
+                'precio_detal_usd': round(rng.uniform(0.5, 10), 2),
+                'precio_mayor_usd': round(rng.uniform(0.4, 8), 2),
+                'equivalencia': rng.choice([1, 6, 12, 24, 30])
+            }
+            for i in range(parametros['productos'])
+        ])
+        m.db.session.commit()
+        
+        productos = m.Producto.query.all()
+        config = m.obtener_configuracion()
+        
+        def fecha_aleatoria():
+            return hoy - timedelta(days=rng.randrange(parametros['dias']))
+        
+        for inicio in range(0, parametros['entradas'], FILAS_POR_LOTE):
+            lote = []
+            for _ in range(min(FILAS_POR_LOTE, parametros['entradas'] - inicio)):
+                producto = rng.choice(productos)
+                tipo = rng.choice(['Mayor', 'Detal'])
+                lote.append(m.datos_entrada(producto, fecha_aleatoria(), tipo, rng.randint(1, 50)))
+            m.db.session.execute(m.db.insert(m.Entrada), lote)
+            m.db.session.commit()
+        
+        for inicio in range(0, parametros['ventas'], FILAS_POR_LOTE):
+            lote = []
+            for _ in range(min(FILAS_POR_LOTE, parametros['ventas'] - inicio)):
+                producto = rng.choice(productos)
+                tipo = rng.choice(['Mayor', 'Detal'])
+                precio = m.precio_segun_tipo(producto, tipo)
+                lote.append(m.datos_venta(producto.id, fecha_aleatoria(), tipo, rng.randint(1, 5), precio, config))
+            m.db.session.execute(m.db.insert(m.Venta), lote)
+            m.db.session.commit()
+        
+        # Una tasa por día que sube de a poco hasta la actual, como con una devaluación sostenida
+        m.registrar_tasas([
+            (hoy - timedelta(days=dia), round(config.tasa_cambio * 0.999 ** dia, 4))
+            for dia in range(1, parametros['dias'] + 1)
+        ])
+        m.reconstruir_saldos_stock()
+        m.reconstruir_ventas_diarias()
+        m.incrementar_version('datos', 'productos')
+        m.db.session.commit()
+
+def preparar_base(ruta_db, parametros, reutilizar):
+    """Deja lista la base sintética; la reutiliza si se generó con los mismos parámetros"""
+    ruta_parametros = ruta_db + '.json'
+    if reutilizar and os.path.exists(ruta_db) and os.path.exists(ruta_parametros):
+        with open(ruta_parametros, encoding='utf-8') as archivo:
+            if json.load(archivo) == parametros:
+                return None
+    
+    for ruta in (ruta_db, ruta_db + '-wal', ruta_db + '-shm', ruta_parametros):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    return ruta_parametros
+
+def copiar_base(origen, destino):
+    """Copia la base sintética con la API de backup de SQLite, para archivarla sin tocar la original"""
+    for ruta in (destino, destino + '-wal', destino + '-shm'):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    fuente, copia = sqlite3.connect(origen), sqlite3.connect(destino)
+    try:
+        fuente.backup(copia)
+    finally:
+        fuente.close()
+        copia.close()
+
+def medir_tablas(m, aplicacion):
+    """Filas y bytes de las tablas activas de movimientos"""
+    with aplicacion.app_context():
+        tablas = m.tamano_tablas('venta', 'entrada', 'venta_diaria')
+    for nombre, tamano in tablas.items():
+        tamano_mb = f"{tamano['bytes'] / 1024 / 1024:8.1f} MB" if tamano['bytes'] is not None else ''
+        print(f"{nombre:<20} {tamano['filas']:>10} filas  {tamano_mb}")
+    return tablas
+
+def contar_consultas(m, aplicacion):
+    """Registra un contador de sentencias SQL sobre el motor de la aplicación"""
+    contador = {'consultas': 0}
+    
+    def al_ejecutar(*args):
+        contador['consultas'] += 1
+    
+    with aplicacion.app_context():
+        event.listen(m.db.engine, 'before_cursor_execute', al_ejecutar)
+    return contador
+
+def medir_rutas(m, aplicacion, contador, repeticiones, con_cache):
+    """Tiempo, consultas SQL y tamaño de respuesta de cada ruta"""
+    cliente = aplicacion.test_client()
+    with aplicacion.app_context():
+        codigo = m.db.session.query(m.Producto.codigo).order_by(m.Producto.id).limit(1).scalar()
+    anio_pasado = date.today().year - 1
+    valores = {
+        'codigo': codigo,
+        'hace_30_dias': (date.today() - timedelta(days=30)).isoformat(),
+        'inicio_anio_pasado': date(anio_pasado, 1, 1).isoformat(),
+        'fin_anio_pasado': date(anio_pasado, 12, 31).isoformat()
+    }
+    
+    resultados = {}
+    for nombre, plantilla in RUTAS:
+        url = plantilla.format(**valores)
+        cliente.get(url).close()  # calentamiento
+        tiempos, consultas = [], []
+        for _ in range(repeticiones):
+            if not con_cache:
+                aplicacion.extensions['misangeles']['respuestas'].clear()
+                aplicacion.extensions['misangeles']['analitica'].clear()
+            contador['consultas'] = 0
+            inicio = time.perf_counter()
+            respuesta = cliente.get(url)
+            cuerpo = respuesta.get_data()
+            tiempos.append(time.perf_counter() - inicio)
+            consultas.append(contador['consultas'])
+            respuesta.close()
+        resultados[nombre] = {
+            'url': url,
+            'estado': respuesta.status_code,
+            'bytes': len(cuerpo),
+            'consultas_sql': max(consultas),
+            **resumir(tiempos)
+        }
+        print(f"{nombre:<20} {respuesta.status_code}  p50 {resultados[nombre]['p50_ms']:9.2f} ms  "
+              f"{resultados[nombre]['consultas_sql']:3d} consultas  {len(cuerpo):>10} bytes")
+    return resultados
+
+def medir_funciones(m, aplicacion, contador, repeticiones):
+    """Tiempo del motor de stock: saldos, historial completo y un producto"""
+    with aplicacion.app_context():
+        producto_id = m.db.session.query(m.StockProducto.producto_id).limit(1).scalar()
+        funciones = [
+            ('calcular_stock_producto', lambda: m.calcular_stock_producto(producto_id)),
+            ('calcular_inventario', lambda: m.calcular_inventario()),
+            ('calcular_inventario_historial', lambda: m.calcular_inventario(desde_historial=True)),
+            ('verificar_saldos_stock', lambda: m.verificar_saldos_stock()),
+            ('calcular_analitica', lambda: m.calcular_analitica()),
+            ('escenarios_tasa', lambda: m.escenarios_tasa([40, 50, 60], date.today() - timedelta(days=365))),
+        ]
+        resultados = {}
+        for nombre, funcion in funciones:
+            tiempos, consultas = [], []
+            for _ in range(repeticiones):
+                contador['consultas'] = 0
+                inicio = time.perf_counter()
+                funcion()
+                tiempos.append(time.perf_counter() - inicio)
+                consultas.append(contador['consultas'])
+                m.db.session.rollback()
+            resultados[nombre] = {'consultas_sql': max(consultas), **resumir(tiempos)}
+            print(f"{nombre:<30} p50 {resultados[nombre]['p50_ms']:9.2f} ms  "
+                  f"{resultados[nombre]['consultas_sql']:3d} consultas")
+    return resultados
+
+def medir_arranque(repeticiones):
+    """Tiempo de un proceso nuevo en importar app.py y crear la aplicación, como al iniciar un worker"""
+    codigo = ('import time; inicio = time.perf_counter(); import app; app.create_app(); '
+              'print(time.perf_counter() - inicio)')
+    carpeta = os.path.dirname(os.path.abspath(__file__))
+    tiempos = [
+        float(subprocess.check_output([sys.executable, '-c', codigo], cwd=carpeta, text=True))
+        for _ in range(repeticiones)
+    ]
+    resultados = {'importar_y_crear_app': {'consultas_sql': 0, **resumir(tiempos)}}
+    print(f"{'importar_y_crear_app':<30} p50 {resultados['importar_y_crear_app']['p50_ms']:9.2f} ms")
+    return resultados
+
+def comparar(antes, despues):
+    """Muestra la variación de p50 y de consultas SQL entre dos resultados"""
+    with open(antes, encoding='utf-8') as archivo:
+        base = json.load(archivo)
+    with open(despues, encoding='utf-8') as archivo:
+        nuevo = json.load(archivo)
+    
+    print(f"{base.get('commit')} -> {nuevo.get('commit')}")
+    for nombre, tamano in nuevo.get('tablas', {}).items():
+        anterior = base.get('tablas', {}).get(nombre)
+        if anterior:
+            print(f"{nombre:<30} {anterior['filas']:>10} -> {tamano['filas']:>10} filas  "
+                  f"{(anterior['bytes'] or 0) / 1024 / 1024:8.1f} -> {(tamano['bytes'] or 0) / 1024 / 1024:8.1f} MB")
+    for grupo in ('rutas', 'funciones', 'arranque'):
+        for nombre, medida in nuevo.get(grupo, {}).items():
+            anterior = base.get(grupo, {}).get(nombre)
+            if not anterior:
+                continue
+            cambio = (medida['p50_ms'] / anterior['p50_ms'] - 1) * 100 if anterior['p50_ms'] else 0
+            print(f"{nombre:<30} {anterior['p50_ms']:9.2f} -> {medida['p50_ms']:9.2f} ms ({cambio:+6.1f}%)  "
+                  f"consultas {anterior['consultas_sql']} -> {medida['consultas_sql']}")
+
+def main():
+    """Genera la base sintética, mide rutas y funciones y guarda el resultado en JSON"""
+    parser = argparse.ArgumentParser(description='Benchmark de Misangeles con datos sintéticos')
+    parser.add_argument('--productos', type=int, default=10000)
+    parser.add_argument('--ventas', type=int, default=1000000)
+    parser.add_argument('--entradas', type=int, default=200000)
+    parser.add_argument('--dias', type=int, default=365, help='Días de historial hacia atrás desde hoy')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'misangeles_benchmark.db'))
+    parser.add_argument('--reutilizar', action='store_true', help='No regenerar si la base ya tiene estos parámetros')
+    parser.add_argument('--con-cache', action='store_true', help='Medir con la caché de respuestas activa')
+    parser.add_argument('--archivar', type=int, metavar='ANIO',
+                        help='Medir sobre una copia de la base con los años hasta ANIO archivados')
+    parser.add_argument('--compactar', action='store_true', help='Con --archivar, ejecutar VACUUM después de archivar')
+    parser.add_argument('--salida', default='benchmark.json')
+    parser.add_argument('--comparar', nargs=2, metavar=('ANTES', 'DESPUES'))
+    args = parser.parse_args()
+    
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+    
+    parametros = {
+        'productos': args.productos,
+        'ventas': args.ventas,
+        'entradas': args.entradas,
+        'dias': args.dias,
+        'semilla': args.semilla
+    }
+    ruta_db = os.path.abspath(args.db)
+    ruta_parametros = preparar_base(ruta_db, parametros, args.reutilizar)
+    
+    import app as m
+    aplicacion = m.create_app('produccion', SQLALCHEMY_DATABASE_URI='sqlite:///' + ruta_db)
+    
+    generacion = None
+    if ruta_parametros:
+        print(f'Generando datos sintéticos en {ruta_db}...')
+        inicio = time.perf_counter()
+        with aplicacion.app_context():
+            m.inicializar_base_datos()
+        generar_datos(m, aplicacion, parametros)
+        generacion = round(time.perf_counter() - inicio, 2)
+        with open(ruta_parametros, 'w', encoding='utf-8') as archivo:
+            json.dump(parametros, archivo)
+        print(f'Datos generados en {generacion}s')
+    else:
+        with aplicacion.app_context():
+            m.inicializar_base_datos()
+    
+    archivado = None
+    if args.archivar:
+        ruta_archivada = f'{os.path.splitext(ruta_db)[0]}_archivado_{args.archivar}.db'
+        copiar_base(ruta_db, ruta_archivada)
+        aplicacion = m.create_app('produccion', SQLALCHEMY_DATABASE_URI='sqlite:///' + ruta_archivada)
+        print(f'Archivando hasta {args.archivar} en {ruta_archivada}...')
+        inicio = time.perf_counter()
+        with aplicacion.app_context():
+            anios = [archivo.anio for archivo in m.archivar_historial(args.archivar)]
+            if args.compactar:
+                m.compactar_base()
+        archivado = {
+            'hasta_anio': args.archivar,
+            'anios': anios,
+            'compactada': args.compactar,
+            'segundos': round(time.perf_counter() - inicio, 2)
+        }
+        print(f"Años archivados {anios} en {archivado['segundos']}s")
+    
+    contador = contar_consultas(m, aplicacion)
+    resultado = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_actual(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'parametros': parametros,
+        'repeticiones': args.repeticiones,
+        'con_cache': args.con_cache,
+        'generacion_s': generacion,
+        'archivado': archivado,
+        'tablas': medir_tablas(m, aplicacion),
+        'rutas': medir_rutas(m, aplicacion, contador, args.repeticiones, args.con_cache),
+        'funciones': medir_funciones(m, aplicacion, contador, args.repeticiones),
+        'arranque': medir_arranque(args.repeticiones)
+    }
+    
+    with open(args.salida, 'w', encoding='utf-8') as archivo:
+        json.dump(resultado, archivo, ensure_ascii=False, indent=2)
+    print(f'Resultados guardados en {args.salida}')
+
+if __name__ == '__main__':
+    main()
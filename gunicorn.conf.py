@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Configuración de gunicorn para producción
+Ejecuta: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import multiprocessing
+import os
+
+from app import ConfiguracionBase
+
+bind = os.environ.get('MISANGELES_BIND', '0.0.0.0:5000')
+
+# Varios procesos para las lecturas; SQLite en modo WAL permite que lean
+# mientras otro escribe. Cada proceso atiende varias peticiones con hilos.
+workers = int(os.environ.get('MISANGELES_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+# MISANGELES_HILOS son para las peticiones normales; cada conexión del tablero
+# en vivo se queda con un hilo propio, así que se suman aparte y no las frenan
+threads = int(os.environ.get('MISANGELES_HILOS', 4)) + ConfiguracionBase.TABLERO_MAX_CLIENTES
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+def on_starting(server):
+    """Comprueba una sola vez, antes de iniciar los workers, que la base esté inicializada"""
+    # Se usa una aplicación aparte: cada worker crea la suya (y sus conexiones) al importar wsgi
+    from app import MENSAJE_ESQUEMA_PENDIENTE, create_app, db, esquema_actualizado
+    
+    aplicacion = create_app()
+    with aplicacion.app_context():
+        actualizado = esquema_actualizado()
+        for motor in db.engines.values():
+            motor.dispose()
+    if not actualizado:
+        raise SystemExit(MENSAJE_ESQUEMA_PENDIENTE)
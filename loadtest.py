@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga con varios cajeros concurrentes
+Ejecuta: python loadtest.py --url http://localhost:5000 --cajeros 16 --segundos 30
+Compara el cobro de compras de 15 productos en un ticket o línea por línea:
+    python loadtest.py --lineas 15 --modo ticket
+    python loadtest.py --lineas 15 --modo lineas
+Mide la sincronización de una caja que vuelve a tener conexión con 2000 ventas:
+    python loadtest.py --sincronizar 2000 --lineas 3
+"""
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import date
+
+LECTURAS = ['/', '/inventario', '/ventas', '/api/inventario']
+
+class SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    """Las ventas responden con una redirección que no hace falta seguir"""
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+_cliente = urllib.request.build_opener(SinRedirecciones)
+
+def percentil(valores, p):
+    """Percentil p de una lista de tiempos"""
+    if not valores:
+        return 0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+def enviar(peticion):
+    """Envía una petición y devuelve 'ok', 'sin_stock' o 'error'"""
+    try:
+        with _cliente.open(peticion, timeout=60) as respuesta:
+            respuesta.read()
+        return 'ok'
+    except urllib.error.HTTPError as e:
+        if e.code == 409:
+            return 'sin_stock'
+        if e.code < 400:
+            # El formulario vuelve a /ventas/nueva cuando no registra la venta
+            return 'sin_stock' if e.headers.get('Location', '').endswith('/ventas/nueva') else 'ok'
+        return 'error'
+    except OSError:
+        return 'error'
+
+def comprar(url, lineas, modo):
+    """Cobra una compra completa: un solo ticket o una venta por línea como antes"""
+    hoy = date.today().isoformat()
+    if modo == 'ticket':
+        datos = json.dumps({'fecha': hoy, 'lineas': lineas}).encode()
+        return enviar(urllib.request.Request(
+            url + '/api/tickets', data=datos, headers={'Content-Type': 'application/json'}
+        ))
+    
+    resultado = 'ok'
+    for linea in lineas:
+        datos = urllib.parse.urlencode({**linea, 'fecha': hoy}).encode()
+        estado = enviar(urllib.request.Request(url + '/ventas/nueva', data=datos))
+        if estado != 'ok':
+            resultado = estado
+    return resultado
+
+def cajero(url, codigos, proporcion_escrituras, lineas, modo, fin, resultados, bloqueo):
+    """Alterna consultas y compras hasta que se acabe el tiempo"""
+    while time.time() < fin:
+        escritura = random.random() < proporcion_escrituras
+        inicio = time.perf_counter()
+        if escritura:
+            compra = [
+                {'codigo': codigo, 'tipo_venta': random.choice(['Mayor', 'Detal']), 'cantidad': 1}
+                for codigo in random.sample(codigos, min(lineas, len(codigos)))
+            ]
+            estado = comprar(url, compra, modo)
+        else:
+            estado = enviar(urllib.request.Request(url + random.choice(LECTURAS)))
+        duracion = time.perf_counter() - inicio
+        
+        with bloqueo:
+            clave = 'escrituras' if escritura else 'lecturas'
+            resultados[clave].append(duracion)
+            if escritura and estado == 'ok':
+                resultados['cobradas'] += 1
+            if estado == 'error':
+                resultados['errores'] += 1
+            elif estado == 'sin_stock':
+                resultados['sin_stock'] += 1
+
+def sincronizar(url, codigos, cantidad, lineas):
+    """Envía en un lote comprimido las ventas acumuladas sin conexión y lo reenvía para medir la deduplicación"""
+    hoy = date.today().isoformat()
+    ventas = [
+        {
+            'clave': str(uuid.uuid4()),
+            'fecha': hoy,
+            'lineas': [
+                {'codigo': codigo, 'tipo_venta': 'Detal', 'cantidad': 1}
+                for codigo in random.sample(codigos, min(lineas, len(codigos)))
+            ]
+        }
+        for _ in range(cantidad)
+    ]
+    cuerpo = gzip.compress(json.dumps({'ventas': ventas}).encode())
+    
+    for intento in ('Envío', 'Reenvío'):
+        peticion = urllib.request.Request(url + '/api/sincronizacion/ventas', data=cuerpo, headers={
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            'Accept-Encoding': 'gzip'
+        })
+        inicio = time.perf_counter()
+        with _cliente.open(peticion, timeout=600) as respuesta:
+            datos = respuesta.read()
+            if respuesta.headers.get('Content-Encoding') == 'gzip':
+                datos = gzip.decompress(datos)
+        duracion = time.perf_counter() - inicio
+        print(f"{intento:<8} {cantidad} ventas en {duracion:6.2f} s  "
+              f"({len(cuerpo) / 1024:.0f} KB enviados)  {json.loads(datos)['resumen']}")
+
+def main():
+    """Lanza los cajeros y muestra el rendimiento de lecturas y escrituras"""
+    parser = argparse.ArgumentParser(description='Prueba de carga de Misangeles')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--cajeros', type=int, default=16, help='Clientes concurrentes')
+    parser.add_argument('--segundos', type=int, default=30)
+    parser.add_argument('--escrituras', type=float, default=0.3, help='Proporción de peticiones que son compras')
+    parser.add_argument('--lineas', type=int, default=1, help='Productos distintos por compra')
+    parser.add_argument('--modo', choices=['ticket', 'lineas'], default='ticket',
+                        help='ticket: una sola petición por compra; lineas: una venta por producto')
+    parser.add_argument('--sincronizar', type=int, default=0, metavar='VENTAS',
+                        help='Enviar estas ventas en un lote de sincronización en vez de la prueba de carga')
+    args = parser.parse_args()
+    
+    # Solo productos con stock, para medir cobros y no rechazos
+    with urllib.request.urlopen(args.url + '/api/inventario') as respuesta:
+        codigos = [
+            item['producto']['codigo'] for item in json.load(respuesta)
+            if item['stock']['stock_mayor'] >= 1 and item['stock']['stock_unidades'] >= 1
+        ]
+    
+    if args.sincronizar:
+        sincronizar(args.url, codigos, args.sincronizar, args.lineas)
+        return
+    
+    resultados = {'lecturas': [], 'escrituras': [], 'errores': 0, 'sin_stock': 0, 'cobradas': 0}
+    bloqueo = threading.Lock()
+    fin = time.time() + args.segundos
+    hilos = [
+        threading.Thread(target=cajero, args=(
+            args.url, codigos, args.escrituras, args.lineas, args.modo, fin, resultados, bloqueo
+        ))
+        for _ in range(args.cajeros)
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    
+    print(f"Cajeros: {args.cajeros}  Duración: {args.segundos}s  Modo: {args.modo}  Líneas por compra: {args.lineas}")
+    print(f"Errores: {resultados['errores']}  Rechazadas por stock: {resultados['sin_stock']}")
+    print(f"Líneas vendidas: {resultados['cobradas'] * args.lineas / args.segundos:.1f} /s")
+    for clave, nombre in (('lecturas', 'Lecturas'), ('escrituras', 'Compras')):
+        tiempos = resultados[clave]
+        print(
+            f"{nombre:<11} {len(tiempos) / args.segundos:8.1f} req/s  "
+            f"p50 {percentil(tiempos, 50) * 1000:7.1f} ms  "
+            f"p95 {percentil(tiempos, 95) * 1000:7.1f} ms  "
+            f"p99 {percentil(tiempos, 99) * 1000:7.1f} ms"
+        )
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,28 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-"""
-Archivo de inicio para la aplicación web
-Ejecuta: python run.py
-"""
-
-from app import app, inicializar_base_datos
-
-if __name__ == '__main__':
-    print("🚀 INICIANDO SISTEMA DE GESTIÓN MIS ÁNGELES")
-    print("=" * 50)
-    
-    # Inicializar base de datos
-    inicializar_base_datos()
-    print("✅ Base de datos inicializada")
-    
-    # Iniciar aplicación
-    print("🌐 Iniciando servidor web...")
-    print("📱 Accede a: http://localhost:5000")
-    print("💻 Para detener: Ctrl+C")
-    print("=" * 50)
-    
-    app.run(debug=True, host='0.0.0.0', port=5000)
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Archivo de inicio para la aplicación web
+Ejecuta: python run.py
+"""
+
+from app import create_app, inicializar_base_datos
+
+app = create_app('desarrollo')
+
+if __name__ == '__main__':
+    print("🚀 INICIANDO SISTEMA DE GESTIÓN MIS ÁNGELES")
+    print("=" * 50)
+    
+    # En desarrollo la base se prepara en cada inicio; en producción se usa
+    # el comando `flask --app wsgi inicializar-db`
+    with app.app_context():
+        inicializar_base_datos()
+    print("✅ Base de datos inicializada")
+    
+    # Iniciar aplicación
+    print("🌐 Iniciando servidor web...")
+    print("📱 Accede a: http://localhost:5000")
+    print("💻 Para detener: Ctrl+C")
+    print("=" * 50)
+    
+    app.run(host='0.0.0.0', port=5000)
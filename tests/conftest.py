@@ -0,0 +1,50 @@
+"""Fixtures comunes: aplicaciones del perfil de pruebas con los productos de ejemplo"""
+import sys
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import ConfiguracionBase, create_app, inicializar_base_datos
+
+
+def _preparar(app):
+    with app.app_context():
+        inicializar_base_datos()
+    return app
+
+
+@pytest.fixture
+def app():
+    """Base en memoria: una sola conexión compartida, para pruebas de un solo hilo"""
+    return _preparar(create_app('pruebas', SUCURSALES={}))
+
+
+@pytest.fixture
+def app_archivo(tmp_path):
+    """Base en un archivo con los PRAGMA de producción, para pruebas con varios hilos"""
+    return _preparar(create_app(
+        'pruebas',
+        SUCURSALES={},
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "misangeles.db"}',
+        SQLALCHEMY_ENGINE_OPTIONS={},
+        SQLITE_PRAGMAS=ConfiguracionBase.SQLITE_PRAGMAS
+    ))
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def registrar_entrada(client, codigo, cantidad, tipo='Mayor', fecha=None):
+    """Carga stock con el formulario de nueva entrada"""
+    respuesta = client.post('/entradas/nueva', data={
+        'codigo_producto': codigo,
+        'tipo_entrada': tipo,
+        'cantidad': str(cantidad),
+        'fecha': (fecha or date.today()).isoformat()
+    })
+    assert respuesta.status_code == 302
@@ -0,0 +1,16 @@
+"""Las consultas frecuentes deben resolverse con un índice"""
+from app import CONSULTAS_FRECUENTES, explicar_consultas_frecuentes
+
+
+def test_consultas_frecuentes_usan_indice(app):
+    with app.app_context():
+        resultados = explicar_consultas_frecuentes()
+    assert [resultado['nombre'] for resultado in resultados] == [nombre for nombre, _ in CONSULTAS_FRECUENTES]
+    sin_indice = {resultado['nombre']: resultado['plan'] for resultado in resultados if not resultado['usa_indice']}
+    assert sin_indice == {}
+
+
+def test_comando_explicar_consultas(app):
+    resultado = app.test_cli_runner().invoke(args=['explicar-consultas'])
+    assert resultado.exit_code == 0, resultado.output
+    assert '❌' not in resultado.output
@@ -0,0 +1,68 @@
+"""Sincronización de cajas: una venta reenviada con la misma clave se registra una sola vez"""
+import threading
+from datetime import date
+
+from app import Ticket, Venta, verificar_saldos_stock
+from conftest import registrar_entrada
+
+
+def _venta(clave, codigo='A001', cantidad=1, tipo='Mayor'):
+    return {
+        'clave': clave,
+        'fecha': date.today().isoformat(),
+        'lineas': [{'codigo': codigo, 'tipo_venta': tipo, 'cantidad': cantidad}]
+    }
+
+
+def test_reenvio_del_lote_queda_como_duplicado(app, client):
+    registrar_entrada(client, 'A001', 5)
+    lote = {'ventas': [_venta('caja1-1'), _venta('caja1-2', cantidad=2)]}
+
+    primera = client.post('/api/sincronizacion/ventas', json=lote).get_json()
+    assert primera['resumen'] == {'registrada': 2}
+    assert primera['stock']['A001']['stock_mayor'] == 2
+
+    segunda = client.post('/api/sincronizacion/ventas', json=lote).get_json()
+    assert segunda['resumen'] == {'duplicada': 2}
+    assert [r['ticket_id'] for r in segunda['resultados']] == [r['ticket_id'] for r in primera['resultados']]
+    assert segunda['stock']['A001']['stock_mayor'] == 2
+    with app.app_context():
+        assert Ticket.query.count() == 2
+        assert Venta.query.count() == 2
+        assert verificar_saldos_stock() == []
+
+
+def test_clave_repetida_en_el_mismo_lote(app, client):
+    registrar_entrada(client, 'A001', 5)
+    resultado = client.post('/api/sincronizacion/ventas', json={
+        'ventas': [_venta('caja1-1'), _venta('caja1-1')]
+    }).get_json()
+    assert [r['estado'] for r in resultado['resultados']] == ['registrada', 'duplicada']
+    assert resultado['resultados'][0]['ticket_id'] == resultado['resultados'][1]['ticket_id']
+    assert resultado['stock']['A001']['stock_mayor'] == 4
+
+
+def test_reenvios_simultaneos_registran_una_vez(app_archivo):
+    registrar_entrada(app_archivo.test_client(), 'A001', 5)
+    envios = 8
+    barrera = threading.Barrier(envios)
+    resultados = []
+
+    def sincronizar():
+        client = app_archivo.test_client()
+        barrera.wait()
+        respuesta = client.post('/api/sincronizacion/ventas', json={'ventas': [_venta('caja2-1')]})
+        resultados.append((respuesta.status_code, respuesta.get_json()['resultados'][0]))
+
+    hilos = [threading.Thread(target=sincronizar) for _ in range(envios)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert {estado for estado, _ in resultados} == {200}
+    assert sorted(r['estado'] for _, r in resultados) == ['duplicada'] * (envios - 1) + ['registrada']
+    assert len({r['ticket_id'] for _, r in resultados}) == 1
+    with app_archivo.app_context():
+        assert Ticket.query.count() == 1
+        assert verificar_saldos_stock() == []
@@ -0,0 +1,64 @@
+"""Cobro de tickets: el stock nunca queda negativo, ni con varias cajas a la vez"""
+import threading
+
+from app import StockProducto, Producto, Venta, db, verificar_saldos_stock
+from conftest import registrar_entrada
+
+
+def _stock(app, codigo):
+    with app.app_context():
+        saldo = db.session.query(StockProducto).join(Producto).filter(Producto.codigo == codigo).one()
+        return saldo.stock_mayor, saldo.stock_unidades
+
+
+def _ticket(codigo, cantidad, tipo='Mayor'):
+    return {'lineas': [{'codigo': codigo, 'tipo_venta': tipo, 'cantidad': cantidad}]}
+
+
+def test_ticket_descuenta_stock(app, client):
+    registrar_entrada(client, 'A001', 4)
+    respuesta = client.post('/api/tickets', json={'lineas': [
+        {'codigo': 'A001', 'tipo_venta': 'Mayor', 'cantidad': 1},
+        {'codigo': 'A001', 'tipo_venta': 'Detal', 'cantidad': 5}
+    ]})
+    assert respuesta.status_code == 201
+    assert respuesta.get_json()['cantidad_lineas'] == 2
+    # La venta al mayor descuenta sacos y la de detal unidades (4 sacos de 25)
+    assert _stock(app, 'A001') == (3, 95)
+
+
+def test_ticket_sin_stock_no_registra_nada(app, client):
+    registrar_entrada(client, 'A001', 1)
+    respuesta = client.post('/api/tickets', json={'lineas': [
+        {'codigo': 'A001', 'tipo_venta': 'Mayor', 'cantidad': 1},
+        {'codigo': 'H001', 'tipo_venta': 'Mayor', 'cantidad': 1}
+    ]})
+    assert respuesta.status_code == 409
+    assert [faltante['codigo'] for faltante in respuesta.get_json()['faltantes']] == ['H001']
+    assert _stock(app, 'A001') == (1, 25)
+    with app.app_context():
+        assert Venta.query.count() == 0
+
+
+def test_cobros_simultaneos_no_venden_de_mas(app_archivo):
+    registrar_entrada(app_archivo.test_client(), 'A001', 10)
+    cajas = 24
+    barrera = threading.Barrier(cajas)
+    estados = []
+
+    def cobrar():
+        client = app_archivo.test_client()
+        barrera.wait()
+        estados.append(client.post('/api/tickets', json=_ticket('A001', 1)).status_code)
+
+    hilos = [threading.Thread(target=cobrar) for _ in range(cajas)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert sorted(estados) == [201] * 10 + [409] * (cajas - 10)
+    assert _stock(app_archivo, 'A001') == (0, 250)
+    with app_archivo.app_context():
+        assert Venta.query.count() == 10
+        assert verificar_saldos_stock() == []
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Punto de entrada para producción
+Antes del primer inicio y después de cada actualización: flask --app wsgi inicializar-db
+Linux:   gunicorn -c gunicorn.conf.py wsgi:app
+Windows: python wsgi.py   (usa waitress)
+"""
+
+import os
+import sys
+
+from app import MENSAJE_ESQUEMA_PENDIENTE, create_app, esquema_actualizado
+
+app = create_app()
+
+if __name__ == '__main__':
+    from waitress import serve
+    
+    with app.app_context():
+        if not esquema_actualizado():
+            sys.exit(MENSAJE_ESQUEMA_PENDIENTE)
+    hilos = int(os.environ.get('MISANGELES_HILOS', 8))
+    # Un hilo más por cada conexión del tablero en vivo, para no quitárselos a las peticiones
+    tablero = app.config['TABLERO_MAX_CLIENTES']
+    print(f"🚀 Sistema de Gestión Mis Angeles en producción ({hilos} hilos + {tablero} para el tablero)")
+    print("📱 Accede a: http://localhost:5000")
+    serve(app, host='0.0.0.0', port=5000, threads=hilos + tablero)